@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import re
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+FLOOD_WAIT_PATTERNS = [re.compile(r"FLOOD_WAIT_(\d+)"), re.compile(r"retry after (\d+)", re.IGNORECASE)]
+
+class RateLimitExceeded(Exception):
+    """Raised when a request can't be admitted before its queueing deadline."""
+
+    def __init__(self, op_class: str, retry_after: float):
+        super().__init__(f"Rate limit exceeded for {op_class}, retry after {retry_after:.1f}s")
+        self.op_class = op_class
+        self.retry_after = retry_after
+
+def parse_flood_wait(error: Dict[str, Any]) -> Optional[int]:
+    """Extract the number of seconds to wait from a TDLib FLOOD_WAIT / 429 error, if it is one."""
+    message = error.get("message", "")
+    for pattern in FLOOD_WAIT_PATTERNS:
+        match = pattern.search(message)
+        if match:
+            return int(match.group(1))
+    if error.get("code") == 429:
+        return 1
+    return None
+
+class TokenBucket:
+    """Token bucket refilled at `rate` tokens per second up to `burst` tokens."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def try_acquire(self) -> float:
+        """Take a token if one is available. Returns 0, or the seconds until the next token."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def refund(self) -> None:
+        """Return a token taken for an operation that was rejected or cancelled before it ran."""
+        self.tokens = min(self.burst, self.tokens + 1)
+
+class SessionLimiter:
+    """Admission control for one session: per operation class concurrency limits and token buckets,
+    plus an account-wide backoff when TDLib reports FLOOD_WAIT."""
+
+    def __init__(self, limits: Dict[str, Dict[str, float]], max_wait: float = 5.0):
+        self.max_wait = {op_class: limit.get("max_wait", max_wait) for op_class, limit in limits.items()}
+        self.buckets = {op_class: TokenBucket(limit["rate"], int(limit["burst"])) for op_class, limit in limits.items()}
+        self.semaphores = {op_class: asyncio.Semaphore(int(limit["concurrency"])) for op_class, limit in limits.items()}
+        self.in_flight = {op_class: 0 for op_class in limits}
+        self.rejected = {op_class: 0 for op_class in limits}
+        self.flood_wait_until = 0.0
+
+    def backoff(self, seconds: float) -> None:
+        """Hold back every operation of the account for `seconds` after a FLOOD_WAIT."""
+        until = time.monotonic() + seconds
+        if until > self.flood_wait_until:
+            logger.warning("TDLib flood wait, backing off for %ss", seconds)
+            self.flood_wait_until = until
+
+    def _reject(self, op_class: str, retry_after: float) -> RateLimitExceeded:
+        self.rejected[op_class] += 1
+        logger.warning("Rejecting %s operation, retry after %.1fs", op_class, retry_after)
+        return RateLimitExceeded(op_class, retry_after)
+
+    @asynccontextmanager
+    async def admit(self, op_class: str, max_wait: Optional[float] = None):
+        """Wait until an operation of `op_class` may run, or raise RateLimitExceeded past the deadline."""
+        deadline = time.monotonic() + (self.max_wait[op_class] if max_wait is None else max_wait)
+
+        flood_wait = self.flood_wait_until - time.monotonic()
+        if flood_wait > 0:
+            if time.monotonic() + flood_wait > deadline:
+                raise self._reject(op_class, flood_wait)
+            await asyncio.sleep(flood_wait)
+
+        bucket = self.buckets[op_class]
+        while True:
+            delay = bucket.try_acquire()
+            if delay == 0:
+                break
+            if time.monotonic() + delay > deadline:
+                raise self._reject(op_class, delay)
+            await asyncio.sleep(delay)
+
+        semaphore = self.semaphores[op_class]
+        if semaphore.locked():
+            try:
+                await asyncio.wait_for(semaphore.acquire(), timeout=max(0.0, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                # The operation never ran, so it mustn't use up the rate budget
+                bucket.refund()
+                raise self._reject(op_class, 1.0)
+            except asyncio.CancelledError:
+                bucket.refund()
+                raise
+        else:
+            await semaphore.acquire()
+        self.in_flight[op_class] += 1
+        try:
+            yield
+        finally:
+            self.in_flight[op_class] -= 1
+            semaphore.release()
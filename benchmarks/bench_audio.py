@@ -0,0 +1,181 @@
+"""Wall time, CPU time and peak RSS of the voice pipeline stages over generated audio fixtures.
+
+Run from the repository root (needs ffmpeg, pydub and numpy, but no network or TDLib):
+
+    python -m benchmarks.bench_audio [--fixture 30:2:48000 ...] [--repeat 3] [--json] [--output results.json]
+                                     [--baseline baseline.json] [--margin 0.25] [--rss-margin 0.5]
+
+A fixture is seconds:channels:sample_rate. Every stage runs in a fresh process, so its peak RSS (including
+the ffmpeg child of the conversions) isn't hidden by an earlier stage's high-water mark. With --baseline,
+the run exits with status 1 if any stage got slower, or bigger, than the baseline by more than the margin.
+"""
+import argparse
+import base64
+import json
+import multiprocessing
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import time
+import wave
+from typing import Any, Dict, List, Tuple
+
+DEFAULT_FIXTURES = ["1:1:16000", "1:2:48000", "30:1:16000", "30:2:48000", "300:1:16000", "300:2:48000"]
+STAGES = ["wav_to_ogg", "ogg_to_wav", "generate_waveform"]
+# The waveform is always num_samples values whatever the recording, so the codec stages run once, over the
+# first fixture's waveform; they take microseconds, so they are timed over many calls
+CODEC_STAGES = ["waveform_encode", "waveform_decode"]
+CODEC_ITERATIONS = 10000
+
+def write_fixture(path: str, seconds: float, channels: int, rate: int) -> None:
+    """Write a WAV of a slow frequency sweep with some noise, loud enough for a meaningful waveform."""
+    import numpy as np
+
+    rng = np.random.default_rng(0)
+    t = np.arange(int(seconds * rate)) / rate
+    signal = 0.6 * np.sin(2 * np.pi * (200 + 50 * np.sin(t)) * t) * (0.5 + 0.5 * np.sin(2 * np.pi * t / 3))
+    signal += 0.05 * rng.standard_normal(len(t))
+    frames = np.repeat((np.clip(signal, -1, 1) * 32767).astype("<i2")[:, None], channels, axis=1)
+    with wave.open(path, "wb") as f:
+        f.setnchannels(channels)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(frames.tobytes())
+
+def usage() -> Tuple[float, float, int]:
+    """CPU seconds of this process and its children, and the larger of their peak RSS in bytes."""
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    scale = 1 if sys.platform == "darwin" else 1024
+    return (own.ru_utime + own.ru_stime, children.ru_utime + children.ru_stime,
+            max(own.ru_maxrss, children.ru_maxrss) * scale)
+
+def run_stage(stage: str, wav_path: str, ogg_path: str, output_dir: str, waveform: List[float]) -> Dict[str, float]:
+    """Run one stage once in this (fresh) process and measure it."""
+    from utils import generate_waveform, convert_oga_to_wav
+
+    encoded = base64.b64encode(bytes([int(x * 31) for x in waveform])).decode("utf-8")
+    own_before, children_before, rss_before = usage()
+    start = time.perf_counter()
+    if stage == "wav_to_ogg":
+        convert_oga_to_wav(wav_path, os.path.join(output_dir, "out.ogg"), reverse=True)
+    elif stage == "ogg_to_wav":
+        convert_oga_to_wav(ogg_path, os.path.join(output_dir, "out.wav"))
+    elif stage == "generate_waveform":
+        if not generate_waveform(wav_path):
+            raise RuntimeError("generate_waveform returned no data")
+    elif stage == "waveform_encode":
+        # Same encoding as TdExample.send_voice_message
+        for _ in range(CODEC_ITERATIONS):
+            base64.b64encode(bytes([int(x * 31) for x in waveform])).decode("utf-8")
+    elif stage == "waveform_decode":
+        # Same decoding as TdExample._fetch_messages
+        for _ in range(CODEC_ITERATIONS):
+            [b / 31.0 for b in base64.b64decode(encoded)]
+    wall = time.perf_counter() - start
+    own_after, children_after, rss_after = usage()
+    calls = CODEC_ITERATIONS if stage.startswith("waveform_") else 1
+    return {
+        "wall_s": wall / calls,
+        "cpu_s": ((own_after - own_before) + (children_after - children_before)) / calls,
+        "peak_rss_mb": rss_after / 1e6,
+        "rss_growth_mb": (rss_after - rss_before) / 1e6,
+    }
+
+def _stage_process(queue, *args) -> None:
+    try:
+        queue.put(run_stage(*args))
+    except Exception as e:
+        queue.put({"error": f"{type(e).__name__}: {e}"})
+
+def measure(stage: str, wav_path: str, ogg_path: str, output_dir: str, waveform: List[float], repeat: int) -> Dict[str, Any]:
+    """Run a stage `repeat` times, each in a new process, and keep the median of every measurement."""
+    context = multiprocessing.get_context("spawn")
+    runs = []
+    for _ in range(repeat):
+        queue = context.Queue()
+        process = context.Process(target=_stage_process, args=(queue, stage, wav_path, ogg_path, output_dir, waveform))
+        process.start()
+        result = queue.get()
+        process.join()
+        if "error" in result:
+            return result
+        runs.append(result)
+    return {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+
+def run(fixtures: List[str], repeat: int) -> List[Dict[str, Any]]:
+    from utils import generate_waveform, convert_oga_to_wav
+
+    results = []
+    waveform = None
+    with tempfile.TemporaryDirectory(prefix="bench_audio_") as workdir:
+        for fixture in fixtures:
+            seconds, channels, rate = fixture.split(":")
+            wav_path = os.path.join(workdir, f"{fixture.replace(':', '_')}.wav")
+            ogg_path = wav_path[:-4] + ".ogg"
+            write_fixture(wav_path, float(seconds), int(channels), int(rate))
+            convert_oga_to_wav(wav_path, ogg_path, reverse=True)
+            for stage in STAGES:
+                results.append({"fixture": fixture, "stage": stage, **measure(stage, wav_path, ogg_path, workdir, [], repeat)})
+            if waveform is None:
+                waveform = generate_waveform(wav_path)
+        for stage in CODEC_STAGES:
+            results.append({"fixture": "codec", "stage": stage, **measure(stage, "", "", workdir, waveform, repeat)})
+    return results
+
+def check_regressions(results: List[Dict[str, Any]], baseline: List[Dict[str, Any]], margin: float,
+                      rss_margin: float) -> List[str]:
+    """Compare against a baseline run, returning a description of every measurement over its margin."""
+    previous = {(item["fixture"], item["stage"]): item for item in baseline}
+    failures = []
+    for item in results:
+        reference = previous.get((item["fixture"], item["stage"]))
+        if reference is None or "error" in reference:
+            continue
+        if "error" in item:
+            failures.append(f"{item['fixture']} {item['stage']}: {item['error']}")
+            continue
+        for key, allowed in (("wall_s", margin), ("cpu_s", margin), ("peak_rss_mb", rss_margin)):
+            if reference[key] > 0 and item[key] > reference[key] * (1 + allowed):
+                failures.append(f"{item['fixture']} {item['stage']}: {key} {item[key]:.6g} vs baseline {reference[key]:.6g} "
+                                f"(+{(item[key] / reference[key] - 1) * 100:.0f}%, allowed +{allowed * 100:.0f}%)")
+    return failures
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--fixture", action="append", default=[], help="seconds:channels:sample_rate (repeatable)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per stage, the median is reported")
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    parser.add_argument("--output", help="also write the results as JSON to this file, e.g. to use as a baseline")
+    parser.add_argument("--baseline", help="results JSON of an earlier run to check for regressions against")
+    parser.add_argument("--margin", type=float, default=0.25, help="allowed wall/CPU time regression, as a fraction")
+    parser.add_argument("--rss-margin", type=float, default=0.5, help="allowed peak RSS regression, as a fraction")
+    args = parser.parse_args()
+
+    results = run(args.fixture or DEFAULT_FIXTURES, args.repeat)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'fixture':<12} {'stage':<18} {'wall ms':>10} {'cpu ms':>10} {'peak RSS MB':>12} {'RSS growth MB':>14}")
+        for r in results:
+            if "error" in r:
+                print(f"{r['fixture']:<12} {r['stage']:<18} {r['error']}")
+                continue
+            print(f"{r['fixture']:<12} {r['stage']:<18} {r['wall_s'] * 1000:>10.3f} {r['cpu_s'] * 1000:>10.3f} "
+                  f"{r['peak_rss_mb']:>12.1f} {r['rss_growth_mb']:>14.1f}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            failures = check_regressions(results, json.load(f), args.margin, args.rss_margin)
+        for failure in failures:
+            print(f"REGRESSION {failure}", file=sys.stderr)
+        if failures:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
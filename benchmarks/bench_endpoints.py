@@ -0,0 +1,142 @@
+"""Throughput and latency of the backend's endpoints against the fake tdjson, without Telegram.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_endpoints [--requests 50] [--concurrency 4] [--endpoint get_messages ...]
+                                         [--latency-scale 1.0] [--http] [--json]
+
+By default the TdExample methods behind each endpoint are called directly; with --http the requests go
+through the FastAPI app (middlewares, caching and encoding included), which needs httpx installed.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+from typing import Any, Awaitable, Callable, Dict, List
+
+os.environ["TDJSON_FAKE"] = "benchmarks.fake_tdjson"
+
+from benchmarks import fake_tdjson
+from config import API_ID, API_HASH
+
+PHONE_NUMBER = "+10000000000"
+FIRST_CHAT_ID = 5000000
+
+def percentile(samples: List[float], q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+def direct_endpoints(client, chats: int) -> Dict[str, Callable[[random.Random], Awaitable[Any]]]:
+    """Requests calling the TdExample methods behind each endpoint."""
+    return {
+        "get_chats": lambda rng: client.get_chats(limit=20, offset=0, phone_number=PHONE_NUMBER),
+        "get_messages": lambda rng: client.get_messages(chat_id=FIRST_CHAT_ID + rng.randrange(chats), limit=50,
+                                                        phone_number=PHONE_NUMBER),
+        "bootstrap": lambda rng: client.get_bootstrap(chat_limit=20, top_chats=5, message_limit=20, phone_number=PHONE_NUMBER),
+        "send_message": lambda rng: client.send_message(chat_id=FIRST_CHAT_ID + rng.randrange(chats), text="benchmark"),
+        "download_file": lambda rng: client.download_file(10000 + 2 * rng.randrange(chats), PHONE_NUMBER, "profile_photo"),
+    }
+
+def http_endpoints(http, chats: int) -> Dict[str, Callable[[random.Random], Awaitable[Any]]]:
+    """Requests going through the FastAPI app."""
+    async def post(path: str, body: Dict[str, Any]) -> Any:
+        response = await http.post(path, json=body)
+        response.raise_for_status()
+        return response
+
+    return {
+        "get_chats": lambda rng: post("/get_chats", {"phone_number": PHONE_NUMBER, "limit": 20}),
+        "get_messages": lambda rng: post("/get_messages", {"phone_number": PHONE_NUMBER, "limit": 50,
+                                                           "chat_id": FIRST_CHAT_ID + rng.randrange(chats)}),
+        "bootstrap": lambda rng: post("/bootstrap", {"phone_number": PHONE_NUMBER}),
+        "send_message": lambda rng: post("/send_message", {"phone_number": PHONE_NUMBER, "message": "benchmark",
+                                                           "chat_id": FIRST_CHAT_ID + rng.randrange(chats)}),
+    }
+
+async def measure(request: Callable[[random.Random], Awaitable[Any]], requests: int, concurrency: int) -> Dict[str, Any]:
+    """Issue `requests` requests from `concurrency` workers and summarize their latencies."""
+    rng = random.Random(0)
+    latencies: List[float] = []
+    errors = 0
+    remaining = iter(range(requests))
+
+    async def worker() -> None:
+        nonlocal errors
+        for _ in remaining:
+            start = time.perf_counter()
+            try:
+                result = await request(rng)
+                if isinstance(result, dict) and result.get("status") == "error":
+                    errors += 1
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "requests_per_s": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "mean_ms": sum(latencies) / len(latencies) * 1000,
+    }
+
+async def run(requests: int, concurrency: int, endpoints: List[str], chats: int, use_http: bool) -> List[Dict[str, Any]]:
+    from td_example import TdExample
+
+    if use_http:
+        import httpx
+        import main
+        session_path = main.get_session_path(PHONE_NUMBER)
+        client = main.clients[session_path] = TdExample(session_path, API_ID, API_HASH)
+        http = httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://bench")
+        available = http_endpoints(http, chats)
+    else:
+        client = TdExample(tempfile.mkdtemp(prefix="bench_session_"), API_ID, API_HASH)
+        available = direct_endpoints(client, chats)
+
+    results = []
+    try:
+        for name in endpoints or list(available):
+            if name not in available:
+                raise SystemExit(f"Unknown endpoint {name}, choose from: {', '.join(available)}")
+            results.append({"endpoint": name, **await measure(available[name], requests, concurrency)})
+    finally:
+        if use_http:
+            await http.aclose()
+    return results
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=50, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--endpoint", action="append", default=[], help="endpoint to run (repeatable, default all)")
+    parser.add_argument("--chats", type=int, default=100, help="chats in the fake account")
+    parser.add_argument("--history", type=int, default=500, help="messages per fake chat")
+    parser.add_argument("--voice-ratio", type=float, default=0.0, help="share of voice notes in the fake data")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="multiplier for the fake TDLib latencies")
+    parser.add_argument("--http", action="store_true", help="go through the FastAPI app instead of TdExample")
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    fake_tdjson.configure(
+        latency={name: value * args.latency_scale for name, value in fake_tdjson.DEFAULT_LATENCY.items()},
+        chats=args.chats, history=args.history, voice_ratio=args.voice_ratio
+    )
+    results = asyncio.run(run(args.requests, args.concurrency, args.endpoint, args.chats, args.http))
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'endpoint':<16} {'requests':>8} {'errors':>7} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'mean ms':>9}")
+    for r in results:
+        print(f"{r['endpoint']:<16} {r['requests']:>8} {r['errors']:>7} {r['requests_per_s']:>9.1f} "
+              f"{r['p50_ms']:>9.1f} {r['p99_ms']:>9.1f} {r['mean_ms']:>9.1f}")
+
+if __name__ == "__main__":
+    main()
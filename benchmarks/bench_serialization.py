@@ -0,0 +1,100 @@
+"""Encode/decode throughput of the stdlib json codec versus the serialization module's codecs.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_serialization [--iterations 2000] [--payload captured.json ...]
+
+By default the payloads are synthetic TDLib "messages"/"chats" objects and API responses from
+benchmarks.payloads; pass --payload to benchmark captured JSON files instead.
+"""
+import argparse
+import json
+import os
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+import serialization
+from benchmarks.payloads import messages_event, chats_page, api_messages_response, api_chats_response
+
+def stdlib_dumps(obj: Any) -> bytes:
+    """The encoding used before the codec layer: json.dumps(...).encode()."""
+    return json.dumps(obj).encode("utf-8")
+
+def stdlib_loads(data: bytes) -> Any:
+    """The decoding used before the codec layer: json.loads(data.decode())."""
+    return json.loads(data.decode("utf-8"))
+
+def measure(func: Callable[[Any], Any], arg: Any, iterations: int) -> float:
+    """Return the mean seconds per call of func(arg)."""
+    func(arg)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func(arg)
+    return (time.perf_counter() - start) / iterations
+
+def codecs() -> List[Tuple[str, Callable[[Any], bytes], Callable[[bytes], Any]]]:
+    """Codecs available in this environment."""
+    available = [("json (stdlib)", stdlib_dumps, stdlib_loads)]
+    if serialization.orjson is not None:
+        available.append(("orjson", serialization.dumps, serialization.loads))
+    if serialization.msgpack is not None:
+        available.append(("msgpack", serialization.encode_msgpack, lambda data: serialization.msgpack.unpackb(data, raw=False)))
+    return available
+
+def load_payloads(paths: List[str]) -> Dict[str, Any]:
+    """Load captured payloads, or build the synthetic ones."""
+    if paths:
+        payloads = {}
+        for path in paths:
+            with open(path, "rb") as f:
+                payloads[os.path.basename(path)] = json.loads(f.read())
+        return payloads
+    return {
+        "tdlib messages (50)": messages_event(count=50),
+        "tdlib messages (100)": messages_event(count=100),
+        "tdlib chats (20)": {"@type": "chats", "chats": chats_page(count=20)},
+        "api get_messages (50)": api_messages_response(count=50),
+        "api get_chats (20)": api_chats_response(count=20),
+    }
+
+def run(iterations: int, paths: List[str]) -> List[Dict[str, Any]]:
+    results = []
+    for name, payload in load_payloads(paths).items():
+        baseline = None
+        for codec_name, encode, decode in codecs():
+            encoded = encode(payload)
+            encode_s = measure(encode, payload, iterations)
+            decode_s = measure(decode, encoded, iterations)
+            if baseline is None:
+                baseline = (encode_s, decode_s)
+            results.append({
+                "payload": name,
+                "codec": codec_name,
+                "bytes": len(encoded),
+                "encode_us": encode_s * 1e6,
+                "decode_us": decode_s * 1e6,
+                "encode_mb_s": len(encoded) / encode_s / 1e6,
+                "decode_mb_s": len(encoded) / decode_s / 1e6,
+                "encode_speedup": baseline[0] / encode_s,
+                "decode_speedup": baseline[1] / decode_s,
+            })
+    return results
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--payload", action="append", default=[], help="captured JSON payload file (repeatable)")
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    results = run(args.iterations, args.payload)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'payload':<24} {'codec':<14} {'bytes':>8} {'enc us':>9} {'dec us':>9} {'enc MB/s':>9} {'dec MB/s':>9} {'enc x':>6} {'dec x':>6}")
+    for r in results:
+        print(f"{r['payload']:<24} {r['codec']:<14} {r['bytes']:>8} {r['encode_us']:>9.1f} {r['decode_us']:>9.1f} "
+              f"{r['encode_mb_s']:>9.1f} {r['decode_mb_s']:>9.1f} {r['encode_speedup']:>6.2f} {r['decode_speedup']:>6.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+"""In-process stand-in for libtdjson, answering the TDLib requests this backend makes from synthetic data.
+
+TdExample loads it instead of the real library when TDJSON_FAKE names this module:
+
+    TDJSON_FAKE=benchmarks.fake_tdjson python -m benchmarks.bench_endpoints
+
+Every response is delivered through td_receive after a per-request latency, so timings include the
+backend's own receive/dispatch overhead. Latencies and data sizes can be set with configure() before the
+first client is created, or with TDJSON_FAKE_LATENCY (a multiplier applied to every latency).
+"""
+import heapq
+import itertools
+import json
+import os
+import random
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from benchmarks.payloads import chats_page, messages_event, tdlib_file, tdlib_message
+
+# Seconds before a response is available from td_receive, by request type
+DEFAULT_LATENCY = {
+    "default": 0.001,
+    "getChats": 0.005,
+    "getChat": 0.002,
+    "getChatHistory": 0.02,
+    "getFile": 0.001,
+    "downloadFile": 0.05,
+    "sendMessage": 0.005,
+    "messageDelivery": 0.1,
+}
+
+# Downloaded files are written with at most this many bytes, whatever size TDLib reports for them
+MAX_FILE_BYTES = 64 * 1024
+
+SETTINGS: Dict[str, Any] = {
+    "latency": dict(DEFAULT_LATENCY),
+    "jitter": 0.2,
+    "chats": 100,
+    "history": 500,
+    "voice_ratio": 0.0,
+    "seed": 1,
+}
+
+def configure(latency: Optional[Dict[str, float]] = None, **settings: Any) -> None:
+    """Override the latency of some request types and/or the synthetic data settings."""
+    if latency:
+        SETTINGS["latency"].update(latency)
+    SETTINGS.update(settings)
+
+class FakeFunction:
+    """Callable standing in for a ctypes function, accepting the restype/argtypes TdExample assigns."""
+
+    def __init__(self, func: Callable[..., Any]):
+        self.func = func
+        self.restype = None
+        self.argtypes = None
+
+    def __call__(self, *args: Any) -> Any:
+        return self.func(*args)
+
+class FakeAccount:
+    """Synthetic chats, histories and files of one fake client."""
+
+    def __init__(self, client_id: int, files_dir: str):
+        self.rng = random.Random(SETTINGS["seed"] + client_id)
+        self.files_dir = files_dir
+        self.files: Dict[int, Dict[str, Any]] = {}
+        self.voice_file_ids = set()
+        self.chats = {chat["id"]: chat for chat in chats_page(count=SETTINGS["chats"], voice_ratio=SETTINGS["voice_ratio"],
+                                                              seed=SETTINGS["seed"] + client_id)}
+        self.histories: Dict[int, List[Dict[str, Any]]] = {}
+        self.message_ids = itertools.count(1 << 45)
+        self.file_ids = itertools.count(1 << 32)
+        self.created = time.time()
+        self.requests = 0
+        for chat in self.chats.values():
+            if chat["photo"]:
+                self.files[chat["photo"]["small"]["id"]] = chat["photo"]["small"]
+                self.files[chat["photo"]["big"]["id"]] = chat["photo"]["big"]
+            self._register_message_files(chat["last_message"])
+
+    def _register_message_files(self, message: Optional[Dict[str, Any]]) -> None:
+        if message and message["content"]["@type"] == "messageVoiceNote":
+            voice = message["content"]["voice_note"]["voice"]
+            self.files[voice["id"]] = voice
+            self.voice_file_ids.add(voice["id"])
+
+    def history(self, chat_id: int) -> List[Dict[str, Any]]:
+        """Return a chat's messages, newest first, generating them on first use."""
+        if chat_id not in self.histories:
+            messages = messages_event(chat_id=chat_id, count=SETTINGS["history"], voice_ratio=SETTINGS["voice_ratio"],
+                                      seed=chat_id)["messages"]
+            for message in messages:
+                self._register_message_files(message)
+            self.histories[chat_id] = messages
+        return self.histories[chat_id]
+
+    def download(self, file_id: int) -> Dict[str, Any]:
+        """Mark a file downloaded, writing placeholder bytes where the real file would be."""
+        file = self.files[file_id]
+        if not file["local"]["is_downloading_completed"]:
+            path = os.path.join(self.files_dir, f"{file_id}.oga" if file_id in self.voice_file_ids else f"{file_id}.jpg")
+            with open(path, "wb") as f:
+                f.write(b"\0" * min(file["size"], MAX_FILE_BYTES))
+            self.files[file_id] = file = tdlib_file(file_id, file["size"], path=path, completed=True)
+        return file
+
+class FakeTdjson:
+    """The tdjson C API (td_create_client_id, td_send, td_receive, td_execute) over synthetic accounts."""
+
+    def __init__(self):
+        self.accounts: Dict[int, FakeAccount] = {}
+        self.client_ids = itertools.count(1)
+        self.pending: List[tuple] = []
+        self.sequence = itertools.count()
+        self.files_dir = tempfile.mkdtemp(prefix="fake_tdjson_")
+        self.td_create_client_id = FakeFunction(self._create_client_id)
+        self.td_send = FakeFunction(self._send)
+        self.td_receive = FakeFunction(self._receive)
+        self.td_execute = FakeFunction(self._execute)
+        self.td_set_log_message_callback = FakeFunction(lambda level, callback: None)
+
+    def _create_client_id(self) -> int:
+        client_id = next(self.client_ids)
+        self.accounts[client_id] = FakeAccount(client_id, self.files_dir)
+        return client_id
+
+    def _latency(self, request_type: str) -> float:
+        latency = SETTINGS["latency"].get(request_type, SETTINGS["latency"]["default"])
+        latency *= float(os.environ.get("TDJSON_FAKE_LATENCY", "1"))
+        return latency * (1 + random.uniform(-SETTINGS["jitter"], SETTINGS["jitter"]))
+
+    def _emit(self, client_id: int, event: Dict[str, Any], delay: float, extra: Any = None) -> None:
+        # Copied, since chats, messages and files are answered straight from the account's state
+        event = dict(event, **{"@client_id": client_id})
+        if extra is not None:
+            event["@extra"] = extra
+        heapq.heappush(self.pending, (time.perf_counter() + delay, next(self.sequence), event))
+
+    def _send(self, client_id: int, request_json: bytes) -> None:
+        request = json.loads(request_json)
+        account = self.accounts.get(client_id)
+        delay = self._latency(request["@type"])
+        if account is None:
+            response = {"@type": "error", "code": 400, "message": "Invalid client identifier"}
+        else:
+            account.requests += 1
+            handler = getattr(self, f"_handle_{request['@type']}", None)
+            response = handler(client_id, account, request, delay) if handler else self._handle_default(request)
+        self._emit(client_id, response, delay, request.get("@extra"))
+
+    def _receive(self, timeout: float) -> Optional[bytes]:
+        # Blocks like the real td_receive does
+        deadline = time.perf_counter() + timeout
+        while True:
+            now = time.perf_counter()
+            if self.pending and self.pending[0][0] <= now:
+                return json.dumps(heapq.heappop(self.pending)[2]).encode("utf-8")
+            wait = deadline - now
+            if self.pending:
+                wait = min(wait, self.pending[0][0] - now)
+            if wait <= 0:
+                return None
+            time.sleep(wait)
+
+    def _execute(self, request_json: bytes) -> bytes:
+        return json.dumps({"@type": "ok"}).encode("utf-8")
+
+    def _handle_default(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        if request["@type"].startswith(("set", "check", "cancel", "load", "register")):
+            return {"@type": "ok"}
+        return {"@type": "error", "code": 400, "message": f"{request['@type']} is not supported by the fake tdjson"}
+
+    def _handle_getAuthorizationState(self, client_id, account, request, delay):
+        return {"@type": "authorizationStateReady"}
+
+    def _handle_close(self, client_id, account, request, delay):
+        self._emit(client_id, {"@type": "updateAuthorizationState",
+                               "authorization_state": {"@type": "authorizationStateClosed"}}, delay * 2)
+        return {"@type": "ok"}
+
+    def _handle_getNetworkStatistics(self, client_id, account, request, delay):
+        return {"@type": "networkStatistics", "since_date": int(account.created), "entries": [
+            {"@type": "networkStatisticsEntryCall", "network_type": {"@type": "networkTypeWiFi"},
+             "sent_bytes": account.requests * 200, "received_bytes": account.requests * 2000, "duration": 0.0}
+        ]}
+
+    def _handle_getStorageStatisticsFast(self, client_id, account, request, delay):
+        return {"@type": "storageStatisticsFast", "files_size": 0, "file_count": len(account.voice_file_ids),
+                "database_size": 0, "language_pack_database_size": 0, "log_size": 0}
+
+    def _handle_getChats(self, client_id, account, request, delay):
+        chats = sorted(account.chats.values(), key=lambda chat: int(chat["positions"][0]["order"]), reverse=True)
+        offset_order = int(request.get("offset_order", str(2 ** 63 - 1)))
+        chat_ids = [chat["id"] for chat in chats if int(chat["positions"][0]["order"]) < offset_order]
+        return {"@type": "chats", "total_count": len(chats), "chat_ids": chat_ids[:request.get("limit", 100)]}
+
+    def _handle_getChat(self, client_id, account, request, delay):
+        chat = account.chats.get(request["chat_id"])
+        if chat is None:
+            return {"@type": "error", "code": 400, "message": "Chat not found"}
+        return chat
+
+    def _handle_getChatHistory(self, client_id, account, request, delay):
+        if request["chat_id"] not in account.chats:
+            return {"@type": "error", "code": 400, "message": "Chat not found"}
+        history = account.history(request["chat_id"])
+        from_message_id = request.get("from_message_id", 0)
+        messages = [message for message in history if not from_message_id or message["id"] < from_message_id]
+        messages = messages[:request.get("limit", 50)]
+        return {"@type": "messages", "total_count": len(history), "messages": messages}
+
+    def _handle_getFile(self, client_id, account, request, delay):
+        file = account.files.get(request["file_id"])
+        if file is None:
+            return {"@type": "error", "code": 404, "message": "File not found"}
+        return file
+
+    def _handle_downloadFile(self, client_id, account, request, delay):
+        if request["file_id"] not in account.files:
+            return {"@type": "error", "code": 404, "message": "File not found"}
+        file = account.download(request["file_id"])
+        self._emit(client_id, {"@type": "updateFile", "file": file}, delay)
+        return file
+
+    def _handle_sendMessage(self, client_id, account, request, delay):
+        chat_id = request["chat_id"]
+        if chat_id not in account.chats:
+            return {"@type": "error", "code": 400, "message": "Chat not found"}
+        content = request["input_message_content"]
+        message = tdlib_message(account.rng, chat_id, next(account.message_ids), int(time.time()))
+        message["is_outgoing"] = True
+        if content["@type"] == "inputMessageVoiceNote":
+            voice = tdlib_file(next(account.file_ids), 20000)
+            account.files[voice["id"]] = voice
+            account.voice_file_ids.add(voice["id"])
+            message["content"] = {
+                "@type": "messageVoiceNote",
+                "voice_note": {"@type": "voiceNote", "duration": content.get("duration", 0),
+                               "waveform": content.get("waveform", ""), "mime_type": "audio/ogg", "voice": voice},
+                "caption": {"@type": "formattedText", "text": "", "entities": []},
+                "is_listened": False
+            }
+        else:
+            message["content"] = {"@type": "messageText", "text": content.get("text", {}), "link_preview": None}
+        pending = dict(message, sending_state={"@type": "messageSendingStatePending", "sending_id": 0})
+
+        sent = dict(message, id=next(account.message_ids))
+        account.history(chat_id).insert(0, sent)
+        account.chats[chat_id]["last_message"] = sent
+        self._emit(client_id, {"@type": "updateMessageSendSucceeded", "message": sent, "old_message_id": message["id"]},
+                   delay + self._latency("messageDelivery"))
+        return pending
+
+_instance: Optional[FakeTdjson] = None
+
+def load() -> FakeTdjson:
+    """Return the process-wide fake library; like libtdjson, all clients share one td_receive queue."""
+    global _instance
+    if _instance is None:
+        _instance = FakeTdjson()
+    return _instance
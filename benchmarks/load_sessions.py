@@ -0,0 +1,190 @@
+"""Multi-account load generator driving the FastAPI app over ASGI, with every session on the fake tdjson.
+
+Run from the repository root (needs httpx):
+
+    python -m benchmarks.load_sessions [--sessions 50] [--concurrency 64] [--duration 30]
+                                       [--mix get_chats=1,get_messages=6,send_message=2,send_voice=1,get_file=4] [--json]
+
+Each session is registered in main.clients the way /authenticate would leave it, so requests exercise the
+real handlers, middlewares, caches and admission limits. Reports throughput and tail latency per operation,
+the status codes seen (429s are admission rejections, not failures) and memory per session.
+"""
+import argparse
+import asyncio
+import hashlib
+import io
+import json
+import os
+import random
+import resource
+import tempfile
+import time
+import tracemalloc
+import wave
+from typing import Any, Awaitable, Callable, Dict, List
+
+os.environ["TDJSON_FAKE"] = "benchmarks.fake_tdjson"
+
+from benchmarks import fake_tdjson
+from benchmarks.bench_endpoints import percentile, FIRST_CHAT_ID
+from config import API_ID, API_HASH
+
+DEFAULT_MIX = "get_chats=1,get_messages=6,send_message=2,send_voice=1,get_file=4"
+SAMPLE_VOICE_NAME = "sample.wav"
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        weights[name.strip()] = float(weight or 1)
+    return weights
+
+def sample_wav(seconds: float = 2.0, rate: int = 16000) -> bytes:
+    """A short mono 16-bit WAV of a sine-ish ramp, standing in for a recorded voice note."""
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(b"".join(((i * 37) % 65536 - 32768).to_bytes(2, "little", signed=True) for i in range(int(seconds * rate))))
+    return buffer.getvalue()
+
+def rss_bytes() -> int:
+    """Current resident set size, falling back to the peak where /proc isn't available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def operations(http, chats: int, voice: bytes) -> Dict[str, Callable[[random.Random, str], Awaitable[Any]]]:
+    """The request mix, each taking a random generator and the session's phone number."""
+    def chat_id(rng: random.Random) -> int:
+        return FIRST_CHAT_ID + rng.randrange(chats)
+
+    return {
+        "get_chats": lambda rng, phone: http.post("/get_chats", json={"phone_number": phone, "limit": 20}),
+        "get_messages": lambda rng, phone: http.post("/get_messages", json={"phone_number": phone, "chat_id": chat_id(rng), "limit": 50}),
+        "send_message": lambda rng, phone: http.post("/send_message", json={"phone_number": phone, "chat_id": chat_id(rng), "message": "load test"}),
+        "send_voice": lambda rng, phone: http.post(
+            "/send_voice_message",
+            files={"file": ("voice.wav", voice, "audio/wav")},
+            data={"request": json.dumps({"phone_number": phone, "chat_id": chat_id(rng), "duration": 2})}
+        ),
+        "get_file": lambda rng, phone: http.get(
+            f"/files/{hashlib.md5(phone.encode()).hexdigest()}/voice/{SAMPLE_VOICE_NAME}", params={"phone_number": phone}
+        ),
+    }
+
+async def run(sessions: int, concurrency: int, duration: float, mix: Dict[str, float], chats: int,
+              trace_memory: bool) -> Dict[str, Any]:
+    import httpx
+    import main
+    from td_example import TdExample
+
+    # Session directories are created relative to the working directory, keep them out of the repository
+    os.chdir(tempfile.mkdtemp(prefix="load_sessions_"))
+    voice = sample_wav()
+    if trace_memory:
+        tracemalloc.start()
+    rss_before = rss_bytes()
+    traced_before = tracemalloc.get_traced_memory()[0] if trace_memory else 0
+
+    phones = [f"+1555{i:07d}" for i in range(sessions)]
+    for phone in phones:
+        session_path = main.get_session_path(phone)
+        main.clients[session_path] = TdExample(session_path, API_ID, API_HASH)
+        with open(os.path.join(session_path, "voice", SAMPLE_VOICE_NAME), "wb") as f:
+            f.write(voice)
+    rss_sessions = rss_bytes()
+
+    http = httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://load", timeout=None)
+    available = operations(http, chats, voice)
+    unknown = set(mix) - set(available)
+    if unknown:
+        raise SystemExit(f"Unknown operations {', '.join(sorted(unknown))}, choose from: {', '.join(available)}")
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    latencies: Dict[str, List[float]] = {name: [] for name in names}
+    statuses: Dict[str, Dict[str, int]] = {name: {} for name in names}
+    deadline = time.perf_counter() + duration
+
+    async def worker(seed: int) -> None:
+        rng = random.Random(seed)
+        while time.perf_counter() < deadline:
+            name = rng.choices(names, weights)[0]
+            start = time.perf_counter()
+            try:
+                response = await available[name](rng, rng.choice(phones))
+                status = str(response.status_code)
+            except Exception as e:
+                status = type(e).__name__
+            latencies[name].append(time.perf_counter() - start)
+            statuses[name][status] = statuses[name].get(status, 0) + 1
+
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*(worker(seed) for seed in range(concurrency)))
+    finally:
+        await http.aclose()
+    elapsed = time.perf_counter() - start
+
+    rss_after = rss_bytes()
+    traced_after = tracemalloc.get_traced_memory()[0] if trace_memory else 0
+    total = sum(len(samples) for samples in latencies.values())
+    return {
+        "sessions": sessions,
+        "concurrency": concurrency,
+        "duration_s": elapsed,
+        "requests": total,
+        "requests_per_s": total / elapsed,
+        "rss_mb_per_session_idle": (rss_sessions - rss_before) / sessions / 1e6,
+        "rss_mb_per_session_loaded": (rss_after - rss_before) / sessions / 1e6,
+        "traced_mb_per_session": (traced_after - traced_before) / sessions / 1e6 if trace_memory else None,
+        "operations": {
+            name: {
+                "requests": len(samples),
+                "requests_per_s": len(samples) / elapsed,
+                "p50_ms": percentile(samples, 0.5) * 1000,
+                "p95_ms": percentile(samples, 0.95) * 1000,
+                "p99_ms": percentile(samples, 0.99) * 1000,
+                "max_ms": max(samples) * 1000,
+                "statuses": statuses[name],
+            }
+            for name, samples in latencies.items() if samples
+        },
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=64, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds to generate load for")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="operation=weight pairs")
+    parser.add_argument("--chats", type=int, default=50, help="chats per fake account")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="multiplier for the fake TDLib latencies")
+    parser.add_argument("--tracemalloc", action="store_true", help="also measure Python heap per session (slower)")
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    fake_tdjson.configure(
+        latency={name: value * args.latency_scale for name, value in fake_tdjson.DEFAULT_LATENCY.items()},
+        chats=args.chats
+    )
+    result = asyncio.run(run(args.sessions, args.concurrency, args.duration, parse_mix(args.mix), args.chats, args.tracemalloc))
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+    print(f"{result['sessions']} sessions, {result['concurrency']} users, {result['duration_s']:.1f}s: "
+          f"{result['requests']} requests, {result['requests_per_s']:.1f} req/s")
+    memory = f"RSS per session: {result['rss_mb_per_session_idle']:.2f} MB idle, {result['rss_mb_per_session_loaded']:.2f} MB loaded"
+    if result["traced_mb_per_session"] is not None:
+        memory += f", Python heap {result['traced_mb_per_session']:.2f} MB"
+    print(memory)
+    print(f"{'operation':<14} {'requests':>8} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}  statuses")
+    for name, stats in result["operations"].items():
+        print(f"{name:<14} {stats['requests']:>8} {stats['requests_per_s']:>8.1f} {stats['p50_ms']:>9.1f} {stats['p95_ms']:>9.1f} "
+              f"{stats['p99_ms']:>9.1f} {stats['max_ms']:>9.1f}  {stats['statuses']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""Synthetic payloads shaped like the TDLib objects and API responses this backend handles."""
+import base64
+import random
+from typing import Any, Dict, List, Optional
+
+WORDS = ["salam", "hello", "chetori", "meeting", "tomorrow", "voice", "ok", "thanks", "khobam", "where", "now", "later"]
+
+def tdlib_file(file_id: int, size: int, path: str = "", completed: bool = False) -> Dict[str, Any]:
+    """Build a TDLib file object."""
+    return {
+        "@type": "file",
+        "id": file_id,
+        "size": size,
+        "expected_size": size,
+        "local": {
+            "@type": "localFile",
+            "path": path,
+            "can_be_downloaded": True,
+            "can_be_deleted": completed,
+            "is_downloading_active": False,
+            "is_downloading_completed": completed,
+            "download_offset": 0,
+            "downloaded_prefix_size": size if completed else 0,
+            "downloaded_size": size if completed else 0
+        },
+        "remote": {
+            "@type": "remoteFile",
+            "id": base64.urlsafe_b64encode(file_id.to_bytes(8, "little") * 6).decode("ascii"),
+            "unique_id": f"AgAD{file_id:08d}",
+            "is_uploading_active": False,
+            "is_uploading_completed": True,
+            "uploaded_size": size
+        }
+    }
+
+def tdlib_message(rng: random.Random, chat_id: int, message_id: int, date: int, voice: bool = False,
+                  voice_file_id: Optional[int] = None) -> Dict[str, Any]:
+    """Build a TDLib message object with a text or voice note content."""
+    if voice:
+        content = {
+            "@type": "messageVoiceNote",
+            "voice_note": {
+                "@type": "voiceNote",
+                "duration": rng.randint(1, 120),
+                "waveform": base64.b64encode(bytes(rng.randrange(32) for _ in range(63))).decode("ascii"),
+                "mime_type": "audio/ogg",
+                "speech_recognition_result": None,
+                "voice": tdlib_file(voice_file_id or message_id, rng.randint(4000, 400000))
+            },
+            "caption": {"@type": "formattedText", "text": "", "entities": []},
+            "is_listened": rng.random() < 0.5
+        }
+    else:
+        text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 30)))
+        content = {
+            "@type": "messageText",
+            "text": {"@type": "formattedText", "text": text, "entities": []},
+            "link_preview": None
+        }
+    is_outgoing = rng.random() < 0.4
+    sender_user_id = 100000 + (0 if is_outgoing else rng.randrange(1000))
+    return {
+        "@type": "message",
+        "id": message_id,
+        "sender_id": {"@type": "messageSenderUser", "user_id": sender_user_id},
+        "chat_id": chat_id,
+        "sending_state": None,
+        "scheduling_state": None,
+        "is_outgoing": is_outgoing,
+        "is_pinned": False,
+        "is_from_offline": False,
+        "can_be_saved": True,
+        "has_timestamped_media": True,
+        "is_channel_post": False,
+        "is_topic_message": False,
+        "contains_unread_mention": False,
+        "date": date,
+        "edit_date": 0,
+        "forward_info": None,
+        "import_info": None,
+        "interaction_info": {
+            "@type": "messageInteractionInfo",
+            "view_count": rng.randrange(500),
+            "forward_count": 0,
+            "reply_info": None,
+            "reactions": None
+        },
+        "unread_reactions": [],
+        "fact_check": None,
+        "reply_to": None,
+        "message_thread_id": 0,
+        "saved_messages_topic_id": 0,
+        "self_destruct_type": None,
+        "self_destruct_in": 0.0,
+        "auto_delete_in": 0.0,
+        "via_bot_user_id": 0,
+        "sender_business_bot_user_id": 0,
+        "sender_boost_count": 0,
+        "author_signature": "",
+        "media_album_id": "0",
+        "effect_id": "0",
+        "restriction_reason": "",
+        "content": content,
+        "reply_markup": None
+    }
+
+def tdlib_chat(rng: random.Random, chat_id: int, order: int, last_message: Optional[Dict[str, Any]],
+               photo_file_id: Optional[int] = None) -> Dict[str, Any]:
+    """Build a TDLib chat object positioned in the main chat list."""
+    photo = None
+    if photo_file_id:
+        photo = {
+            "@type": "chatPhotoInfo",
+            "small": tdlib_file(photo_file_id, rng.randint(5000, 20000)),
+            "big": tdlib_file(photo_file_id + 1, rng.randint(20000, 90000)),
+            "minithumbnail": {
+                "@type": "minithumbnail",
+                "width": 40,
+                "height": 40,
+                "data": base64.b64encode(bytes(rng.randrange(256) for _ in range(300))).decode("ascii")
+            },
+            "has_animation": False,
+            "is_personal": False
+        }
+    return {
+        "@type": "chat",
+        "id": chat_id,
+        "type": {"@type": "chatTypePrivate", "user_id": chat_id},
+        "title": " ".join(rng.choice(WORDS).title() for _ in range(2)),
+        "photo": photo,
+        "accent_color_id": rng.randrange(7),
+        "background_custom_emoji_id": "0",
+        "permissions": {"@type": "chatPermissions", "can_send_basic_messages": True},
+        "last_message": last_message,
+        "positions": [{"@type": "chatPosition", "list": {"@type": "chatListMain"}, "order": str(order), "source": None, "is_pinned": False}],
+        "chat_lists": [{"@type": "chatListMain"}],
+        "message_sender_id": None,
+        "block_list": None,
+        "has_protected_content": False,
+        "is_translatable": False,
+        "is_marked_as_unread": False,
+        "view_as_topics": False,
+        "has_scheduled_messages": False,
+        "can_be_deleted_only_for_self": True,
+        "can_be_deleted_for_all_users": True,
+        "can_be_reported": False,
+        "default_disable_notification": False,
+        "unread_count": rng.randrange(40),
+        "last_read_inbox_message_id": 0,
+        "last_read_outbox_message_id": 0,
+        "unread_mention_count": 0,
+        "unread_reaction_count": 0,
+        "notification_settings": {"@type": "chatNotificationSettings", "use_default_mute_for": True, "mute_for": 0},
+        "available_reactions": {"@type": "chatAvailableReactionsAll", "max_reaction_count": 11},
+        "message_auto_delete_time": 0,
+        "emoji_status": None,
+        "background": None,
+        "theme_name": "",
+        "action_bar": None,
+        "business_bot_manage_bar": None,
+        "video_chat": {"@type": "videoChat", "group_call_id": 0, "has_participants": False, "default_participant_id": None},
+        "pending_join_requests": None,
+        "reply_markup_message_id": 0,
+        "draft_message": None,
+        "client_data": ""
+    }
+
+def messages_event(chat_id: int = 1000, count: int = 50, voice_ratio: float = 0.2, seed: int = 1) -> Dict[str, Any]:
+    """Build a TDLib "messages" response as returned by getChatHistory."""
+    rng = random.Random(seed)
+    base_id = 1 << 30
+    messages = [
+        tdlib_message(rng, chat_id, (base_id - i) << 20, 1700000000 - i * 60, voice=rng.random() < voice_ratio)
+        for i in range(count)
+    ]
+    return {"@type": "messages", "total_count": count, "messages": messages}
+
+def chats_page(count: int = 20, voice_ratio: float = 0.2, seed: int = 2) -> List[Dict[str, Any]]:
+    """Build a page of TDLib chat objects with embedded last messages, newest first."""
+    rng = random.Random(seed)
+    chats = []
+    for i in range(count):
+        chat_id = 5000000 + i
+        last_message = tdlib_message(rng, chat_id, (1 << 40) + i, 1700000000 - i * 300, voice=rng.random() < voice_ratio)
+        chats.append(tdlib_chat(rng, chat_id, (1 << 50) - i, last_message, photo_file_id=10000 + i * 2))
+    return chats
+
+def api_messages_response(count: int = 50, voice_ratio: float = 0.2, seed: int = 3) -> Dict[str, Any]:
+    """Build a /get_messages response body."""
+    rng = random.Random(seed)
+    messages = []
+    for i in range(count):
+        is_voice = rng.random() < voice_ratio
+        messages.append({
+            "id": ((1 << 30) - i) << 20,
+            "chat_id": 1000,
+            "content": "🔈 پیغام صوتی" if is_voice else " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 30))),
+            "is_voice": is_voice,
+            "voice_url": "http://192.168.1.3:8000/files/42aa3780b8b3005ea0842fa524a3d48b/voice/voice_1.wav?phone_number=%2B10000000000" if is_voice else None,
+            "duration": rng.randint(1, 120) if is_voice else 0,
+            "is_outgoing": rng.random() < 0.4,
+            "date": 1700000000 - i * 60,
+            "waveform_data": [rng.randrange(32) / 31.0 for _ in range(63)] if is_voice else None,
+            "status": "success"
+        })
+    return {"messages": messages}
+
+def api_chats_response(count: int = 20, seed: int = 4) -> Dict[str, Any]:
+    """Build a /get_chats response body with raw TDLib last messages, as the default schema returns them."""
+    rng = random.Random(seed)
+    chats = []
+    for i, chat in enumerate(chats_page(count, seed=seed)):
+        chats.append({
+            "id": chat["id"],
+            "title": chat["title"],
+            "last_message": chat["last_message"],
+            "unread_count": chat["unread_count"],
+            "order": chat["positions"][0]["order"],
+            "profile_photo_url": f"http://192.168.1.3:8000/files/42aa3780b8b3005ea0842fa524a3d48b/profile_photo/photo_{i}.jpg?phone_number=%2B10000000000" if rng.random() < 0.8 else None
+        })
+    return {"chats": chats, "version": 42, "epoch": "0123456789ab"}
@@ -0,0 +1,112 @@
+"""Replay a recorded TDLib trace through TdExample's parse and dispatch path and report its throughput.
+
+Record a trace by setting TDLIB_TRACE_DIR in config.py, then run from the repository root:
+
+    python -m benchmarks.replay_trace TRACE.jsonl.gz [--speed 0] [--receivers 1] [--json]
+
+--speed 1 replays at the recorded pace, --speed 10 ten times faster, and --speed 0 (the default) as fast
+as possible. Every recorded account gets its own TdExample over the fake tdjson, and each event is
+re-encoded and then parsed and dispatched exactly as a live event from td_receive would be.
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from typing import Any, Dict, List
+
+os.environ["TDJSON_FAKE"] = "benchmarks.fake_tdjson"
+
+from benchmarks.bench_endpoints import percentile
+from config import API_ID, API_HASH
+from serialization import dumps, loads
+from tdlib_trace import read_trace
+
+async def replay(path: str, speed: float, receivers: int) -> Dict[str, Any]:
+    from td_example import TdExample
+
+    clients: Dict[Any, TdExample] = {}
+    queues: List[asyncio.Queue] = []
+    by_type: Dict[str, List[float]] = {}
+    events = 0
+    queries = 0
+    event_bytes = 0
+    replay_start = time.perf_counter()
+
+    for record in read_trace(path):
+        if record["dir"] == "send":
+            queries += 1
+            continue
+        if speed > 0:
+            delay = record["t"] / speed - (time.perf_counter() - replay_start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+        recorded_client_id = record["client_id"]
+        client = clients.get(recorded_client_id)
+        if client is None:
+            client = clients[recorded_client_id] = TdExample(tempfile.mkdtemp(prefix="replay_session_"), API_ID, API_HASH)
+            for _ in range(receivers):
+                queue: asyncio.Queue = asyncio.Queue()
+                client._receivers.append(queue)
+                queues.append(queue)
+
+        event = dict(record["data"], **{"@client_id": client.client_id})
+        raw = dumps(event)
+        start = time.perf_counter()
+        client._dispatch(loads(raw))
+        elapsed = time.perf_counter() - start
+        by_type.setdefault(event.get("@type", "unknown"), []).append(elapsed)
+        events += 1
+        event_bytes += len(raw)
+        # Stand in for the handlers consuming their queues
+        for queue in queues:
+            while not queue.empty():
+                queue.get_nowait()
+
+    wall = time.perf_counter() - replay_start
+    dispatch_total = sum(sum(samples) for samples in by_type.values())
+    return {
+        "trace": os.path.basename(path),
+        "accounts": len(clients),
+        "queries": queries,
+        "events": events,
+        "event_mb": event_bytes / 1e6,
+        "wall_s": wall,
+        "dispatch_s": dispatch_total,
+        "events_per_s": events / dispatch_total if dispatch_total else 0.0,
+        "chats_cached": sum(len(client.chat_cache) for client in clients.values()),
+        "journal_entries": sum(len(client.update_journal.entries) for client in clients.values()),
+        "by_type": {
+            event_type: {
+                "events": len(samples),
+                "p50_us": percentile(samples, 0.5) * 1e6,
+                "p99_us": percentile(samples, 0.99) * 1e6,
+                "total_ms": sum(samples) * 1000,
+            }
+            for event_type, samples in sorted(by_type.items(), key=lambda item: -sum(item[1]))
+        },
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("trace", help="trace file recorded through TDLIB_TRACE_DIR")
+    parser.add_argument("--speed", type=float, default=0.0, help="replay speed factor, 0 for as fast as possible")
+    parser.add_argument("--receivers", type=int, default=1, help="concurrent receiver queues per account")
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    result = asyncio.run(replay(args.trace, args.speed, args.receivers))
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+    print(f"{result['trace']}: {result['events']} events ({result['event_mb']:.1f} MB), {result['queries']} queries, "
+          f"{result['accounts']} accounts")
+    print(f"parse+dispatch {result['dispatch_s']:.3f}s -> {result['events_per_s']:.0f} events/s, wall {result['wall_s']:.3f}s")
+    print(f"{'event type':<36} {'events':>8} {'p50 us':>9} {'p99 us':>9} {'total ms':>10}")
+    for event_type, stats in result["by_type"].items():
+        print(f"{event_type:<36} {stats['events']:>8} {stats['p50_us']:>9.1f} {stats['p99_us']:>9.1f} {stats['total_ms']:>10.1f}")
+
+if __name__ == "__main__":
+    main()
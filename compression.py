@@ -0,0 +1,156 @@
+import gzip
+import logging
+import time
+from typing import Any, Dict, List, Optional
+from tracing import span
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+COMPRESSIBLE_MEDIA_TYPES = ("application/json", "application/msgpack")
+
+def available_encodings() -> List[str]:
+    """Content encodings supported in this environment, in order of preference."""
+    encodings = []
+    if brotli is not None:
+        encodings.append("br")
+    if zstandard is not None:
+        encodings.append("zstd")
+    encodings.append("gzip")
+    return encodings
+
+def negotiate_encoding(accept_encoding: str, encodings: List[str]) -> Optional[str]:
+    """Pick the preferred supported encoding from an Accept-Encoding header."""
+    accepted = {}
+    for item in accept_encoding.split(","):
+        parts = [part.strip() for part in item.split(";")]
+        if not parts[0]:
+            continue
+        quality = 1.0
+        for param in parts[1:]:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        accepted[parts[0].lower()] = quality
+    for encoding in encodings:
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+def compress(body: bytes, encoding: str, levels: Dict[str, int]) -> bytes:
+    """Compress a response body with the given content encoding."""
+    if encoding == "br":
+        return brotli.compress(body, quality=levels.get("br", 4))
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=levels.get("zstd", 3)).compress(body)
+    return gzip.compress(body, compresslevel=levels.get("gzip", 6))
+
+class CompressionStats:
+    """Per-route compression ratio and CPU cost counters."""
+
+    def __init__(self):
+        self.routes: Dict[str, Dict[str, Any]] = {}
+
+    def record(self, route: str, encoding: Optional[str], bytes_in: int, bytes_out: int, cpu_seconds: float) -> None:
+        stats = self.routes.setdefault(route, {"responses": 0, "compressed": 0, "bytes_in": 0, "bytes_out": 0, "cpu_seconds": 0.0, "encodings": {}})
+        stats["responses"] += 1
+        stats["bytes_in"] += bytes_in
+        stats["bytes_out"] += bytes_out
+        if encoding:
+            stats["compressed"] += 1
+            stats["cpu_seconds"] += cpu_seconds
+            stats["encodings"][encoding] = stats["encodings"].get(encoding, 0) + 1
+
+    def report(self) -> Dict[str, Dict[str, Any]]:
+        """Return the counters with derived compression ratio and mean CPU cost per compressed response."""
+        report = {}
+        for route, stats in self.routes.items():
+            report[route] = {
+                **stats,
+                "encodings": dict(stats["encodings"]),
+                "ratio": stats["bytes_in"] / stats["bytes_out"] if stats["bytes_out"] else 1.0,
+                "cpu_ms_per_response": stats["cpu_seconds"] * 1000 / stats["compressed"] if stats["compressed"] else 0.0
+            }
+        return report
+
+class CompressionMiddleware:
+    """ASGI middleware compressing large JSON/MessagePack responses with a negotiated encoding.
+
+    Streaming responses (e.g. FileResponse for /files media, which is already compressed) are passed through.
+    """
+
+    def __init__(self, app, minimum_size: int = 1024, levels: Optional[Dict[str, int]] = None,
+                 excluded_prefixes: tuple = ("/files/",), stats: Optional[CompressionStats] = None):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.levels = levels or {}
+        self.excluded_prefixes = excluded_prefixes
+        self.encodings = available_encodings()
+        self.stats = stats or CompressionStats()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(self.excluded_prefixes):
+            await self.app(scope, receive, send)
+            return
+        accept_encoding = ""
+        for name, value in scope.get("headers", []):
+            if name == b"accept-encoding":
+                accept_encoding = value.decode("latin-1")
+                break
+        encoding = negotiate_encoding(accept_encoding, self.encodings)
+        start_message = None
+
+        async def send_wrapper(message):
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if start_message is None or message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            # The route template, known once routing ran, so path parameters don't multiply the stats keys
+            route = getattr(scope.get("route"), "path", "unmatched")
+            start, start_message = start_message, None
+            body = message.get("body", b"")
+            headers = [(name, value) for name, value in start.get("headers", [])]
+            header_map = {name.lower(): value for name, value in headers}
+            media_type = header_map.get(b"content-type", b"").decode("latin-1").split(";")[0].strip()
+            if (message.get("more_body", False) or encoding is None or len(body) < self.minimum_size
+                    or media_type not in COMPRESSIBLE_MEDIA_TYPES or b"content-encoding" in header_map):
+                if not message.get("more_body", False):
+                    self.stats.record(route, None, len(body), len(body), 0.0)
+                await send(start)
+                await send(message)
+                return
+
+            cpu_start = time.thread_time()
+            with span("compress", encoding=encoding, bytes_in=len(body)):
+                compressed = compress(body, encoding, self.levels)
+            cpu_seconds = time.thread_time() - cpu_start
+            self.stats.record(route, encoding, len(body), len(compressed), cpu_seconds)
+
+            headers = [(name, value) for name, value in headers if name.lower() not in (b"content-length", b"vary", b"etag")]
+            etag = header_map.get(b"etag")
+            if etag:
+                # The encoded representation is no longer byte-identical to the one the strong ETag describes
+                headers.append((b"etag", etag if etag.startswith(b"W/") else b"W/" + etag))
+            vary = header_map.get(b"vary")
+            headers.append((b"vary", vary + b", Accept-Encoding" if vary else b"Accept-Encoding"))
+            headers.append((b"content-encoding", encoding.encode("latin-1")))
+            headers.append((b"content-length", str(len(compressed)).encode("latin-1")))
+            await send({**start, "headers": headers})
+            await send({**message, "body": compressed})
+
+        await self.app(scope, receive, send_wrapper)
@@ -1,3 +1,84 @@
 API_ID = 855178
 API_HASH = "d4b8d0a8494ab6043f0cfdb1ee6383d3"
-BACKEND_HOST = "http://192.168.1.3:8000"
\ No newline at end of file
+BACKEND_HOST = "http://192.168.1.3:8000"
+
+# Number of pushed updates kept per session for reconnecting clients
+UPDATE_JOURNAL_SIZE = 1000
+
+# Upper bound for how long a /updates long-poll request may be parked
+LONG_POLL_MAX_TIMEOUT = 60.0
+
+# Maximum number of sub-operations accepted by a single /batch request
+BATCH_MAX_OPERATIONS = 20
+
+# Encoded chat/message pages kept for repeated polls, and how long one may be served without a rebuild
+RESPONSE_CACHE_SIZE = 256
+RESPONSE_CACHE_TTL = 30.0
+
+# Responses smaller than this are sent uncompressed; levels are per content encoding
+COMPRESSION_MIN_SIZE = 1024
+COMPRESSION_LEVELS = {"br": 4, "zstd": 3, "gzip": 6}
+
+# Per-session admission control in front of TDLib, per operation class: token bucket rate/burst,
+# concurrent operations, and how long a request may queue before it is rejected with 429
+ADMISSION_LIMITS = {
+    "read": {"rate": 5.0, "burst": 10, "concurrency": 4},
+    "send": {"rate": 1.0, "burst": 5, "concurrency": 2},
+    "download": {"rate": 20.0, "burst": 40, "concurrency": 8, "max_wait": 30.0},
+}
+ADMISSION_MAX_WAIT = 5.0
+
+# Idempotency keys remembered for retried sends, and for how long (seconds)
+IDEMPOTENCY_MAX_KEYS = 10000
+IDEMPOTENCY_TTL = 600.0
+
+# Sent messages whose delivery status is kept per session
+SEND_STATUS_SIZE = 1000
+
+# Broadcasts: chats per broadcast, finished broadcasts kept for progress queries,
+# and how long to wait for the shared media upload (seconds)
+BROADCAST_MAX_CHATS = 500
+BROADCAST_HISTORY = 100
+BROADCAST_UPLOAD_TIMEOUT = 120.0
+
+# Background prefetch of the next message page: cached pages per session, their lifetime (seconds),
+# and the delay before the prefetch starts (seconds)
+PREFETCH_CACHE_PAGES = 50
+PREFETCH_CACHE_TTL = 300.0
+PREFETCH_DELAY = 0.2
+
+# Directory to record scrubbed TDLib queries and events to (gzip JSON lines) for replay; None disables recording
+TDLIB_TRACE_DIR = None
+
+# Request tracing: JSONL file and/or OTLP/HTTP endpoint (e.g. "http://localhost:4318/v1/traces") to export
+# spans to, None to disable either; requests slower than the threshold (seconds) log their span tree
+TRACE_JSONL_PATH = None
+TRACE_OTLP_ENDPOINT = None
+TRACE_SLOW_REQUEST_SECONDS = 5.0
+
+# Event loop monitor: sampling interval and stall threshold (seconds); debug mode captures stack samples of
+# whatever blocked the loop and lists them at /debug/loop_stalls (which requires ADMIN_TOKEN)
+LOOP_MONITOR_INTERVAL = 0.1
+LOOP_BLOCK_THRESHOLD = 0.1
+LOOP_MONITOR_DEBUG = False
+
+# Logging goes through a bounded queue to a background writer; below WARNING, categories (logger name
+# prefixes) can be sampled (fraction kept) and rate limited (records per second)
+LOG_LEVEL = "INFO"
+LOG_JSON = False
+LOG_QUEUE_SIZE = 10000
+LOG_SAMPLE_RATES = {"td_example.events": 0.1}
+LOG_RATE_LIMITS = {"td_example.queries": 20, "td_example.events": 20}
+
+# TDLib's own log file, which TDLib rotates (keeping one .old file) once it reaches the maximum size in bytes
+TDLIB_LOG_PATH = "logs/tdlib.log"
+TDLIB_LOG_MAX_SIZE = 10 * 1024 * 1024
+TDLIB_LOG_VERBOSITY = 1
+
+# Token required in the X-Admin-Token header of /admin endpoints; None disables them
+ADMIN_TOKEN = None
+
+# Open TDLib clients at most, and how long (seconds) a session may sit idle before its client is closed;
+# closed sessions keep their warm caches on disk and are reopened on their next request
+SESSION_POOL_MAX_LIVE = 100
+SESSION_IDLE_TIMEOUT = 900.0
@@ -0,0 +1,64 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Optional
+from fastapi import HTTPException, Request
+
+logger = logging.getLogger(__name__)
+
+DEADLINE_HEADER = "x-request-deadline"
+DISCONNECT_POLL_INTERVAL = 0.25
+
+def request_deadline(request: Request) -> Optional[float]:
+    """Return the request's deadline as a loop time, from the optional X-Request-Deadline header.
+
+    The header is either a number of seconds from now (e.g. "5" or "2.5"),
+    or an absolute Unix timestamp in seconds or milliseconds.
+    """
+    value = request.headers.get(DEADLINE_HEADER)
+    if not value:
+        return None
+    try:
+        deadline = float(value)
+    except ValueError:
+        logger.warning("Ignoring invalid %s header: %s", DEADLINE_HEADER, value)
+        return None
+    if deadline > 1e12:
+        deadline = deadline / 1000 - time.time()
+    elif deadline > 1e9:
+        deadline = deadline - time.time()
+    return asyncio.get_event_loop().time() + deadline
+
+async def run_cancellable(request: Request, work: Awaitable[Any]) -> Any:
+    """Run handler work as a task and cancel it when the client disconnects or the request deadline passes.
+
+    Cancellation propagates into the pending TDLib waits and download tasks of the work.
+    """
+    loop = asyncio.get_event_loop()
+    deadline = request_deadline(request)
+    task = asyncio.ensure_future(work)
+    try:
+        while True:
+            timeout = DISCONNECT_POLL_INTERVAL
+            if deadline is not None:
+                timeout = min(timeout, max(0.0, deadline - loop.time()))
+            done, _ = await asyncio.wait({task}, timeout=timeout)
+            if done:
+                return task.result()
+            if deadline is not None and loop.time() >= deadline:
+                logger.warning("Request deadline exceeded for %s, cancelling its work", request.url.path)
+                raise HTTPException(status_code=504, detail="Request deadline exceeded")
+            if await request.is_disconnected():
+                logger.warning("Client disconnected from %s, cancelling its work", request.url.path)
+                raise HTTPException(status_code=499, detail="Client closed request")
+    finally:
+        if not task.done():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                # The work's own cancellation is expected, but not this task being cancelled meanwhile
+                if asyncio.current_task().cancelling():
+                    raise
+            except Exception:
+                pass
@@ -0,0 +1,90 @@
+import os
+import resource
+import sys
+import threading
+import tracemalloc
+from collections import deque
+from typing import Any, Dict, Optional
+
+_CONTAINERS = (dict, list, tuple, set, frozenset, deque)
+
+def approx_size(obj: Any) -> int:
+    """Approximate bytes held by a structure of built-in containers, counting shared objects once."""
+    seen = set()
+    total = 0
+    stack = [obj]
+    while stack:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        total += sys.getsizeof(item)
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, _CONTAINERS):
+            stack.extend(item)
+    return total
+
+def process_memory() -> Dict[str, float]:
+    """Current and peak resident set size of this process in MB."""
+    scale = 1 if sys.platform == "darwin" else 1024
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    try:
+        with open("/proc/self/statm") as f:
+            current = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        current = peak
+    return {"rss_mb": current / 1e6, "peak_rss_mb": peak / 1e6}
+
+class TracemallocSnapshots:
+    """On-demand tracemalloc snapshots, each compared to the previous one to show where memory grew.
+
+    Tracing starts with the first snapshot and slows allocations down until stop() is called. Calls are
+    serialized, as they run in the threadpool and each one replaces the previous snapshot.
+    """
+
+    def __init__(self):
+        self.previous: Optional[tracemalloc.Snapshot] = None
+        self._lock = threading.Lock()
+
+    def snapshot(self, limit: int = 25, group_by: str = "lineno", frames: int = 1) -> Dict[str, Any]:
+        with self._lock:
+            return self._snapshot(limit, group_by, frames)
+
+    def _snapshot(self, limit: int, group_by: str, frames: int) -> Dict[str, Any]:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+            self.previous = None
+        current = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        ])
+        traced, peak = tracemalloc.get_traced_memory()
+        result: Dict[str, Any] = {
+            "traced_mb": traced / 1e6,
+            "traced_peak_mb": peak / 1e6,
+            "frames": tracemalloc.get_traceback_limit(),
+            "first_snapshot": self.previous is None,
+        }
+        if self.previous is None:
+            stats = current.statistics(group_by)[:limit]
+            result["top"] = [
+                {"traceback": [str(frame) for frame in stat.traceback], "size_kb": stat.size / 1e3, "count": stat.count}
+                for stat in stats
+            ]
+        else:
+            stats = current.compare_to(self.previous, group_by)[:limit]
+            result["top"] = [
+                {"traceback": [str(frame) for frame in stat.traceback], "size_kb": stat.size / 1e3, "size_diff_kb": stat.size_diff / 1e3,
+                 "count": stat.count, "count_diff": stat.count_diff}
+                for stat in stats
+            ]
+        self.previous = current
+        return result
+
+    def stop(self) -> None:
+        with self._lock:
+            tracemalloc.stop()
+            self.previous = None
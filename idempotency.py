@@ -0,0 +1,62 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Tuple
+
+logger = logging.getLogger(__name__)
+
+class IdempotencyKeyReused(Exception):
+    """Raised when an idempotency key is reused for a different request."""
+
+class IdempotencyStore:
+    """Bounded TTL store mapping an idempotency key to the outcome of, or the in-flight future for, a request."""
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 600.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries: "OrderedDict[tuple, dict]" = OrderedDict()
+
+    def _evict(self) -> None:
+        """Drop expired completed entries from the oldest end, and the oldest ones beyond the size bound."""
+        now = time.monotonic()
+        while self.entries:
+            key, entry = next(iter(self.entries.items()))
+            expired = entry["future"].done() and now - entry["created"] > self.ttl
+            if not expired and len(self.entries) <= self.max_entries:
+                break
+            del self.entries[key]
+
+    async def run(self, key: tuple, fingerprint: Any, work: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Run `work` once per key. Returns its result and whether it was replayed from an earlier request.
+
+        Requests that fail with an exception (raised before the send, e.g. rate limited or invalid input) or
+        with a definitive error result (e.g. TDLib rejecting the message) are forgotten, so they can be retried
+        under the same key. An error marked `unconfirmed` (a timeout after TDLib got the message, which may have
+        been sent) is kept and replayed, so a retry can't send a duplicate.
+        """
+        self._evict()
+        entry = self.entries.get(key)
+        if entry is not None:
+            if entry["fingerprint"] != fingerprint:
+                raise IdempotencyKeyReused(f"Idempotency key {key[-1]} was already used for a different request")
+            logger.info("Replaying outcome for idempotency key %s", key[-1])
+            return await asyncio.shield(entry["future"]), True
+
+        future = asyncio.get_event_loop().create_future()
+        self.entries[key] = {"fingerprint": fingerprint, "future": future, "created": time.monotonic()}
+        try:
+            result = await work()
+        except BaseException as e:
+            self.entries.pop(key, None)
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                # Mark the exception as retrieved when no retry is waiting on it
+                future.exception()
+            raise
+        if isinstance(result, dict) and result.get("status") == "error" and not result.get("unconfirmed"):
+            self.entries.pop(key, None)
+        future.set_result(result)
+        return result, False
@@ -0,0 +1,142 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import threading
+import time
+from typing import Any, Dict, Optional
+
+# Attributes every LogRecord has; anything else was passed through `extra=` and is a structured field
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "suppressed"}
+
+class CategoryFilter(logging.Filter):
+    """Samples and rate limits records below WARNING per category.
+
+    A category is a logger name prefix, e.g. "td_example.events" also covers "td_example.events.files".
+    Sample rates are the fraction of records kept, rate limits the records per second let through; the
+    number of records a rate limit dropped is attached to the next record of that category.
+    """
+
+    def __init__(self, sample_rates: Optional[Dict[str, float]] = None, rate_limits: Optional[Dict[str, float]] = None):
+        super().__init__()
+        self.sample_rates = sample_rates or {}
+        self.rate_limits = rate_limits or {}
+        self._categories: Dict[str, Optional[str]] = {}
+        self._windows: Dict[str, list] = {}
+        self._suppressed: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _category(self, name: str) -> Optional[str]:
+        if name not in self._categories:
+            prefix = name
+            while prefix and prefix not in self.sample_rates and prefix not in self.rate_limits:
+                prefix = prefix.rpartition(".")[0]
+            self._categories[name] = prefix or None
+        return self._categories[name]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        category = self._category(record.name)
+        if category is None:
+            return True
+        rate = self.sample_rates.get(category)
+        if rate is not None and random.random() >= rate:
+            return False
+        limit = self.rate_limits.get(category)
+        if limit is None:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(category)
+            if window is None or now - window[0] >= 1.0:
+                window = self._windows[category] = [now, 0]
+            if window[1] >= limit:
+                self._suppressed[category] = self._suppressed.get(category, 0) + 1
+                return False
+            window[1] += 1
+            suppressed = self._suppressed.pop(category, 0)
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the writer thread unformatted, so the caller never pays for formatting.
+
+    Arguments are formatted later on the writer thread, so they must not be mutated after the log call.
+    When the queue is full records are dropped instead of blocking the event loop.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if self.dropped:
+            record.suppressed = getattr(record, "suppressed", 0) + self.dropped
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+        else:
+            self.dropped = 0
+
+class StructuredFormatter(logging.Formatter):
+    """Formats records as text with their `extra=` fields appended as key=value, or as one JSON object per line."""
+
+    def __init__(self, json_output: bool = False):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+        self.json_output = json_output
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES}
+        suppressed = getattr(record, "suppressed", 0)
+        if self.json_output:
+            entry: Dict[str, Any] = {
+                "time": record.created,
+                "level": record.levelname,
+                "logger": record.name,
+                "message": record.getMessage(),
+                **fields
+            }
+            if suppressed:
+                entry["suppressed"] = suppressed
+            if record.exc_info:
+                entry["exception"] = self.formatException(record.exc_info)
+            return json.dumps(entry, ensure_ascii=False, default=str)
+        text = super().format(record)
+        if fields:
+            text += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        if suppressed:
+            text += f" ({suppressed} earlier records suppressed)"
+        return text
+
+def _stop_listener(listener: logging.handlers.QueueListener) -> None:
+    # QueueListener.stop fails when the listener was already stopped
+    if listener._thread is not None:
+        listener.stop()
+
+def configure_logging(level: str = "INFO", json_output: bool = False, queue_size: int = 10000,
+                      sample_rates: Optional[Dict[str, float]] = None,
+                      rate_limits: Optional[Dict[str, float]] = None) -> logging.handlers.QueueListener:
+    """Route all logging through a bounded queue to a background writer thread, replacing the root handlers.
+
+    The writer is flushed and stopped at interpreter exit.
+    """
+    log_queue: queue.Queue = queue.Queue(queue_size)
+    handler = LazyQueueHandler(log_queue)
+    handler.addFilter(CategoryFilter(sample_rates, rate_limits))
+    writer = logging.StreamHandler()
+    writer.setFormatter(StructuredFormatter(json_output))
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level)
+    listener = logging.handlers.QueueListener(log_queue, writer, respect_handler_level=True)
+    listener.start()
+    atexit.register(_stop_listener, listener)
+    return listener
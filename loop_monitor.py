@@ -0,0 +1,126 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+import weakref
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+from metrics import EVENT_LOOP_LAG_SECONDS, EVENT_LOOP_STALLS
+
+logger = logging.getLogger(__name__)
+
+# HTTP scope of the request being served. Tasks the handler starts (run_cancellable, gather, downloads,
+# prefetches) inherit it with their context, and the task factory records it per task, so the watchdog thread,
+# which can't read another thread's context, can attribute a stall to the route of the running task
+_request_scope: ContextVar[Optional[Dict[str, Any]]] = ContextVar("request_scope", default=None)
+_task_scopes: "weakref.WeakKeyDictionary[asyncio.Task, Dict[str, Any]]" = weakref.WeakKeyDictionary()
+
+def _scope_recording_factory(previous_factory):
+    def factory(loop, coro, **kwargs):
+        task = previous_factory(loop, coro, **kwargs) if previous_factory else asyncio.Task(coro, loop=loop, **kwargs)
+        context = kwargs.get("context")
+        scope = context.get(_request_scope) if context is not None else _request_scope.get()
+        if scope is not None:
+            _task_scopes[task] = scope
+        return task
+    return factory
+
+def _route_of(scope: Optional[Dict[str, Any]]) -> str:
+    if scope is None:
+        return "background"
+    route = scope.get("route")
+    return getattr(route, "path", scope.get("path", "unknown"))
+
+class LoopMonitor:
+    """Samples event loop scheduling delay into a histogram.
+
+    In debug mode a watchdog thread also captures the loop thread's stack whenever the loop has not
+    run for `block_threshold` seconds, and attributes the stall to the route of the running task.
+    """
+
+    def __init__(self, interval: float = 0.1, block_threshold: float = 0.1, debug: bool = False, max_stalls: int = 200):
+        self.interval = interval
+        self.block_threshold = block_threshold
+        self.debug = debug
+        self.stalls: deque = deque(maxlen=max_stalls)
+        self.heartbeat = time.perf_counter()
+        self._pending_stalls: deque = deque()
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._stopped = threading.Event()
+
+    def start(self) -> None:
+        self._loop = asyncio.get_event_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._task = asyncio.ensure_future(self._sample())
+        if self.debug:
+            self._loop.set_task_factory(_scope_recording_factory(self._loop.get_task_factory()))
+            threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+        logger.info("Loop monitor started (interval=%ss, debug=%s)", self.interval, self.debug)
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _sample(self) -> None:
+        while True:
+            expected = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.perf_counter()
+            self.heartbeat = now
+            EVENT_LOOP_LAG_SECONDS.observe(max(0.0, now - expected))
+            # Stalls are recorded by the watchdog thread, metrics are only updated from the loop
+            while self._pending_stalls:
+                EVENT_LOOP_STALLS.inc(self._pending_stalls.popleft()["route"])
+
+    def _watch(self) -> None:
+        stall = None
+        while not self._stopped.wait(self.block_threshold / 2):
+            blocked_for = time.perf_counter() - self.heartbeat - self.interval
+            if blocked_for < self.block_threshold:
+                if stall is not None:
+                    logger.warning("Event loop blocked for %.3fs in %s:\n%s", stall['blocked_s'], stall['route'], stall['samples'][0])
+                stall = None
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            sample = "".join(traceback.format_stack(frame))
+            if stall is None:
+                task = asyncio.current_task(self._loop)
+                stall = {"time": time.time(), "route": _route_of(_task_scopes.get(task) if task else None),
+                         "task": task.get_name() if task else None, "blocked_s": blocked_for, "samples": [sample]}
+                self.stalls.append(stall)
+                self._pending_stalls.append(stall)
+            else:
+                stall["blocked_s"] = blocked_for
+                if len(stall["samples"]) < 5 and sample != stall["samples"][-1]:
+                    stall["samples"].append(sample)
+
+    def report(self) -> List[Dict[str, Any]]:
+        """Return the recent stalls, newest first."""
+        return [dict(stall, samples=list(stall["samples"])) for stall in reversed(self.stalls)]
+
+class LoopMonitorMiddleware:
+    """ASGI middleware recording which request the handler and the tasks it starts serve, for stall attribution."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        task = asyncio.current_task()
+        if task is not None:
+            _task_scopes[task] = scope
+        token = _request_scope.set(scope)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _request_scope.reset(token)
@@ -1,23 +1,41 @@
 import uvicorn
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Query, Response
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Header, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
-from models import AuthRequest, SessionRequest, MessageRequest, SendMessageRequest, SendVoiceMessageRequest, GetChatsRequest
+from models import AuthRequest, SessionRequest, MessageRequest, SendMessageRequest, SendVoiceMessageRequest, BroadcastRequest, CloseChatRequest, GetChatsRequest, ChatChangesRequest, BootstrapRequest, BatchRequest, BatchOperation
 from td_example import TdExample
-from config import API_ID, API_HASH
-from typing import Dict
+from admission import RateLimitExceeded
+from deadlines import run_cancellable
+from idempotency import IdempotencyStore, IdempotencyKeyReused
+from outbox import Broadcast, Outbox
+from responses import ResponseCache, shape, compact_chat, compact_message, etag_matches
+from serialization import NegotiatedResponse, NegotiationMiddleware, dumps_text, wants_msgpack
+from compression import CompressionMiddleware, CompressionStats
+from tracing import Tracer, TracingMiddleware, JsonlSpanExporter, OtlpHttpSpanExporter
+from loop_monitor import LoopMonitor, LoopMonitorMiddleware
+from log_queue import configure_logging
+from diagnostics import TracemallocSnapshots, process_memory
+from session_pool import SessionPool
+from metrics import REGISTRY, MetricsMiddleware, CACHE_LOOKUPS, ACTIVE_SESSIONS, WEBSOCKET_CONNECTIONS, TDLIB_RECEIVER_QUEUE_DEPTH
+from websocket_utils import websocket_connections, wait_for_disconnect
+from config import API_ID, API_HASH, LONG_POLL_MAX_TIMEOUT, BATCH_MAX_OPERATIONS, RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL, COMPRESSION_MIN_SIZE, COMPRESSION_LEVELS, IDEMPOTENCY_MAX_KEYS, IDEMPOTENCY_TTL, BROADCAST_MAX_CHATS, BROADCAST_HISTORY, BROADCAST_UPLOAD_TIMEOUT, TRACE_JSONL_PATH, TRACE_OTLP_ENDPOINT, TRACE_SLOW_REQUEST_SECONDS, \
+    LOOP_MONITOR_INTERVAL, LOOP_BLOCK_THRESHOLD, LOOP_MONITOR_DEBUG, LOG_LEVEL, LOG_JSON, LOG_QUEUE_SIZE, LOG_SAMPLE_RATES, LOG_RATE_LIMITS, ADMIN_TOKEN, \
+    SESSION_POOL_MAX_LIVE, SESSION_IDLE_TIMEOUT
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
 import json
 import logging
 import hashlib
+import hmac
 import os
 import time
 import asyncio
 
 # Configure logging
-logging.basicConfig(level=logging.INFO)
+configure_logging(LOG_LEVEL, json_output=LOG_JSON, queue_size=LOG_QUEUE_SIZE, sample_rates=LOG_SAMPLE_RATES, rate_limits=LOG_RATE_LIMITS)
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+app = FastAPI(default_response_class=NegotiatedResponse)
+compression_stats = CompressionStats()
 
 # Add CORS middleware
 app.add_middleware(
@@ -27,8 +45,48 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-
-clients: Dict[str, TdExample] = {}
+app.add_middleware(NegotiationMiddleware)
+app.add_middleware(CompressionMiddleware, minimum_size=COMPRESSION_MIN_SIZE, levels=COMPRESSION_LEVELS, stats=compression_stats)
+app.add_middleware(MetricsMiddleware)
+
+span_exporters = []
+if TRACE_JSONL_PATH:
+    span_exporters.append(JsonlSpanExporter(TRACE_JSONL_PATH))
+if TRACE_OTLP_ENDPOINT:
+    span_exporters.append(OtlpHttpSpanExporter(TRACE_OTLP_ENDPOINT))
+app.add_middleware(TracingMiddleware, tracer=Tracer(span_exporters, slow_threshold=TRACE_SLOW_REQUEST_SECONDS))
+app.add_middleware(LoopMonitorMiddleware)
+
+loop_monitor = LoopMonitor(interval=LOOP_MONITOR_INTERVAL, block_threshold=LOOP_BLOCK_THRESHOLD, debug=LOOP_MONITOR_DEBUG)
+
+@app.on_event("startup")
+async def start_loop_monitor():
+    loop_monitor.start()
+
+@app.on_event("shutdown")
+async def stop_loop_monitor():
+    loop_monitor.stop()
+
+@app.on_event("startup")
+async def start_session_pool():
+    clients.start()
+
+@app.on_event("shutdown")
+async def close_session_pool():
+    await clients.close()
+
+@app.exception_handler(RateLimitExceeded)
+async def rate_limit_exceeded_handler(request: Request, exc: RateLimitExceeded):
+    """Reject requests that could not be admitted in time with 429 and a Retry-After hint."""
+    retry_after = max(1, int(exc.retry_after + 0.999))
+    return JSONResponse(status_code=429, content={"detail": str(exc)}, headers={"Retry-After": str(retry_after)})
+
+clients = SessionPool(lambda session_path: TdExample(session_path=session_path, api_id=API_ID, api_hash=API_HASH),
+                      max_live=SESSION_POOL_MAX_LIVE, idle_timeout=SESSION_IDLE_TIMEOUT)
+response_cache = ResponseCache(max_entries=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL)
+idempotency_store = IdempotencyStore(max_entries=IDEMPOTENCY_MAX_KEYS, ttl=IDEMPOTENCY_TTL)
+outbox = Outbox(max_broadcasts=BROADCAST_HISTORY)
+tracemalloc_snapshots = TracemallocSnapshots()
 
 def get_session_path(phone_number: str) -> str:
     """Generate session path from phone number."""
@@ -38,113 +96,303 @@ def get_session_path(phone_number: str) -> str:
     session_id = hashlib.md5(phone_number.encode()).hexdigest()
     return os.path.join("sessions", session_id)
 
+def resolve_session_file(phone_number: str, file_type: str, file_name: str) -> tuple:
+    """Resolve a served file to its path in the session's directory and its media type."""
+    valid_file_types = {"voice": "voice", "profile_photo": "profile_photos", "profile_photos": "profile_photos"}
+    if file_type not in valid_file_types:
+        logger.error("Invalid file type: %s", file_type)
+        raise HTTPException(status_code=400, detail="Invalid file type")
+
+    session_path = get_session_path(phone_number)
+    file_path = os.path.join(session_path, valid_file_types[file_type], os.path.basename(file_name))
+    if not os.path.exists(file_path):
+        logger.error("File not found: %s", file_path)
+        raise HTTPException(status_code=404, detail="File not found")
+
+    media_type = "audio/wav" if valid_file_types[file_type] == "voice" else "image/jpeg"
+    return file_path, media_type
+
+async def cached_response(http_request: Request, client: TdExample, endpoint: str, params: Dict[str, Any],
+                          build: Callable[[], Awaitable[Tuple[Any, bool]]]) -> Response:
+    """Serve an encoded page from the response cache, rebuilding it only when the session's updates moved on.
+
+    `build` returns the page and whether it is complete. Incomplete pages (e.g. empty after a TDLib timeout, or
+    with media whose download failed or wasn't admitted) are served uncached, so a retry rebuilds them.
+    """
+    await client.drain_updates()
+    journal = client.update_journal
+    params_key = json.dumps(params, sort_keys=True)
+    key = (client.session_path, endpoint, params_key, wants_msgpack(), journal.epoch, journal.last_seq)
+    entry = response_cache.get(key)
+    CACHE_LOOKUPS.inc("response", "miss" if entry is None else "hit")
+    if entry is None:
+        page, complete = await run_cancellable(http_request, build())
+        rendered = NegotiatedResponse(page)
+        if not complete:
+            logger.info("Not caching incomplete %s page for %s", endpoint, client.session_path)
+            return Response(content=rendered.body, media_type=rendered.media_type, headers={"Cache-Control": "no-store"})
+        # Keyed by the journal position before the build: an update received while building bumps last_seq,
+        # so the next request misses instead of being served a page that may predate the update
+        entry = response_cache.put(key, rendered.body, rendered.media_type)
+    else:
+        logger.info("Serving cached %s page for %s", endpoint, client.session_path)
+
+    headers = {"ETag": entry["etag"], "Cache-Control": "no-cache"}
+    if etag_matches(http_request.headers.get("if-none-match"), entry["etag"]):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry["body"], media_type=entry["media_type"], headers=headers)
+
+async def run_idempotent(response: Response, session_path: str, endpoint: str, key: Optional[str],
+                         fingerprint: Any, work: Callable[[], Awaitable[Any]]) -> Any:
+    """Run a send at most once per idempotency key, replaying the original outcome to retries."""
+    if not key:
+        return await work()
+    try:
+        result, replayed = await idempotency_store.run((session_path, endpoint, key), fingerprint, work)
+    except IdempotencyKeyReused as e:
+        logger.error(str(e))
+        raise HTTPException(status_code=422, detail=str(e))
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return result
+
 @app.post("/check_session")
 async def check_session(request: SessionRequest):
     """Check if a session exists and is authenticated."""
-    logger.info(f"Checking session for phone: {request.phone_number}")
+    logger.info("Checking session for phone: %s", request.phone_number)
     session_path = get_session_path(request.phone_number)
-    logger.info(f"Session path: {session_path}")
+    logger.info("Session path: %s", session_path)
     if not os.path.exists(session_path):
-        logger.info(f"No session found at {session_path}")
+        logger.info("No session found at %s", session_path)
         return {"is_authenticated": False, "auth_state": "no_session"}
 
-    client = clients.get(session_path)
-    logger.info(f"Client exists: {client is not None}, client_id: {client.client_id if client else 'None'}")
-    if not client or client.client_id == 0:
-        logger.info(f"Creating new client for session: {session_path}")
-        client = TdExample(session_path=session_path, api_id=API_ID, api_hash=API_HASH)
-        clients[session_path] = client
-        logger.info(f"New client created with client_id: {client.client_id}")
-
-    result = await client.check_session()
-    logger.info(f"Session check result: {result}")
-    if result["auth_state"] in ["unknown", "authorizationStateClosed"]:
-        logger.info(f"Invalid session, destroying client and creating new one for {session_path}")
-        client.destroy_client()
-        del clients[session_path]
-        client = TdExample(session_path=session_path, api_id=API_ID, api_hash=API_HASH)
-        clients[session_path] = client
-        logger.info(f"New client created with client_id: {client.client_id}")
+    async with clients.use(session_path, create=True) as client:
+        logger.info("Using client_id: %s", client.client_id)
         result = await client.check_session()
-    return result
+        logger.info("Session check result: %s", result)
+        if result["auth_state"] in ["unknown", "authorizationStateClosed"]:
+            logger.info("Invalid session, destroying client and creating new one for %s", session_path)
+            await client.close()
+            clients.pop(session_path, None)
+            client = clients.create(session_path)
+            logger.info("New client created with client_id: %s", client.client_id)
+            result = await client.check_session()
+        return result
 
 @app.post("/authenticate")
 async def authenticate(request: AuthRequest):
     """Authenticate a client with provided credentials."""
-    logger.info(f"Authentication request: phone={request.phone_number}, code={request.code}")
+    logger.info("Authentication request: phone=%s, code=%s", request.phone_number, request.code)
     session_path = get_session_path(request.phone_number)
-    logger.info(f"Session path: {session_path}")
+    logger.info("Session path: %s", session_path)
     
-    client = clients.get(session_path)
-    logger.info(f"Client exists: {client is not None}, client_id: {client.client_id if client else 'None'}")
-    if not client or client.client_id == 0:
-        logger.info(f"Creating new client for authentication: {session_path}")
-        client = TdExample(session_path=session_path, api_id=API_ID, api_hash=API_HASH)
-        clients[session_path] = client
-        logger.info(f"New client created with client_id: {client.client_id}")
-
-    result = await client.authenticate(
-        phone_number=request.phone_number,
-        code=request.code,
-        password=request.password,
-        first_name=request.first_name,
-        last_name=request.last_name,
-        email=request.email,
-        email_code=request.email_code
-    )
-    logger.info(f"Authentication result: {result}")
-    return result
+    async with clients.use(session_path, create=True) as client:
+        logger.info("Using client_id: %s", client.client_id)
+        result = await client.authenticate(
+            phone_number=request.phone_number,
+            code=request.code,
+            password=request.password,
+            first_name=request.first_name,
+            last_name=request.last_name,
+            email=request.email,
+            email_code=request.email_code
+        )
+        logger.info("Authentication result: %s", result)
+        return result
 
 @app.post("/get_chats")
-async def get_chats(request: GetChatsRequest):
+async def get_chats(request: GetChatsRequest, http_request: Request):
     """Retrieve a list of chats for a given phone number."""
-    logger.info(f"Get chats request: phone={request.phone_number}, limit={request.limit}, offset={request.offset}")
+    logger.info("Get chats request: phone=%s, limit=%s, offset=%s", request.phone_number, request.limit, request.offset)
     session_path = get_session_path(request.phone_number)
-    client = clients.get(session_path)
-    if not client or client.client_id == 0:
-        logger.error(f"No valid client found for phone: {request.phone_number}")
-        raise HTTPException(status_code=401, detail="Client not authenticated")
-
-    chats = await client.get_chats(
-        limit=request.limit,
-        offset=request.offset,
-        phone_number=request.phone_number
-    )
-    return {"chats": chats}
+    async with clients.use(session_path) as client:
+        if not client or client.client_id == 0:
+            logger.error("No valid client found for phone: %s", request.phone_number)
+            raise HTTPException(status_code=401, detail="Client not authenticated")
+
+        async def build() -> Tuple[Dict[str, Any], bool]:
+            async with client.limiter.admit("read"):
+                chats = await client.get_chats(
+                    limit=request.limit,
+                    offset=request.offset,
+                    phone_number=request.phone_number
+                )
+            complete = bool(chats) and not client.unresolved_media(chats=chats)
+            chats = shape(chats, compact_chat, compact=request.compact, fields=request.fields)
+            return {"chats": chats, "version": client.chat_list_versions.version, "epoch": client.chat_list_versions.epoch}, complete
+
+        params = {"limit": request.limit, "offset": request.offset, "compact": request.compact, "fields": request.fields}
+        return await cached_response(http_request, client, "get_chats", params, build)
+
+@app.post("/get_chat_changes")
+async def get_chat_changes(request: ChatChangesRequest):
+    """Retrieve only the chats that changed, and the ones removed, since a chat list version."""
+    logger.info("Get chat changes request: phone=%s, since_version=%s", request.phone_number, request.since_version)
+    session_path = get_session_path(request.phone_number)
+    async with clients.use(session_path) as client:
+        if not client or client.client_id == 0:
+            logger.error("No valid client found for phone: %s", request.phone_number)
+            raise HTTPException(status_code=401, detail="Client not authenticated")
+
+        changes = await client.get_chat_changes(since_version=request.since_version, epoch=request.epoch,
+                                                phone_number=request.phone_number)
+        changes["chats"] = shape(changes["chats"], compact_chat, compact=request.compact, fields=request.fields)
+        return changes
 
 @app.post("/get_messages")
-async def get_messages(request: MessageRequest):
+async def get_messages(request: MessageRequest, http_request: Request):
     """Retrieve messages from a specific chat."""
-    logger.info(f"Get messages request: phone={request.phone_number}, chat_id={request.chat_id}")
+    logger.info("Get messages request: phone=%s, chat_id=%s", request.phone_number, request.chat_id)
     session_path = get_session_path(request.phone_number)
-    client = clients.get(session_path)
-    if not client or client.client_id == 0:
-        logger.error(f"No valid client found for phone: {request.phone_number}")
-        raise HTTPException(status_code=401, detail="Client not authenticated")
-
-    messages = await client.get_messages(
-        chat_id=request.chat_id,
-        limit=request.limit,
-        from_message_id=request.from_message_id,
-        phone_number=request.phone_number
-    )
-    return {"messages": messages}
+    async with clients.use(session_path) as client:
+        if not client or client.client_id == 0:
+            logger.error("No valid client found for phone: %s", request.phone_number)
+            raise HTTPException(status_code=401, detail="Client not authenticated")
+
+        async def build() -> Tuple[Dict[str, Any], bool]:
+            async with client.limiter.admit("read"):
+                messages = await client.get_messages(
+                    chat_id=request.chat_id,
+                    limit=request.limit,
+                    from_message_id=request.from_message_id,
+                    phone_number=request.phone_number,
+                    prefetch=True
+                )
+            complete = bool(messages) and not client.unresolved_media(messages=messages)
+            messages = shape(messages, compact_message, compact=request.compact, fields=request.fields)
+            return {"messages": messages}, complete
+
+        params = {
+            "chat_id": request.chat_id,
+            "limit": request.limit,
+            "from_message_id": request.from_message_id,
+            "compact": request.compact,
+            "fields": request.fields
+        }
+        return await cached_response(http_request, client, "get_messages", params, build)
+
+@app.post("/close_chat")
+async def close_chat(request: CloseChatRequest):
+    """Tell the backend the user left a chat, so its background page prefetch is cancelled."""
+    logger.info("Close chat request: phone=%s, chat_id=%s", request.phone_number, request.chat_id)
+    session_path = get_session_path(request.phone_number)
+    async with clients.use(session_path) as client:
+        if not client or client.client_id == 0:
+            logger.error("No valid client found for phone: %s", request.phone_number)
+            raise HTTPException(status_code=401, detail="Client not authenticated")
+
+        client.cancel_prefetch(request.chat_id)
+        return {"status": "success"}
+
+@app.post("/bootstrap")
+async def bootstrap(request: BootstrapRequest, http_request: Request):
+    """Retrieve everything needed for the app's first paint: chats, avatar previews and the top chats' messages."""
+    logger.info("Bootstrap request: phone=%s, chat_limit=%s, top_chats=%s", request.phone_number, request.chat_limit, request.top_chats)
+    session_path = get_session_path(request.phone_number)
+    async with clients.use(session_path) as client:
+        if not client or client.client_id == 0:
+            logger.error("No valid client found for phone: %s", request.phone_number)
+            raise HTTPException(status_code=401, detail="Client not authenticated")
+
+        async def build() -> Dict[str, Any]:
+            async with client.limiter.admit("read"):
+                return await client.get_bootstrap(
+                    chat_limit=request.chat_limit,
+                    top_chats=request.top_chats,
+                    message_limit=request.message_limit,
+                    phone_number=request.phone_number
+                )
+
+        result = await run_cancellable(http_request, build())
+        if request.compact:
+            result["chats"] = shape(result["chats"], compact_chat, compact=True)
+            result["messages"] = {chat_id: shape(page, compact_message, compact=True) for chat_id, page in result["messages"].items()}
+        return result
+
+async def run_batch_operation(client: TdExample, phone_number: str, operation: BatchOperation) -> Dict[str, Any]:
+    """Execute a single /batch sub-operation against the session's client."""
+    params = operation.params
+    if operation.op == "get_chats":
+        async with client.limiter.admit("read"):
+            chats = await client.get_chats(
+                limit=params.get("limit", 20),
+                offset=params.get("offset", 0),
+                phone_number=phone_number
+            )
+        chats = shape(chats, compact_chat, compact=params.get("compact", False), fields=params.get("fields"))
+        return {"chats": chats, "version": client.chat_list_versions.version, "epoch": client.chat_list_versions.epoch}
+    if operation.op == "get_messages":
+        if "chat_id" not in params:
+            raise HTTPException(status_code=422, detail="Missing required field: chat_id")
+        async with client.limiter.admit("read"):
+            messages = await client.get_messages(
+                chat_id=params["chat_id"],
+                limit=params.get("limit", 50),
+                from_message_id=params.get("from_message_id", 0),
+                phone_number=phone_number
+            )
+        messages = shape(messages, compact_message, compact=params.get("compact", False), fields=params.get("fields"))
+        return {"messages": messages}
+    if operation.op == "get_chat_changes":
+        changes = await client.get_chat_changes(since_version=params.get("since_version", 0), epoch=params.get("epoch"),
+                                                phone_number=phone_number)
+        changes["chats"] = shape(changes["chats"], compact_chat, compact=params.get("compact", False), fields=params.get("fields"))
+        return changes
+    if operation.op == "file_info":
+        file_path, media_type = resolve_session_file(phone_number, params.get("file_type", ""), params.get("file_name", ""))
+        return {"media_type": media_type, "size": os.path.getsize(file_path)}
+    raise HTTPException(status_code=400, detail=f"Unknown operation: {operation.op}")
+
+@app.post("/batch")
+async def batch(request: BatchRequest, http_request: Request):
+    """Execute several read operations for one phone number concurrently in a single round trip."""
+    logger.info("Batch request: phone=%s, operations=%s", request.phone_number, [operation.op for operation in request.operations])
+    if len(request.operations) > BATCH_MAX_OPERATIONS:
+        raise HTTPException(status_code=422, detail=f"At most {BATCH_MAX_OPERATIONS} operations per batch")
+    session_path = get_session_path(request.phone_number)
+    async with clients.use(session_path) as client:
+        if not client or client.client_id == 0:
+            logger.error("No valid client found for phone: %s", request.phone_number)
+            raise HTTPException(status_code=401, detail="Client not authenticated")
+
+        results = await run_cancellable(http_request, asyncio.gather(
+            *(run_batch_operation(client, request.phone_number, operation) for operation in request.operations),
+            return_exceptions=True
+        ))
+        responses = []
+        for operation, result in zip(request.operations, results):
+            if isinstance(result, HTTPException):
+                responses.append({"id": operation.id, "op": operation.op, "status_code": result.status_code, "error": result.detail})
+            elif isinstance(result, RateLimitExceeded):
+                responses.append({"id": operation.id, "op": operation.op, "status_code": 429, "error": str(result), "retry_after": result.retry_after})
+            elif isinstance(result, Exception):
+                logger.error("Batch operation %s failed: %s", operation.op, result)
+                responses.append({"id": operation.id, "op": operation.op, "status_code": 500, "error": str(result)})
+            else:
+                responses.append({"id": operation.id, "op": operation.op, "status_code": 200, "result": result})
+        return {"results": responses}
 
 @app.post("/send_message")
-async def send_message(request: SendMessageRequest):
+async def send_message(request: SendMessageRequest, response: Response, idempotency_key: Optional[str] = Header(None)):
     """Send a text message to a specific chat."""
-    logger.info(f"Send message request: phone={request.phone_number}, chat_id={request.chat_id}")
+    logger.info("Send message request: phone=%s, chat_id=%s", request.phone_number, request.chat_id)
     session_path = get_session_path(request.phone_number)
-    client = clients.get(session_path)
-    if not client or client.client_id == 0:
-        logger.error(f"No valid client found for phone: {request.phone_number}")
-        raise HTTPException(status_code=401, detail="Client not authenticated")
+    async with clients.use(session_path) as client:
+        if not client or client.client_id == 0:
+            logger.error("No valid client found for phone: %s", request.phone_number)
+            raise HTTPException(status_code=401, detail="Client not authenticated")
 
-    result = await client.send_message(chat_id=request.chat_id, text=request.message)
-    return result
+        async def send() -> Dict[str, Any]:
+            async with client.limiter.admit("send"):
+                return await client.send_message(chat_id=request.chat_id, text=request.message)
+
+        key = request.idempotency_key or idempotency_key
+        fingerprint = (request.chat_id, hashlib.sha1(request.message.encode()).hexdigest())
+        return await run_idempotent(response, session_path, "send_message", key, fingerprint, send)
 
 @app.post("/send_voice_message")
-async def send_voice_message(file: UploadFile = File(...), request: str = Form(...)):
+async def send_voice_message(response: Response, file: UploadFile = File(...), request: str = Form(...),
+                             idempotency_key: Optional[str] = Header(None)):
     """Send a voice message to a specific chat."""
     logger.info("Send voice message request received")
     try:
@@ -158,64 +406,170 @@ async def send_voice_message(file: UploadFile = File(...), request: str = Form(.
             raise HTTPException(status_code=422, detail="Missing required fields: phone_number, chat_id, duration")
 
         session_path = get_session_path(phone_number)
-        client = clients.get(session_path)
-        if not client or client.client_id == 0:
-            logger.error(f"No valid client found for phone: {phone_number}")
-            raise HTTPException(status_code=401, detail="Client not authenticated")
+        async with clients.use(session_path) as client:
+            if not client or client.client_id == 0:
+                logger.error("No valid client found for phone: %s", phone_number)
+                raise HTTPException(status_code=401, detail="Client not authenticated")
 
-        session_id = hashlib.md5(phone_number.encode()).hexdigest()
-        voice_dir = os.path.join(session_path, "voice")
-        os.makedirs(voice_dir, exist_ok=True)
-        voice_path = os.path.join(voice_dir, f"voice_{int(time.time() * 1000)}.wav")
-
-        with open(voice_path, "wb") as f:
             content = await file.read()
-            f.write(content)
-        logger.info(f"Saved uploaded voice file to: {voice_path}")
-
-        with open(voice_path, 'rb') as f:
-            header = f.read(4)
-            if header != b'RIFF':
-                logger.error(f"Uploaded file is not WAV: {voice_path}")
-                os.remove(voice_path)
-                raise HTTPException(status_code=422, detail="File must be WAV")
-
-        result = await client.send_voice_message(
-            chat_id=chat_id,
-            voice_path=voice_path,
-            duration=duration,
-            phone_number=phone_number
-        )
-        return result
+
+            async def send() -> Dict[str, Any]:
+                voice_dir = os.path.join(session_path, "voice")
+                os.makedirs(voice_dir, exist_ok=True)
+                voice_path = os.path.join(voice_dir, f"voice_{int(time.time() * 1000)}.wav")
+
+                with open(voice_path, "wb") as f:
+                    f.write(content)
+                logger.info("Saved uploaded voice file to: %s", voice_path)
+
+                with open(voice_path, 'rb') as f:
+                    header = f.read(4)
+                    if header != b'RIFF':
+                        logger.error("Uploaded file is not WAV: %s", voice_path)
+                        os.remove(voice_path)
+                        raise HTTPException(status_code=422, detail="File must be WAV")
+
+                async with client.limiter.admit("send"):
+                    return await client.send_voice_message(
+                        chat_id=chat_id,
+                        voice_path=voice_path,
+                        duration=duration,
+                        phone_number=phone_number
+                    )
+
+            # Checked before the upload is saved, so a retried voice note isn't converted or uploaded twice
+            key = request_data.get("idempotency_key") or idempotency_key
+            fingerprint = (chat_id, duration, hashlib.sha1(content).hexdigest())
+            return await run_idempotent(response, session_path, "send_voice_message", key, fingerprint, send)
 
     except json.JSONDecodeError:
         logger.error("Invalid JSON in send_voice_message request")
         raise HTTPException(status_code=422, detail="Invalid JSON in request")
+    except (HTTPException, RateLimitExceeded):
+        raise
     except Exception as e:
-        logger.error(f"Error processing send_voice_message: {str(e)}")
+        logger.error("Error processing send_voice_message: %s", str(e))
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
+def validate_broadcast_chats(chat_ids: list) -> None:
+    """Reject broadcasts without target chats or with more than BROADCAST_MAX_CHATS of them."""
+    if not chat_ids:
+        raise HTTPException(status_code=422, detail="chat_ids must not be empty")
+    if len(chat_ids) > BROADCAST_MAX_CHATS:
+        raise HTTPException(status_code=422, detail=f"A broadcast can target at most {BROADCAST_MAX_CHATS} chats")
+
+@app.post("/broadcast")
+async def broadcast_message(request: BroadcastRequest):
+    """Queue a text message for many chats; delivery is paced in the background."""
+    logger.info("Broadcast request: phone=%s, chats=%s", request.phone_number, len(request.chat_ids))
+    validate_broadcast_chats(request.chat_ids)
+    session_path = get_session_path(request.phone_number)
+    async with clients.use(session_path) as client:
+        if not client or client.client_id == 0:
+            logger.error("No valid client found for phone: %s", request.phone_number)
+            raise HTTPException(status_code=401, detail="Client not authenticated")
+
+        content = {
+            "@type": "inputMessageText",
+            "text": {"@type": "formattedText", "text": request.message}
+        }
+        broadcast = outbox.start(Broadcast(client, request.chat_ids, content, upload_timeout=BROADCAST_UPLOAD_TIMEOUT))
+        return broadcast.progress()
+
+@app.post("/broadcast_voice")
+async def broadcast_voice_message(file: UploadFile = File(...), request: str = Form(...)):
+    """Queue a voice note for many chats. It is encoded and uploaded once, then reused for every chat."""
+    logger.info("Broadcast voice request received")
+    try:
+        request_data = json.loads(request)
+    except json.JSONDecodeError:
+        logger.error("Invalid JSON in broadcast_voice request")
+        raise HTTPException(status_code=422, detail="Invalid JSON in request")
+    phone_number = request_data.get("phone_number")
+    chat_ids = request_data.get("chat_ids")
+    duration = request_data.get("duration")
+    if not phone_number or not isinstance(chat_ids, list) or duration is None:
+        logger.error("Missing required fields in broadcast_voice request")
+        raise HTTPException(status_code=422, detail="Missing required fields: phone_number, chat_ids, duration")
+    validate_broadcast_chats(chat_ids)
+
+    session_path = get_session_path(phone_number)
+    async with clients.use(session_path) as client:
+        if not client or client.client_id == 0:
+            logger.error("No valid client found for phone: %s", phone_number)
+            raise HTTPException(status_code=401, detail="Client not authenticated")
+
+        voice_dir = os.path.join(session_path, "voice")
+        os.makedirs(voice_dir, exist_ok=True)
+        voice_path = os.path.join(voice_dir, f"broadcast_{int(time.time() * 1000)}.wav")
+        content = await file.read()
+        if content[:4] != b'RIFF':
+            logger.error("Uploaded broadcast voice file is not WAV")
+            raise HTTPException(status_code=422, detail="File must be WAV")
+        with open(voice_path, "wb") as f:
+            f.write(content)
+
+        try:
+            voice_note = await client.prepare_voice_note(voice_path, duration)
+        except Exception as e:
+            logger.error("Error encoding broadcast voice note: %s", e)
+            raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+        finally:
+            # Only the encoded OGG is uploaded, the WAV isn't needed once the waveform is extracted
+            os.remove(voice_path)
+        broadcast = outbox.start(Broadcast(client, chat_ids, voice_note, upload_timeout=BROADCAST_UPLOAD_TIMEOUT,
+                                           cleanup_paths=[voice_note["voice_note"]["path"]]))
+        return broadcast.progress()
+
+@app.get("/broadcast/{broadcast_id}")
+async def get_broadcast(broadcast_id: str, phone_number: str = Query(...)):
+    """Report the progress of a broadcast."""
+    session_path = get_session_path(phone_number)
+    async with clients.use(session_path) as client:
+        if not client or client.client_id == 0:
+            logger.error("No valid client found for phone: %s", phone_number)
+            raise HTTPException(status_code=401, detail="Client not authenticated")
+
+        await client.drain_updates()
+        broadcast = outbox.get(session_path, broadcast_id)
+        if broadcast is None:
+            raise HTTPException(status_code=404, detail="Unknown broadcast")
+        return broadcast.progress()
+
+@app.delete("/broadcast/{broadcast_id}")
+async def cancel_broadcast(broadcast_id: str, phone_number: str = Query(...)):
+    """Stop a broadcast. Messages already handed to TDLib are still delivered."""
+    broadcast = outbox.cancel(get_session_path(phone_number), broadcast_id)
+    if broadcast is None:
+        raise HTTPException(status_code=404, detail="Unknown broadcast")
+    await asyncio.sleep(0)
+    return broadcast.progress()
+
+@app.get("/send_status")
+async def get_send_status(phone_number: str = Query(...), chat_id: int = Query(...), message_id: int = Query(...)):
+    """Report the delivery state of a sent message by the temporary id /send_message returned."""
+    session_path = get_session_path(phone_number)
+    async with clients.use(session_path) as client:
+        if not client or client.client_id == 0:
+            logger.error("No valid client found for phone: %s", phone_number)
+            raise HTTPException(status_code=401, detail="Client not authenticated")
+
+        await client.drain_updates()
+        status = client.get_send_status(chat_id, message_id)
+        if status is None:
+            raise HTTPException(status_code=404, detail="Unknown message")
+        return status
+
 @app.get("/files/{session_id}/{file_type}/{file_name}")
 async def get_file(session_id: str, file_type: str, file_name: str, phone_number: str = Query(...)):
     """Serve a file from the session's directory."""
-    logger.info(f"File request: session_id={session_id}, file_type={file_type}, file_name={file_name}, phone_number={phone_number}")
+    logger.info("File request: session_id=%s, file_type=%s, file_name=%s, phone_number=%s", session_id, file_type, file_name, phone_number)
     expected_session_id = hashlib.md5(phone_number.encode()).hexdigest()
     if session_id != expected_session_id:
-        logger.error(f"Session ID mismatch: {session_id} != {expected_session_id}")
+        logger.error("Session ID mismatch: %s != %s", session_id, expected_session_id)
         raise HTTPException(status_code=403, detail="Invalid session ID")
 
-    valid_file_types = {"voice": "voice", "profile_photo": "profile_photos", "profile_photos": "profile_photos"}
-    if file_type not in valid_file_types:
-        logger.error(f"Invalid file type: {file_type}")
-        raise HTTPException(status_code=400, detail="Invalid file type")
-
-    session_path = get_session_path(phone_number)
-    file_path = os.path.join(session_path, valid_file_types[file_type], file_name)
-    if not os.path.exists(file_path):
-        logger.error(f"File not found: {file_path}")
-        raise HTTPException(status_code=404, detail="File not found")
-
-    media_type = "audio/wav" if valid_file_types[file_type] == "voice" else "image/jpeg"
+    file_path, media_type = resolve_session_file(phone_number, file_type, file_name)
     return FileResponse(
         file_path,
         media_type=media_type,
@@ -225,25 +579,14 @@ async def get_file(session_id: str, file_type: str, file_name: str, phone_number
 @app.head("/files/{session_id}/{file_type}/{file_name}")
 async def head_file(session_id: str, file_type: str, file_name: str, phone_number: str = Query(...)):
     """Handle HEAD request for a file."""
-    logger.info(f"HEAD request: session_id={session_id}, file_type={file_type}, file_name={file_name}, phone_number={phone_number}")
+    logger.info("HEAD request: session_id=%s, file_type=%s, file_name=%s, phone_number=%s", session_id, file_type, file_name, phone_number)
     expected_session_id = hashlib.md5(phone_number.encode()).hexdigest()
     if session_id != expected_session_id:
-        logger.error(f"Session ID mismatch: {session_id} != {expected_session_id}")
+        logger.error("Session ID mismatch: %s != %s", session_id, expected_session_id)
         raise HTTPException(status_code=403, detail="Invalid session ID")
 
-    valid_file_types = {"voice": "voice", "profile_photo": "profile_photos", "profile_photos": "profile_photos"}
-    if file_type not in valid_file_types:
-        logger.error(f"Invalid file type: {file_type}")
-        raise HTTPException(status_code=400, detail="Invalid file type")
-
-    session_path = get_session_path(phone_number)
-    file_path = os.path.join(session_path, valid_file_types[file_type], file_name)
-    if not os.path.exists(file_path):
-        logger.error(f"File not found: {file_path}")
-        raise HTTPException(status_code=404, detail="File not found")
-
+    file_path, media_type = resolve_session_file(phone_number, file_type, file_name)
     file_size = os.path.getsize(file_path)
-    media_type = "audio/wav" if valid_file_types[file_type] == "voice" else "image/jpeg"
     return Response(
         headers={
             "Content-Type": media_type,
@@ -253,5 +596,165 @@ async def head_file(session_id: str, file_type: str, file_name: str, phone_numbe
         status_code=200
     )
 
+@app.get("/updates")
+async def get_updates(phone_number: str = Query(...), since: int = Query(0), timeout: float = Query(25.0), epoch: Optional[str] = Query(None)):
+    """Long-poll the session's update stream for clients that can't hold a WebSocket."""
+    logger.info("Updates request: phone=%s, since=%s, timeout=%s", phone_number, since, timeout)
+    session_path = get_session_path(phone_number)
+    async with clients.use(session_path) as client:
+        if not client or client.client_id == 0:
+            logger.error("No valid client found for phone: %s", phone_number)
+            raise HTTPException(status_code=401, detail="Client not authenticated")
+
+        journal = client.update_journal
+        timeout = min(max(timeout, 0.0), LONG_POLL_MAX_TIMEOUT)
+        result = journal.since(since, epoch)
+        if result["resync_required"] or result["updates"] or timeout == 0:
+            return result
+
+        client.subscribe_updates()
+        try:
+            await journal.wait(since, timeout=timeout)
+        finally:
+            client.unsubscribe_updates()
+            # The poll was activity until it returned, so the idle time counts from here
+            client.touch()
+        return journal.since(since, epoch)
+
+@app.get("/metrics")
+async def get_metrics():
+    """Expose TDLib, HTTP, cache and media pipeline metrics in the Prometheus text format."""
+    ACTIVE_SESSIONS.set(len(clients))
+    WEBSOCKET_CONNECTIONS.set(sum(len(connections) for connections in websocket_connections.values()))
+    TDLIB_RECEIVER_QUEUE_DEPTH.clear()
+    for session_path, client in clients.items():
+        TDLIB_RECEIVER_QUEUE_DEPTH.set(client.queue_depth(), clients.label(session_path))
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+def check_admin_token(token: Optional[str]) -> None:
+    if ADMIN_TOKEN is None:
+        raise HTTPException(status_code=404, detail="Admin endpoints are disabled, set ADMIN_TOKEN to enable them")
+    if token is None or not hmac.compare_digest(token.encode("utf-8"), ADMIN_TOKEN.encode("utf-8")):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+@app.get("/debug/loop_stalls")
+async def get_loop_stalls(x_admin_token: Optional[str] = Header(None)):
+    """List recent event loop stalls with the stack samples that blocked the loop (debug mode only)."""
+    check_admin_token(x_admin_token)
+    if not loop_monitor.debug:
+        raise HTTPException(status_code=404, detail="Loop monitor debug mode is disabled")
+    return {"threshold_s": loop_monitor.block_threshold, "stalls": loop_monitor.report()}
+
+@app.get("/admin/sessions")
+async def get_admin_sessions(tdlib_stats: bool = Query(True), x_admin_token: Optional[str] = Header(None)):
+    """Report per-session cache sizes, in-flight work, last activity and TDLib network/storage usage."""
+    check_admin_token(x_admin_token)
+    sessions = {os.path.basename(session_path): client.memory_report() for session_path, client in clients.items()}
+    if tdlib_stats:
+        live = [(os.path.basename(session_path), client) for session_path, client in clients.items() if client.client_id]
+        stats = await asyncio.gather(*(client.get_resource_stats() for _, client in live), return_exceptions=True)
+        for (session_id, _), result in zip(live, stats):
+            sessions[session_id]["tdlib"] = {"error": str(result)} if isinstance(result, Exception) else result
+    totals: Dict[str, Dict[str, int]] = {}
+    for report in sessions.values():
+        for name, cache in report["caches"].items():
+            total = totals.setdefault(name, {"entries": 0, "approx_bytes": 0})
+            total["entries"] += cache["entries"]
+            total["approx_bytes"] += cache["approx_bytes"]
+    return {
+        "process": process_memory(),
+        "session_count": len(sessions),
+        "cache_totals": totals,
+        "pool": clients.report(),
+        "response_cache_entries": len(response_cache.entries),
+        "sessions": sessions
+    }
+
+@app.post("/admin/tracemalloc/snapshot")
+def take_tracemalloc_snapshot(limit: int = Query(25, ge=1, le=500), group_by: str = Query("lineno"),
+                              frames: int = Query(1, ge=1, le=50), x_admin_token: Optional[str] = Header(None)):
+    """Take a tracemalloc snapshot and return the allocations that grew the most since the previous one.
+
+    The first call starts tracing (with `frames` frames per allocation) and returns the largest allocations.
+    A plain def, so the snapshot and its comparison run in the threadpool instead of blocking the event loop.
+    """
+    check_admin_token(x_admin_token)
+    if group_by not in ("lineno", "filename", "traceback"):
+        raise HTTPException(status_code=422, detail="group_by must be lineno, filename or traceback")
+    return tracemalloc_snapshots.snapshot(limit=limit, group_by=group_by, frames=frames)
+
+@app.delete("/admin/tracemalloc")
+def stop_tracemalloc(x_admin_token: Optional[str] = Header(None)):
+    """Stop tracing allocations, removing its overhead."""
+    check_admin_token(x_admin_token)
+    tracemalloc_snapshots.stop()
+    return {"status": "stopped"}
+
+@app.get("/stats/compression")
+async def get_compression_stats():
+    """Report per-route response compression ratio and CPU cost."""
+    return compression_stats.report()
+
+@app.websocket("/ws/{phone_number}")
+async def websocket_updates(websocket: WebSocket, phone_number: str, since: Optional[int] = Query(None), epoch: Optional[str] = Query(None)):
+    """Push session updates to the app, replaying the ones missed since the client's last seq."""
+    await websocket.accept()
+    logger.info("WebSocket connected: phone=%s, since=%s, epoch=%s", phone_number, since, epoch)
+    session_path = get_session_path(phone_number)
+    async with clients.use(session_path) as client:
+        if not client or client.client_id == 0:
+            logger.error("No valid client found for phone: %s", phone_number)
+            await websocket.close(code=4401, reason="Client not authenticated")
+            return
+
+        journal = client.update_journal
+        websocket_connections.setdefault(phone_number, []).append(websocket)
+        client.subscribe_updates()
+        # Nothing may be written for a long time, so watch for the disconnect; otherwise a dead connection
+        # would keep the session pinned and its updates polled until the next update is written
+        disconnected = asyncio.ensure_future(wait_for_disconnect(websocket))
+        try:
+            if since is None:
+                seq = journal.last_seq
+                resync_required = False
+            else:
+                backlog = journal.since(since, epoch)
+                resync_required = backlog["resync_required"]
+                for entry in backlog["updates"]:
+                    await websocket.send_text(dumps_text({"epoch": journal.epoch, **entry}))
+                seq = backlog["last_seq"]
+            await websocket.send_text(dumps_text({"epoch": journal.epoch, "last_seq": seq, "resync_required": resync_required}))
+            logger.info("Replayed updates for %s up to seq %s, resync_required=%s", phone_number, seq, resync_required)
+
+            while True:
+                update = asyncio.ensure_future(journal.wait(seq, timeout=30.0))
+                await asyncio.wait({update, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+                if disconnected.done():
+                    update.cancel()
+                    disconnected.result()
+                    logger.info("WebSocket disconnected for %s", phone_number)
+                    break
+                if not update.result():
+                    continue
+                batch = journal.since(seq)
+                if batch["resync_required"]:
+                    logger.warning("WebSocket for %s fell out of the journal window at seq %s", phone_number, seq)
+                    await websocket.send_text(dumps_text({"epoch": journal.epoch, "last_seq": batch["last_seq"], "resync_required": True}))
+                for entry in batch["updates"]:
+                    await websocket.send_text(dumps_text({"epoch": journal.epoch, **entry}))
+                seq = batch["last_seq"]
+        except WebSocketDisconnect:
+            logger.info("WebSocket disconnected for %s", phone_number)
+        except Exception as e:
+            logger.error("Error in WebSocket for %s: %s", phone_number, e)
+        finally:
+            disconnected.cancel()
+            client.unsubscribe_updates()
+            client.touch()
+            if websocket in websocket_connections.get(phone_number, []):
+                websocket_connections[phone_number].remove(websocket)
+                if not websocket_connections[phone_number]:
+                    del websocket_connections[phone_number]
+
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True, log_level="debug")
\ No newline at end of file
@@ -0,0 +1,152 @@
+import bisect
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Latency buckets in seconds, from a cached TDLib call up to a slow media download
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+class Registry:
+    """Collection of metrics rendered together in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self.metrics: List["Metric"] = []
+
+    def register(self, metric: "Metric") -> None:
+        self.metrics.append(metric)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+class Metric:
+    """Base of the metric types: label values are passed positionally, in the order of `labelnames`."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), registry: Registry = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values: Dict[tuple, float] = {}
+        registry.register(self)
+
+    def clear(self) -> None:
+        """Forget every label combination, e.g. before re-populating a gauge at scrape time."""
+        self.values.clear()
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+                for labels, value in self.values.items()]
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        self.values[labels] = self.values.get(labels, 0.0) + amount
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, *labels: str) -> None:
+        self.values[labels] = value
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        self.values[labels] = self.values.get(labels, 0.0) + amount
+
+    def dec(self, *labels: str, amount: float = 1.0) -> None:
+        self.values[labels] = self.values.get(labels, 0.0) - amount
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS, registry: Registry = REGISTRY):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(buckets)
+        self.series: Dict[tuple, Dict[str, object]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0}
+        # Counts are stored per bucket and only made cumulative when rendered
+        series["counts"][bisect.bisect_left(self.buckets, value)] += 1
+        series["sum"] += value
+
+    def clear(self) -> None:
+        self.series.clear()
+
+    def samples(self) -> List[str]:
+        lines = []
+        for labels, series in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series["counts"]):
+                cumulative += count
+                bucket_labels = _format_labels(self.labelnames, labels, ("le", _format_value(bound)))
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {_format_value(series['sum'])}")
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+TDLIB_REQUEST_SECONDS = Histogram("tdlib_request_duration_seconds", "Time from sending a TDLib request to its response.", ["type"])
+TDLIB_EVENTS = Counter("tdlib_events_total", "TDLib events received, by event type.", ["type"])
+TDLIB_RECEIVER_QUEUE_DEPTH = Gauge("tdlib_receiver_queue_depth", "Events queued for a session's active receivers, by opaque session label.", ["session"])
+CACHE_LOOKUPS = Counter("cache_lookups_total", "Cache lookups, by cache and result.", ["cache", "result"])
+TRANSCODES_QUEUED = Gauge("transcodes_queued", "Audio transcodes waiting for or running in the executor.")
+TRANSCODE_SECONDS = Histogram("transcode_duration_seconds", "Audio transcode time, including executor queueing.", ["direction"])
+DOWNLOADS = Counter("downloads_total", "File downloads, by file type and result.", ["file_type", "result"])
+DOWNLOAD_BYTES = Counter("download_bytes_total", "Bytes downloaded from Telegram, by file type.", ["file_type"])
+ACTIVE_SESSIONS = Gauge("active_sessions", "TDLib clients held by the backend.")
+WEBSOCKET_CONNECTIONS = Gauge("websocket_connections", "Open update WebSocket connections.")
+HTTP_REQUEST_SECONDS = Histogram("http_request_duration_seconds", "HTTP request handling time, by route, method and status.",
+                                 ["route", "method", "status"])
+EVENT_LOOP_LAG_SECONDS = Histogram("event_loop_lag_seconds", "Delay between when the loop monitor should have run and when it did.",
+                                   buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+EVENT_LOOP_STALLS = Counter("event_loop_stalls_total", "Event loop stalls over the blocking threshold, by route (debug mode).", ["route"])
+
+class MetricsMiddleware:
+    """ASGI middleware timing HTTP requests by their route template, so path parameters don't multiply series."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, getattr(route, "path", "unmatched"),
+                                         scope["method"], str(status))
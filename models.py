@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import Any, Dict, List, Optional
 
 class AuthRequest(BaseModel):
     phone_number: Optional[str] = None
@@ -18,11 +18,23 @@ class MessageRequest(BaseModel):
     chat_id: int
     limit: int = 50
     from_message_id: int = 0
+    compact: bool = False
+    fields: Optional[List[str]] = None
+
+class CloseChatRequest(BaseModel):
+    phone_number: str
+    chat_id: int
 
 class SendMessageRequest(BaseModel):
     phone_number: str
     chat_id: int
     message: str
+    idempotency_key: Optional[str] = None
+
+class BroadcastRequest(BaseModel):
+    phone_number: str
+    chat_ids: List[int]
+    message: str
 
 class SendVoiceMessageRequest(BaseModel):
     phone_number: str
@@ -32,4 +44,29 @@ class SendVoiceMessageRequest(BaseModel):
 class GetChatsRequest(BaseModel):
     phone_number: str
     limit: int = 20
-    offset: int = 0
\ No newline at end of file
+    offset: int = 0
+    compact: bool = False
+    fields: Optional[List[str]] = None
+
+class BootstrapRequest(BaseModel):
+    phone_number: str
+    chat_limit: int = 20
+    top_chats: int = 5
+    message_limit: int = 20
+    compact: bool = False
+
+class ChatChangesRequest(BaseModel):
+    phone_number: str
+    since_version: int = 0
+    epoch: Optional[str] = None
+    compact: bool = False
+    fields: Optional[List[str]] = None
+
+class BatchOperation(BaseModel):
+    op: str
+    id: Optional[str] = None
+    params: Dict[str, Any] = {}
+
+class BatchRequest(BaseModel):
+    phone_number: str
+    operations: List[BatchOperation]
\ No newline at end of file
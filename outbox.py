@@ -0,0 +1,152 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+from admission import RateLimitExceeded
+
+logger = logging.getLogger(__name__)
+
+class Broadcast:
+    """Delivery of one message to many chats of a session, paced by the session's "send" admission limits.
+
+    Media referenced by an inputFileLocal is uploaded with the first send only; once that send succeeds,
+    the remaining chats get the uploaded file as an inputFileRemote.
+    """
+
+    def __init__(self, client, chat_ids: List[int], content: Dict[str, Any], upload_timeout: float = 120.0,
+                 cleanup_paths: Optional[List[str]] = None):
+        self.id = uuid.uuid4().hex[:12]
+        self.client = client
+        self.session_path = client.session_path
+        self.content = content
+        self.upload_timeout = upload_timeout
+        self.cleanup_paths = cleanup_paths or []
+        self.sends: Dict[int, Dict[str, Any]] = {
+            chat_id: {"chat_id": chat_id, "state": "queued", "message_id": None, "final_message_id": None, "error": None}
+            for chat_id in dict.fromkeys(chat_ids)
+        }
+        self.state = "queued"
+        self.created = int(time.time())
+        self.finished: Optional[int] = None
+        self.task: Optional[asyncio.Task] = None
+
+    def _local_file(self) -> Optional[Dict[str, Any]]:
+        """Return the content's input file if it still has to be uploaded."""
+        for value in self.content.values():
+            if isinstance(value, dict) and value.get("@type") == "inputFileLocal":
+                return value
+        return None
+
+    def _use_remote_file(self, remote_file_id: str) -> None:
+        """Point the content at the already uploaded file instead of the local one."""
+        for key, value in self.content.items():
+            if isinstance(value, dict) and value.get("@type") == "inputFileLocal":
+                self.content[key] = {"@type": "inputFileRemote", "id": remote_file_id}
+                logger.info("Broadcast %s reuses uploaded file %s", self.id, remote_file_id)
+
+    async def _send(self, chat_id: int) -> None:
+        entry = self.sends[chat_id]
+        while True:
+            try:
+                async with self.client.limiter.admit("send"):
+                    event = await self.client.send_pending(chat_id, self.content)
+                break
+            except RateLimitExceeded as e:
+                # A broadcast has no caller waiting on it, so wait out the limit instead of failing the chat
+                await asyncio.sleep(e.retry_after)
+
+        if event["@type"] == "error":
+            logger.error("Broadcast %s failed for chat %s: %s", self.id, chat_id, event)
+            entry["state"] = "failed"
+            entry["error"] = event.get("message")
+            return
+        entry["state"] = "pending"
+        entry["message_id"] = event["id"]
+
+        if self._local_file() is not None:
+            status = await self.client.wait_send_status(chat_id, event["id"], timeout=self.upload_timeout)
+            if status and status.get("remote_file_id"):
+                self._use_remote_file(status["remote_file_id"])
+
+    async def run(self) -> None:
+        self.state = "running"
+        logger.info("Broadcast %s started for %s chats", self.id, len(self.sends))
+        try:
+            for chat_id in self.sends:
+                await self._send(chat_id)
+            self.state = "done"
+            logger.info("Broadcast %s handed all messages to TDLib", self.id)
+        except asyncio.CancelledError:
+            self.state = "cancelled"
+            logger.info("Broadcast %s cancelled", self.id)
+            raise
+        except Exception as e:
+            self.state = "failed"
+            logger.error("Broadcast %s failed: %s", self.id, e)
+        finally:
+            self.finished = int(time.time())
+            # Removed whatever the upload state: a file that didn't upload within upload_timeout (or whose
+            # broadcast was cancelled or failed) would otherwise stay in the session's directory for good
+            for path in self.cleanup_paths:
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def progress(self) -> Dict[str, Any]:
+        """Return the broadcast's state with per-chat delivery states, refreshed from the session's send status."""
+        chats = []
+        counts = {"queued": 0, "pending": 0, "sent": 0, "failed": 0}
+        for chat_id, entry in self.sends.items():
+            if entry["message_id"] is not None and entry["state"] == "pending":
+                status = self.client.get_send_status(chat_id, entry["message_id"])
+                if status is not None and status["state"] != "pending":
+                    entry["state"] = status["state"]
+                    entry["final_message_id"] = status["final_message_id"]
+                    entry["error"] = (status["error"] or {}).get("message")
+            counts[entry["state"]] += 1
+            chats.append(dict(entry))
+        return {
+            "id": self.id,
+            "state": self.state,
+            "total": len(self.sends),
+            "counts": counts,
+            "created": self.created,
+            "finished": self.finished,
+            "chats": chats
+        }
+
+class Outbox:
+    """Running and recently finished broadcasts of every session, bounded to the newest `max_broadcasts`."""
+
+    def __init__(self, max_broadcasts: int = 100):
+        self.max_broadcasts = max_broadcasts
+        self.broadcasts: "OrderedDict[str, Broadcast]" = OrderedDict()
+
+    def start(self, broadcast: Broadcast) -> Broadcast:
+        """Start delivering a broadcast in the background; the session's client counts as busy until it ends."""
+        broadcast.client.active_broadcasts += 1
+        broadcast.task = asyncio.ensure_future(broadcast.run())
+        broadcast.task.add_done_callback(lambda _: self._finished(broadcast))
+        self.broadcasts[broadcast.id] = broadcast
+        finished = [key for key, item in self.broadcasts.items() if item.task.done()]
+        while len(self.broadcasts) > self.max_broadcasts and finished:
+            del self.broadcasts[finished.pop(0)]
+        return broadcast
+
+    def _finished(self, broadcast: Broadcast) -> None:
+        broadcast.client.active_broadcasts -= 1
+
+    def get(self, session_path: str, broadcast_id: str) -> Optional[Broadcast]:
+        broadcast = self.broadcasts.get(broadcast_id)
+        if broadcast is None or broadcast.session_path != session_path:
+            return None
+        return broadcast
+
+    def cancel(self, session_path: str, broadcast_id: str) -> Optional[Broadcast]:
+        """Stop a broadcast; messages already handed to TDLib are still delivered."""
+        broadcast = self.get(session_path, broadcast_id)
+        if broadcast is not None and broadcast.task and not broadcast.task.done():
+            broadcast.task.cancel()
+        return broadcast
@@ -0,0 +1,184 @@
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, TypedDict
+
+logger = logging.getLogger(__name__)
+
+class CompactLastMessage(TypedDict, total=False):
+    id: int
+    date: int
+    is_outgoing: bool
+    text: str
+    is_voice: bool
+    voice_url: Optional[str]
+    duration: int
+
+class CompactChat(TypedDict, total=False):
+    id: int
+    title: str
+    unread_count: int
+    order: str
+    profile_photo_url: Optional[str]
+    profile_photo_preview: Dict[str, Any]
+    last_message: Optional[CompactLastMessage]
+
+class CompactMessage(TypedDict, total=False):
+    id: int
+    date: int
+    is_outgoing: bool
+    content: str
+    status: str
+    is_voice: bool
+    voice_url: Optional[str]
+    duration: int
+    waveform_data: List[float]
+
+def compact_last_message(last_message: Optional[Dict[str, Any]]) -> Optional[CompactLastMessage]:
+    """Reduce a raw TDLib last_message to the fields the chat list renders."""
+    if not last_message:
+        return None
+    content = last_message.get("content", {})
+    compact: CompactLastMessage = {
+        "id": last_message["id"],
+        "date": last_message.get("date", 0),
+        "is_outgoing": last_message.get("is_outgoing", False),
+    }
+    if content.get("@type") == "messageVoiceNote":
+        voice_note = content.get("voice_note", {})
+        compact["is_voice"] = True
+        compact["text"] = content.get("text", "")
+        compact["voice_url"] = voice_note.get("voice", {}).get("remote", {}).get("url")
+        compact["duration"] = voice_note.get("duration", 0)
+    elif content.get("@type") == "messageText":
+        compact["text"] = content.get("text", {}).get("text", "")
+    else:
+        compact["text"] = ""
+    return compact
+
+def compact_chat(chat: Dict[str, Any]) -> CompactChat:
+    """Reduce a formatted chat to its compact representation."""
+    compact: CompactChat = {
+        "id": chat["id"],
+        "title": chat["title"],
+        "unread_count": chat["unread_count"],
+        "order": chat["order"],
+        "profile_photo_url": chat.get("profile_photo_url"),
+        "last_message": compact_last_message(chat.get("last_message")),
+    }
+    if chat.get("profile_photo_preview"):
+        compact["profile_photo_preview"] = chat["profile_photo_preview"]
+    return compact
+
+def compact_message(message: Dict[str, Any]) -> CompactMessage:
+    """Reduce a formatted message to its compact representation, dropping voice fields for text messages."""
+    compact: CompactMessage = {
+        "id": message["id"],
+        "date": message["date"],
+        "is_outgoing": message["is_outgoing"],
+        "content": message["content"],
+        "status": message["status"],
+    }
+    if message["is_voice"]:
+        compact["is_voice"] = True
+        compact["voice_url"] = message["voice_url"]
+        compact["duration"] = message["duration"]
+        compact["waveform_data"] = message["waveform_data"]
+    return compact
+
+def project(item: Dict[str, Any], fields: List[str]) -> Dict[str, Any]:
+    """Keep only the requested top-level fields of a response item."""
+    return {field: item[field] for field in fields if field in item}
+
+def shape(items: List[Dict[str, Any]], compactor: Callable[[Dict[str, Any]], Dict[str, Any]],
+          compact: bool = False, fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """Apply the compact schema and/or a field projection to a list of response items."""
+    if compact:
+        items = [compactor(item) for item in items]
+    if fields:
+        items = [project(item, fields) for item in items]
+    return items
+
+class ResponseCache:
+    """Bounded LRU cache of encoded response bodies, keyed by session, endpoint, params and data version."""
+
+    def __init__(self, max_entries: int = 256, ttl: float = 30.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple) -> Optional[Dict[str, Any]]:
+        """Return the cached body for a key, if present and not expired."""
+        entry = self.entries.get(key)
+        if entry is None or time.monotonic() - entry["created"] > self.ttl:
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key: tuple, body: bytes, media_type: str) -> Dict[str, Any]:
+        """Store an encoded body and return its cache entry with a strong ETag."""
+        entry = {
+            "body": body,
+            "media_type": media_type,
+            "etag": f'"{hashlib.sha1(body).hexdigest()[:20]}"',
+            "created": time.monotonic()
+        }
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, session_path: str) -> None:
+        """Drop every cached body of a session."""
+        for key in [key for key in self.entries if key[0] == session_path]:
+            del self.entries[key]
+
+class MessagePageCache:
+    """Bounded LRU cache of one session's formatted message pages, keyed by chat, page size and cursor."""
+
+    def __init__(self, max_pages: int = 50, ttl: float = 300.0):
+        self.max_pages = max_pages
+        self.ttl = ttl
+        self.pages: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, chat_id: int, limit: int, from_message_id: int) -> Optional[List[Dict[str, Any]]]:
+        """Return a copy of a cached page, if present and not expired."""
+        key = (chat_id, limit, from_message_id)
+        entry = self.pages.get(key)
+        if entry is None or time.monotonic() - entry["created"] > self.ttl:
+            if entry is not None:
+                del self.pages[key]
+            self.misses += 1
+            return None
+        self.pages.move_to_end(key)
+        self.hits += 1
+        return [dict(message) for message in entry["messages"]]
+
+    def put(self, chat_id: int, limit: int, from_message_id: int, messages: List[Dict[str, Any]]) -> None:
+        key = (chat_id, limit, from_message_id)
+        self.pages[key] = {"messages": [dict(message) for message in messages], "created": time.monotonic()}
+        self.pages.move_to_end(key)
+        while len(self.pages) > self.max_pages:
+            self.pages.popitem(last=False)
+
+    def invalidate_chat(self, chat_id: int) -> None:
+        """Drop every cached page of a chat."""
+        for key in [key for key in self.pages if key[0] == chat_id]:
+            del self.pages[key]
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Check an If-None-Match header against an ETag."""
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
@@ -0,0 +1,90 @@
+import contextvars
+import json
+import logging
+from typing import Any, Union
+from starlette.responses import Response
+from tracing import span
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+
+# Set per request by NegotiationMiddleware from the Accept header
+_wants_msgpack: contextvars.ContextVar[bool] = contextvars.ContextVar("wants_msgpack", default=False)
+
+def dumps(obj: Any) -> bytes:
+    """Encode an object as UTF-8 JSON bytes, using orjson when it is available."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def dumps_text(obj: Any) -> str:
+    """Encode an object as a JSON string, e.g. for WebSocket text frames."""
+    return dumps(obj).decode("utf-8")
+
+def loads(data: Union[bytes, str]) -> Any:
+    """Decode JSON bytes or text, using orjson when it is available."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def encode_msgpack(obj: Any) -> bytes:
+    """Encode an object as MessagePack."""
+    return msgpack.packb(obj, use_bin_type=True)
+
+def wants_msgpack() -> bool:
+    """Whether the current request negotiated a MessagePack response."""
+    return _wants_msgpack.get()
+
+def accepts_msgpack(accept: str) -> bool:
+    """Check whether an Accept header asks for MessagePack."""
+    return msgpack is not None and MSGPACK_MEDIA_TYPE in accept
+
+class NegotiatedResponse(Response):
+    """Response that renders JSON with the fast codec, or MessagePack when the client asked for it."""
+    media_type = JSON_MEDIA_TYPE
+
+    def __init__(self, content: Any = None, *args, **kwargs):
+        if _wants_msgpack.get():
+            self.media_type = MSGPACK_MEDIA_TYPE
+        super().__init__(content, *args, **kwargs)
+        if msgpack is not None:
+            self.headers["Vary"] = "Accept"
+
+    def render(self, content: Any) -> bytes:
+        with span("encode", media_type=self.media_type):
+            if self.media_type == MSGPACK_MEDIA_TYPE:
+                return encode_msgpack(content)
+            return dumps(content)
+
+class NegotiationMiddleware:
+    """ASGI middleware that records whether the request accepts MessagePack responses."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept = ""
+        for name, value in scope.get("headers", []):
+            if name == b"accept":
+                accept = value.decode("latin-1")
+                break
+        token = _wants_msgpack.set(accepts_msgpack(accept))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _wants_msgpack.reset(token)
@@ -0,0 +1,222 @@
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, MutableMapping, Optional
+from serialization import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+WARM_CACHE_FILE = "warm_cache.json"
+
+class SessionPool(MutableMapping):
+    """The live TDLib clients, keyed by session path, with a cap on how many stay open.
+
+    Clients idle for longer than `idle_timeout`, or the least recently used idle ones once more than
+    `max_live` are open, are closed and their warm caches written to the session directory. acquire()
+    transparently revives such a session (a new TDLib client over the same database, with the caches
+    restored) the next time it is used. Requests hold their client through use(), which pins it so it
+    isn't evicted while in use. As a mapping it only contains the clients that are currently open.
+    """
+
+    def __init__(self, factory: Callable[[str], Any], max_live: int = 100, idle_timeout: float = 900.0):
+        self.factory = factory
+        self.max_live = max_live
+        self.idle_timeout = idle_timeout
+        self.live: Dict[str, Any] = {}
+        self.evictions = 0
+        self.revivals = 0
+        self._reviving: Dict[str, asyncio.Task] = {}
+        self._evicting: Dict[str, asyncio.Task] = {}
+        self._pins: Dict[str, int] = {}
+        self._labels: Dict[str, str] = {}
+        self._sweep_task: Optional[asyncio.Task] = None
+
+    def __getitem__(self, session_path: str) -> Any:
+        return self.live[session_path]
+
+    def __setitem__(self, session_path: str, client: Any) -> None:
+        self.live[session_path] = client
+        if len(self.live) > self.max_live:
+            try:
+                asyncio.get_running_loop().create_task(self._enforce_limit())
+            except RuntimeError:
+                pass
+
+    def __delitem__(self, session_path: str) -> None:
+        del self.live[session_path]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self.live))
+
+    def __len__(self) -> int:
+        return len(self.live)
+
+    def label(self, session_path: str) -> str:
+        """Opaque name of a session, stable for the life of the process, for places like metrics labels where
+        the session directory (the md5 of its phone number) must not be exposed."""
+        if session_path not in self._labels:
+            self._labels[session_path] = f"session{len(self._labels) + 1}"
+        return self._labels[session_path]
+
+    def _warm_cache_path(self, session_path: str) -> str:
+        return os.path.join(session_path, WARM_CACHE_FILE)
+
+    def _load_warm_cache(self, session_path: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._warm_cache_path(session_path), "rb") as f:
+                return loads(f.read())
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning("Ignoring unreadable warm cache of %s: %s", session_path, e)
+            return None
+
+    def create(self, session_path: str) -> Any:
+        """Open a new client for a session, restoring its warm caches if it was evicted before."""
+        client = self.factory(session_path)
+        warm_cache = self._load_warm_cache(session_path)
+        if warm_cache:
+            client.restore_warm_cache(warm_cache)
+        self[session_path] = client
+        return client
+
+    async def _wait_evicted(self, session_path: str) -> None:
+        """Wait for an eviction in progress to close the session's client, so a new one doesn't share its database."""
+        task = self._evicting.get(session_path)
+        if task is not None:
+            await asyncio.shield(task)
+
+    async def open(self, session_path: str) -> Any:
+        """Return the session's open client, or create one, e.g. to authenticate it."""
+        await self._wait_evicted(session_path)
+        client = self.live.get(session_path)
+        if client is None or not client.client_id:
+            client = self.create(session_path)
+        return client
+
+    async def acquire(self, session_path: str) -> Optional[Any]:
+        """Return the session's open client, reviving it if it was evicted; None if it isn't authenticated."""
+        client = self.live.get(session_path)
+        if client is not None and client.client_id:
+            return client
+        if not os.path.exists(self._warm_cache_path(session_path)):
+            return None
+        # Concurrent requests for an evicted session share one revival
+        task = self._reviving.get(session_path)
+        if task is None:
+            task = self._reviving[session_path] = asyncio.ensure_future(self._revive(session_path))
+            task.add_done_callback(lambda _: self._reviving.pop(session_path, None))
+        return await asyncio.shield(task)
+
+    async def _revive(self, session_path: str) -> Optional[Any]:
+        await self._wait_evicted(session_path)
+        await self._enforce_limit(reserve=1)
+        start = time.perf_counter()
+        client = self.create(session_path)
+        result = await client.check_session()
+        if not result.get("is_authenticated"):
+            logger.info("Evicted session %s is no longer authenticated (%s)", session_path, result.get("auth_state"))
+            self.live.pop(session_path, None)
+            os.remove(self._warm_cache_path(session_path))
+            await client.close()
+            return None
+        self.revivals += 1
+        logger.info("Revived session %s in %.2fs", session_path, time.perf_counter() - start)
+        return client
+
+    @asynccontextmanager
+    async def use(self, session_path: str, create: bool = False) -> AsyncIterator[Optional[Any]]:
+        """Hold the session's client (see acquire, or open with `create`) for a request, pinned against eviction."""
+        self._pins[session_path] = self._pins.get(session_path, 0) + 1
+        try:
+            client = await (self.open(session_path) if create else self.acquire(session_path))
+            if client is not None:
+                client.touch()
+            yield client
+        finally:
+            self._pins[session_path] -= 1
+            if not self._pins[session_path]:
+                del self._pins[session_path]
+
+    def _evictable(self, session_path: str, client: Any) -> bool:
+        return not self._pins.get(session_path) and client.is_idle()
+
+    async def evict(self, session_path: str, only_idle: bool = False) -> bool:
+        """Close a session's client and persist its warm caches, so acquire() can revive it later.
+
+        With `only_idle`, a client that is pinned or busy by now is kept; returns whether it was evicted.
+        """
+        client = self.live.get(session_path)
+        if client is None or (only_idle and not self._evictable(session_path, client)):
+            return False
+        del self.live[session_path]
+        if client.client_id:
+            with open(self._warm_cache_path(session_path), "wb") as f:
+                f.write(dumps(client.export_warm_cache()))
+        # Until the client is closed, revivals and new clients of the session wait for this task
+        task = self._evicting[session_path] = asyncio.ensure_future(client.close())
+        task.add_done_callback(lambda _: self._evicting.pop(session_path, None))
+        await asyncio.shield(task)
+        self.evictions += 1
+        logger.info("Evicted session %s after %.0fs idle", session_path, time.time() - client.last_activity)
+        return True
+
+    async def _enforce_limit(self, reserve: int = 0) -> None:
+        """Evict idle clients, least recently active first, until `reserve` more fit under max_live."""
+        excess = len(self.live) + reserve - self.max_live
+        if excess <= 0:
+            return
+        idle = sorted((client.last_activity, session_path) for session_path, client in self.live.items()
+                      if self._evictable(session_path, client))
+        for _, session_path in idle:
+            if excess <= 0:
+                break
+            # Evicting the previous ones awaited, so a request may have pinned this session meanwhile
+            if await self.evict(session_path, only_idle=True):
+                excess -= 1
+        if len(self.live) + reserve > self.max_live:
+            logger.warning("Session pool over its limit of %s: %s clients are busy", self.max_live, len(self.live))
+
+    async def _sweep(self) -> None:
+        while True:
+            await asyncio.sleep(min(60.0, self.idle_timeout / 4))
+            cutoff = time.time() - self.idle_timeout
+            for session_path, client in list(self.live.items()):
+                if client.last_activity >= cutoff or self._pins.get(session_path):
+                    continue
+                try:
+                    # Nothing else may be receiving on a quiet server, so dispatch the send outcomes and
+                    # responses that already arrived before deciding whether the client is idle
+                    await client.drain_updates()
+                    if self.live.get(session_path) is client:
+                        await self.evict(session_path, only_idle=True)
+                except Exception as e:
+                    logger.error("Failed to evict session %s: %s", session_path, e)
+
+    def start(self) -> None:
+        if self._sweep_task is None or self._sweep_task.done():
+            self._sweep_task = asyncio.ensure_future(self._sweep())
+
+    async def close(self) -> None:
+        """Stop evicting and close every open client, persisting warm caches for the next start."""
+        if self._sweep_task is not None:
+            self._sweep_task.cancel()
+        session_paths = list(self.live)
+        results = await asyncio.gather(*(self.evict(session_path) for session_path in session_paths), return_exceptions=True)
+        for session_path, result in zip(session_paths, results):
+            if isinstance(result, Exception):
+                logger.error("Failed to close session %s: %s", session_path, result)
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "live": len(self.live),
+            "max_live": self.max_live,
+            "idle_timeout_s": self.idle_timeout,
+            "evictions": self.evictions,
+            "revivals": self.revivals,
+            "reviving": len(self._reviving),
+            "evicting": len(self._evicting),
+            "pinned": len(self._pins)
+        }
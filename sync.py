@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import uuid
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# TDLib updates that are relevant to the app and worth replaying after a reconnect
+JOURNALED_UPDATES = {
+    "updateNewChat",
+    "updateNewMessage",
+    "updateMessageContent",
+    "updateMessageSendSucceeded",
+    "updateMessageSendFailed",
+    "updateDeleteMessages",
+    "updateChatLastMessage",
+    "updateChatPosition",
+    "updateChatAddedToList",
+    "updateChatRemovedFromList",
+    "updateChatReadInbox",
+    "updateChatReadOutbox",
+    "updateChatTitle",
+    "updateChatPhoto",
+    "updateAuthorizationState",
+}
+
+# TDLib updates that change a cached chat's row in the chat list
+CHAT_LIST_UPDATES = {
+    "updateNewChat",
+    "updateChatLastMessage",
+    "updateChatPosition",
+    "updateChatAddedToList",
+    "updateChatRemovedFromList",
+    "updateChatReadInbox",
+    "updateChatTitle",
+    "updateChatPhoto",
+}
+
+class UpdateJournal:
+    """Bounded, append-only journal of session updates with monotonically increasing sequence numbers."""
+
+    def __init__(self, max_size: int = 1000):
+        self.max_size = max_size
+        self.epoch = uuid.uuid4().hex[:12]
+        self.entries = deque(maxlen=max_size)
+        self.last_seq = 0
+        self._new_entry: Optional[asyncio.Event] = None
+
+    def append(self, update: Dict[str, Any]) -> int:
+        """Append an update to the journal and wake up waiting readers."""
+        self.last_seq += 1
+        self.entries.append({"seq": self.last_seq, "update": update})
+        if self._new_entry is not None:
+            self._new_entry.set()
+            self._new_entry = None
+        return self.last_seq
+
+    @property
+    def first_seq(self) -> int:
+        """Sequence number of the oldest entry still in the journal."""
+        return self.entries[0]["seq"] if self.entries else self.last_seq + 1
+
+    def since(self, seq: int, epoch: Optional[str] = None) -> Dict[str, Any]:
+        """Return the entries after `seq`, or a resync marker if they fell out of the window."""
+        if (epoch and epoch != self.epoch) or seq > self.last_seq or seq < self.first_seq - 1:
+            return {"resync_required": True, "epoch": self.epoch, "last_seq": self.last_seq, "updates": []}
+        updates: List[Dict[str, Any]] = [entry for entry in self.entries if entry["seq"] > seq]
+        return {"resync_required": False, "epoch": self.epoch, "last_seq": self.last_seq, "updates": updates}
+
+    async def wait(self, seq: int, timeout: float) -> bool:
+        """Wait until an entry newer than `seq` is available. Returns False on timeout."""
+        if self.last_seq > seq:
+            return True
+        if self._new_entry is None:
+            self._new_entry = asyncio.Event()
+        try:
+            await asyncio.wait_for(self._new_entry.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return False
+        return self.last_seq > seq
+
+class ChatListVersions:
+    """Version counter for a session's chat list, tracking which chats changed or were removed since a version."""
+
+    def __init__(self, max_removed: int = 1000):
+        self.max_removed = max_removed
+        self.epoch = uuid.uuid4().hex[:12]
+        self.version = 0
+        self.min_version = 0
+        self.changed: Dict[int, int] = {}
+        self.removed: Dict[int, int] = {}
+        self.fingerprints: Dict[int, tuple] = {}
+
+    def update(self, chat_id: int, fingerprint: tuple) -> bool:
+        """Bump the version if the chat's fingerprint changed. Returns True if it did."""
+        if self.fingerprints.get(chat_id) == fingerprint and chat_id not in self.removed:
+            return False
+        self.version += 1
+        self.fingerprints[chat_id] = fingerprint
+        self.changed[chat_id] = self.version
+        self.removed.pop(chat_id, None)
+        return True
+
+    def remove(self, chat_id: int) -> None:
+        """Record that a previously listed chat left the chat list."""
+        if chat_id not in self.fingerprints:
+            return
+        self.version += 1
+        self.fingerprints.pop(chat_id, None)
+        self.changed.pop(chat_id, None)
+        self.removed[chat_id] = self.version
+        if len(self.removed) > self.max_removed:
+            oldest_chat_id = min(self.removed, key=self.removed.get)
+            self.min_version = self.removed.pop(oldest_chat_id)
+            logger.info("Dropped removal of chat %s, deltas now start at version %s", oldest_chat_id, self.min_version)
+
+    def since(self, version: int, epoch: Optional[str] = None) -> Dict[str, Any]:
+        """Return the chat ids changed and removed after `version`, or a resync marker."""
+        if (epoch and epoch != self.epoch) or version > self.version or version < self.min_version:
+            return {"resync_required": True, "epoch": self.epoch, "version": self.version, "changed": [], "removed": []}
+        changed = [chat_id for chat_id, chat_version in self.changed.items() if chat_version > version]
+        removed = [chat_id for chat_id, chat_version in self.removed.items() if chat_version > version]
+        return {"resync_required": False, "epoch": self.epoch, "version": self.version, "changed": changed, "removed": removed}
@@ -1,4 +1,3 @@
-import json
 import os
 import sys
 import asyncio
@@ -7,15 +6,44 @@ import glob
 import time
 import urllib.parse
 import base64
-from pydub import AudioSegment
+import itertools
+import importlib
+from collections import OrderedDict
 from ctypes import CDLL, CFUNCTYPE, c_char_p, c_double, c_int
 from ctypes.util import find_library
 from typing import Any, Dict, Optional, List
 import hashlib
 from utils import generate_waveform, convert_oga_to_wav
-from config import BACKEND_HOST
+from serialization import dumps, loads
+from admission import SessionLimiter, RateLimitExceeded, parse_flood_wait
+from responses import MessagePageCache
+from diagnostics import approx_size
+from metrics import TDLIB_REQUEST_SECONDS, TDLIB_EVENTS, CACHE_LOOKUPS, TRANSCODES_QUEUED, TRANSCODE_SECONDS, DOWNLOADS, DOWNLOAD_BYTES
+from tdlib_trace import TraceRecorder, open_recorder
+from tracing import span, start_span, traced
+from sync import UpdateJournal, ChatListVersions, JOURNALED_UPDATES, CHAT_LIST_UPDATES
+from config import BACKEND_HOST, UPDATE_JOURNAL_SIZE, ADMISSION_LIMITS, ADMISSION_MAX_WAIT, SEND_STATUS_SIZE, \
+    PREFETCH_CACHE_PAGES, PREFETCH_CACHE_TTL, PREFETCH_DELAY, TDLIB_TRACE_DIR, TDLIB_LOG_PATH, TDLIB_LOG_MAX_SIZE, TDLIB_LOG_VERBOSITY
 
 logger = logging.getLogger(__name__)
+# Per-query and per-event logging, sampled and rate limited through LOG_SAMPLE_RATES/LOG_RATE_LIMITS
+query_logger = logging.getLogger(f"{__name__}.queries")
+event_logger = logging.getLogger(f"{__name__}.events")
+
+# TDLib updates that move a sent message from pending to its final state
+SEND_STATUS_UPDATES = {"updateMessageSendSucceeded", "updateMessageSendFailed", "updateFile"}
+
+# TDLib updates that change messages already in the history, and so in cached pages
+MESSAGE_CHANGE_UPDATES = {"updateMessageContent", "updateDeleteMessages"}
+
+# td_receive returns events of every client in the process, so route them by "@client_id"
+_clients_by_id: Dict[int, "TdExample"] = {}
+
+# Opt-in recording of every query and event, shared like td_receive itself
+_trace_recorder: Optional[TraceRecorder] = open_recorder(TDLIB_TRACE_DIR)
+
+# TDLib's log stream and callback are process-wide, so they are set up once; the callback must stay referenced
+_log_callback = None
 
 class TdExample:
     def __init__(self, session_path: str, api_id: int, api_hash: str):
@@ -27,17 +55,41 @@ class TdExample:
         self.file_url_cache = {}
         self.chat_cache = {}
         self.sent_message_ids = set()
+        self.update_journal = UpdateJournal(max_size=UPDATE_JOURNAL_SIZE)
+        self.chat_list_versions = ChatListVersions()
+        self.limiter = SessionLimiter(ADMISSION_LIMITS, max_wait=ADMISSION_MAX_WAIT)
+        self._receivers: List[asyncio.Queue] = []
+        self._update_subscribers = 0
+        self._pump_task: Optional[asyncio.Task] = None
+        self._extra_ids = itertools.count(1)
+        self._download_waiters: Dict[int, int] = {}
+        self._downloads_started = set()
+        self.send_status: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+        self._pending_sends: Dict[str, int] = {}
+        self._uploads: Dict[int, tuple] = {}
+        self.message_cache = MessagePageCache(max_pages=PREFETCH_CACHE_PAGES, ttl=PREFETCH_CACHE_TTL)
+        self._prefetch_tasks: Dict[int, asyncio.Task] = {}
+        self._request_started: Dict[str, tuple] = {}
+        self.active_broadcasts = 0
+        self.last_activity = time.time()
         os.makedirs(self.session_path, exist_ok=True)
         os.makedirs(os.path.join(self.session_path, "voice"), exist_ok=True)
         os.makedirs(os.path.join(self.session_path, "profile_photos"), exist_ok=True)
         self._load_library()
         self._setup_functions()
         self._setup_logging()
-        self.client_id = self._td_create_client_id()
-        logger.info(f"Created client with ID: {self.client_id} for session: {session_path}")
+        self.client_id = self._create_client()
+        logger.info("Created client with ID: %s for session: %s", self.client_id, session_path)
 
     def _load_library(self) -> None:
         """Load TDLib library."""
+        fake = os.environ.get("TDJSON_FAKE")
+        if fake:
+            # A Python module whose load() returns an object with the tdjson functions, for offline benchmarks
+            logger.warning("Using fake TDLib from %s", fake)
+            self.tdjson = importlib.import_module(fake).load()
+            return
+
         tdjson_path = find_library("tdjson")
         if tdjson_path is None:
             if os.name == "nt":
@@ -49,7 +101,7 @@ class TdExample:
         try:
             self.tdjson = CDLL(tdjson_path)
         except Exception as e:
-            logger.error(f"Error loading TDLib: {e}")
+            logger.error("Error loading TDLib: %s", e)
             sys.exit(1)
 
     def _setup_functions(self) -> None:
@@ -75,17 +127,45 @@ class TdExample:
         self._td_set_log_message_callback.restype = None
         self._td_set_log_message_callback.argtypes = [c_int, self.log_message_callback_type]
 
-    def _setup_logging(self, verbosity_level: int = 1) -> None:
-        """Set up TDLib logging."""
+    def _create_client(self) -> int:
+        """Create a TDLib client and route its events to this session."""
+        client_id = self._td_create_client_id()
+        _clients_by_id[client_id] = self
+        return client_id
+
+    def queue_depth(self) -> int:
+        """Return the number of events waiting in the session's receiver queues."""
+        return sum(queue.qsize() for queue in self._receivers)
+
+    def _next_extra(self) -> str:
+        """Return a unique "@extra" tag used to match a TDLib response to its request."""
+        return f"{self.client_id}:{next(self._extra_ids)}"
+
+    def _setup_logging(self, verbosity_level: int = TDLIB_LOG_VERBOSITY) -> None:
+        """Send TDLib's log to its own rotating file; only fatal errors go through Python logging."""
+        global _log_callback
+        if _log_callback is not None:
+            return
+
         @self.log_message_callback_type
         def on_log_message_callback(verbosity_level, message):
-            decoded_message = message.decode('utf-8')
-            if verbosity_level == 0:
-                logger.error(f"TDLib fatal error: {decoded_message}")
-            else:
-                logger.info(f"TDLib log: {decoded_message}")
+            logger.error("TDLib fatal error: %s", message.decode('utf-8', errors='replace'))
 
-        self._td_set_log_message_callback(2, on_log_message_callback)
+        _log_callback = on_log_message_callback
+        self._td_set_log_message_callback(0, on_log_message_callback)
+        if TDLIB_LOG_PATH:
+            os.makedirs(os.path.dirname(os.path.abspath(TDLIB_LOG_PATH)), exist_ok=True)
+            result = self.execute({
+                "@type": "setLogStream",
+                "log_stream": {
+                    "@type": "logStreamFile",
+                    "path": os.path.abspath(TDLIB_LOG_PATH),
+                    "max_file_size": TDLIB_LOG_MAX_SIZE,
+                    "redirect_stderr": False
+                }
+            })
+            if result and result.get("@type") == "error":
+                logger.warning("Failed to set TDLib log file %s: %s", TDLIB_LOG_PATH, result.get("message"))
         self.execute({"@type": "setLogVerbosityLevel", "new_verbosity_level": verbosity_level})
 
     def clean_old_files(self) -> None:
@@ -99,22 +179,34 @@ class TdExample:
                             file_age = time.time() - os.path.getmtime(file_path)
                             if file_age > 24 * 3600:
                                 os.remove(file_path)
-                                logger.info(f"Deleted old file: {file_path}")
+                                logger.info("Deleted old file: %s", file_path)
                     except Exception as e:
-                        logger.warning(f"Failed to delete old file {file_path}: {e}")
+                        logger.warning("Failed to delete old file %s: %s", file_path, e)
 
     def execute(self, query: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """Execute a TDLib query synchronously."""
-        query_json = json.dumps(query).encode("utf-8")
+        query_json = dumps(query)
         result = self._td_execute(query_json)
         if result:
-            return json.loads(result.decode("utf-8"))
+            return loads(result)
         return None
 
+    def touch(self) -> None:
+        """Record user activity; called where requests arrive, so diagnostic queries don't keep the session alive."""
+        self.last_activity = time.time()
+
     def send(self, query: Dict[str, Any]) -> None:
         """Send a TDLib query asynchronously."""
-        logger.info(f"Sending query to TDLib: {query}")
-        query_json = json.dumps(query).encode("utf-8")
+        # Every query is tagged, so its response can be timed even when the caller doesn't match on "@extra"
+        if "@extra" not in query:
+            query["@extra"] = self._next_extra()
+        self._request_started[query["@extra"]] = (query["@type"], time.perf_counter(), start_span(f"tdlib {query['@type']}"))
+        if _trace_recorder is not None:
+            _trace_recorder.record("send", self.client_id, query)
+        query_json = dumps(query)
+        query_logger.info("Sending query %s", query["@type"], extra={"client_id": self.client_id, "tdlib_extra": query["@extra"]})
+        if query_logger.isEnabledFor(logging.DEBUG):
+            query_logger.debug("Query body: %s", query_json.decode("utf-8"))
         self._td_send(self.client_id, query_json)
 
     async def receive(self, timeout: float = 2.0) -> Optional[Dict[str, Any]]:
@@ -122,53 +214,178 @@ class TdExample:
         try:
             result = self._td_receive(timeout)
             if result:
-                return json.loads(result.decode("utf-8"))
+                event = loads(result)
+                if _trace_recorder is not None:
+                    _trace_recorder.record("recv", event.get("@client_id"), event)
+                return event
         except Exception as e:
-            logger.error(f"Error receiving TDLib event: {e}")
+            logger.error("Error receiving TDLib event: %s", e)
         return None
 
+    def _dispatch(self, event: Dict[str, Any]) -> None:
+        """Route a TDLib event to its session's journal and active receivers."""
+        owner = _clients_by_id.get(event.get("@client_id"), self)
+        TDLIB_EVENTS.inc(event.get("@type", "unknown"))
+        if "@extra" in event:
+            started = owner._request_started.pop(event["@extra"], None)
+            if started is not None:
+                TDLIB_REQUEST_SECONDS.observe(time.perf_counter() - started[1], started[0])
+                if started[2] is not None:
+                    started[2].end(response=event.get("@type"))
+        if event.get("@type") in JOURNALED_UPDATES:
+            owner.update_journal.append(event)
+        if event.get("@type") in CHAT_LIST_UPDATES:
+            owner._apply_chat_update(event)
+        if event.get("@type") in MESSAGE_CHANGE_UPDATES:
+            owner.message_cache.invalidate_chat(event["chat_id"])
+        if event.get("@type") in SEND_STATUS_UPDATES:
+            owner._apply_send_update(event)
+        elif event.get("@type") == "message" and event.get("@extra") in owner._pending_sends:
+            owner._track_send(event)
+        if event.get("@type") == "error":
+            flood_wait = parse_flood_wait(event)
+            if flood_wait:
+                owner.limiter.backoff(flood_wait)
+        for queue in owner._receivers:
+            queue.put_nowait(event)
+
     async def _receive_events(self, timeout: float = 20.0):
         """Generator for receiving TDLib events."""
+        # Every concurrent receiver gets its own copy of the events, so handlers don't steal each other's responses
+        queue: asyncio.Queue = asyncio.Queue()
+        self._receivers.append(queue)
         end_time = asyncio.get_event_loop().time() + timeout
-        while asyncio.get_event_loop().time() < end_time:
-            try:
-                event = await self.receive(timeout=0.5)
+        try:
+            while asyncio.get_event_loop().time() < end_time:
+                try:
+                    if queue.empty():
+                        event = await self.receive(timeout=0.5)
+                        if event:
+                            self._dispatch(event)
+                    if not queue.empty():
+                        event = queue.get_nowait()
+                        event_logger.info("Received event %s", event['@type'], extra={"client_id": self.client_id})
+                        yield event
+                        continue
+                except Exception as e:
+                    logger.error("Error in _receive_events: %s", e)
+                    await asyncio.sleep(0.1)
+                await asyncio.sleep(0.05)
+            logger.info("No more events received within timeout")
+        finally:
+            self._receivers.remove(queue)
+
+    async def drain_updates(self, max_events: int = 1000) -> int:
+        """Dispatch the TDLib events that are already pending, without waiting for new ones."""
+        if self._receivers:
+            return 0
+        count = 0
+        while count < max_events:
+            event = await self.receive(timeout=0.0)
+            if not event:
+                break
+            self._dispatch(event)
+            count += 1
+        return count
+
+    def subscribe_updates(self) -> None:
+        """Register an update stream consumer and make sure updates are being polled."""
+        self._update_subscribers += 1
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.create_task(self._pump_updates())
+
+    def unsubscribe_updates(self) -> None:
+        """Unregister an update stream consumer."""
+        self._update_subscribers = max(0, self._update_subscribers - 1)
+
+    async def _pump_updates(self) -> None:
+        """Poll TDLib for updates while the session has subscribers and no handler is receiving."""
+        logger.info("Starting update pump for session: %s", self.session_path)
+        while self._update_subscribers > 0 and self.client_id:
+            if not self._receivers:
+                event = await self.receive(timeout=0.0)
                 if event:
-                    logger.info(f"Received event: {event['@type']}")
-                    yield event
-            except Exception as e:
-                logger.error(f"Error in _receive_events: {e}")
-                await asyncio.sleep(0.1)
-            await asyncio.sleep(0.05)
-        logger.info("No more events received within timeout")
+                    self._dispatch(event)
+                    continue
+            await asyncio.sleep(0.1)
+        logger.info("Stopped update pump for session: %s", self.session_path)
 
     def destroy_client(self) -> None:
         """Destroy the TDLib client."""
         self.send({"@type": "close"})
-        logger.info(f"Destroying client with ID: {self.client_id}")
+        logger.info("Destroying client with ID: %s", self.client_id)
         for _ in range(10):
             result = self._td_receive(2.0)
             if result:
-                event = json.loads(result.decode("utf-8"))
+                event = loads(result)
                 if event.get("@type") == "updateAuthorizationState" and event["authorization_state"]["@type"] == "authorizationStateClosed":
-                    logger.info(f"Client {self.client_id} closed successfully")
+                    logger.info("Client %s closed successfully", self.client_id)
                     break
+        _clients_by_id.pop(self.client_id, None)
+        self._request_started.clear()
         self.client_id = 0
 
+    async def close(self, timeout: float = 20.0) -> None:
+        """Close the TDLib client like destroy_client, but without blocking the event loop."""
+        if not self.client_id:
+            return
+        logger.info("Closing client with ID: %s", self.client_id)
+        for task in self._prefetch_tasks.values():
+            task.cancel()
+        self._prefetch_tasks.clear()
+        self.send({"@type": "close"})
+        async for event in self._receive_events(timeout=timeout):
+            if event["@type"] == "updateAuthorizationState" and event["authorization_state"]["@type"] == "authorizationStateClosed":
+                logger.info("Client %s closed successfully", self.client_id)
+                break
+        else:
+            logger.warning("Client %s did not report authorizationStateClosed within %ss", self.client_id, timeout)
+        _clients_by_id.pop(self.client_id, None)
+        self._request_started.clear()
+        self.client_id = 0
+
+    def is_idle(self) -> bool:
+        """Whether nothing is using the client: no handler, update stream, broadcast, query, send or transfer in progress."""
+        return (not self._receivers and not self._update_subscribers and not self.active_broadcasts
+                and not self._request_started and not self._pending_sends and not self._uploads and not self._download_waiters
+                and all(task.done() for task in self._prefetch_tasks.values())
+                and all(status["state"] != "pending" for status in self.send_status.values()))
+
+    def export_warm_cache(self) -> Dict[str, Any]:
+        """Return the caches worth keeping while the client is closed, see restore_warm_cache."""
+        return {
+            "chat_cache": self.chat_cache,
+            "file_url_cache": self.file_url_cache,
+            "sent_message_ids": list(self.sent_message_ids)
+        }
+
+    def restore_warm_cache(self, data: Dict[str, Any]) -> None:
+        """Reload caches saved by export_warm_cache, skipping failed downloads and files that were cleaned up."""
+        for chat_id, chat in data.get("chat_cache", {}).items():
+            self.chat_cache[int(chat_id)] = chat
+            self._touch_chat(int(chat_id))
+        local_files = set()
+        for dir_name in ["voice", "profile_photos"]:
+            local_files.update(os.listdir(os.path.join(self.session_path, dir_name)))
+        for file_id, url in data.get("file_url_cache", {}).items():
+            if url and urllib.parse.unquote(urllib.parse.urlsplit(url).path.rsplit("/", 1)[-1]) in local_files:
+                self.file_url_cache[int(file_id)] = url
+        self.sent_message_ids.update(data.get("sent_message_ids", []))
+
     async def check_session(self) -> Dict[str, Any]:
         """Check the authentication state of the session."""
         max_retries = 3
         for attempt in range(max_retries):
-            logger.info(f"Checking session, attempt {attempt + 1}")
+            logger.info("Checking session, attempt %s", attempt + 1)
             self.send({"@type": "getAuthorizationState"})
             async for event in self._receive_events(timeout=20.0):
-                logger.info(f"Processing event in check_session: {event['@type']}")
+                logger.info("Processing event in check_session: %s", event['@type'])
                 if event["@type"] == "authorizationStateReady":
                     logger.info("Session is authenticated (authorizationStateReady)")
                     return {"is_authenticated": True, "auth_state": "authenticated"}
                 elif event["@type"] == "updateAuthorizationState":
                     auth_state = event["authorization_state"]["@type"]
-                    logger.info(f"Session check state: {auth_state}")
+                    logger.info("Session check state: %s", auth_state)
                     if auth_state == "authorizationStateReady":
                         logger.info("Session is authenticated via updateAuthorizationState")
                         return {"is_authenticated": True, "auth_state": "authenticated"}
@@ -195,21 +412,21 @@ class TdExample:
                         "authorizationStateWaitEmailAddress",
                         "authorizationStateWaitEmailCode"
                     ]:
-                        logger.info(f"Session requires authentication: {auth_state}")
+                        logger.info("Session requires authentication: %s", auth_state)
                         return {"is_authenticated": False, "auth_state": auth_state}
                     elif auth_state == "authorizationStateClosed":
                         logger.info("Session closed, recreating client")
                         self.destroy_client()
-                        self.client_id = self._td_create_client_id()
-                        logger.info(f"Recreated client with ID: {self.client_id}")
+                        self.client_id = self._create_client()
+                        logger.info("Recreated client with ID: %s", self.client_id)
                         break
                 elif event["@type"] == "error":
-                    logger.error(f"TDLib error during session check: {event}")
+                    logger.error("TDLib error during session check: %s", event)
                     if attempt < max_retries - 1:
                         logger.info("Retrying session check after error")
                         self.destroy_client()
-                        self.client_id = self._td_create_client_id()
-                        logger.info(f"Recreated client with ID: {self.client_id}")
+                        self.client_id = self._create_client()
+                        logger.info("Recreated client with ID: %s", self.client_id)
                         await asyncio.sleep(1.0)
                         break
             await asyncio.sleep(1.0)
@@ -220,7 +437,7 @@ class TdExample:
                          first_name: str = None, last_name: str = None, email: str = None,
                          email_code: str = None) -> Dict[str, Any]:
         """Authenticate the client with provided credentials."""
-        logger.info(f"Authenticate called with phone: {phone_number}, code: {code}")
+        logger.info("Authenticate called with phone: %s, code: %s", phone_number, code)
         
         if not any([phone_number, code, password, first_name, last_name, email, email_code]):
             self.send({"@type": "getAuthorizationState"})
@@ -255,7 +472,7 @@ class TdExample:
                 if event["@type"] == "updateAuthorizationState":
                     auth_state = event["authorization_state"]
                     auth_type = auth_state["@type"]
-                    logger.info(f"Auth state: {auth_type}")
+                    logger.info("Auth state: %s", auth_type)
                     if auth_type == "authorizationStateReady":
                         return {"is_authenticated": True, "auth_state": "authenticated"}
                     elif auth_type == "authorizationStateWaitTdlibParameters":
@@ -290,31 +507,53 @@ class TdExample:
                     elif auth_type == "authorizationStateClosed":
                         logger.info("Session closed, recreating client")
                         self.destroy_client()
-                        self.client_id = self._td_create_client_id()
-                        logger.info(f"Recreated client with ID: {self.client_id}")
+                        self.client_id = self._create_client()
+                        logger.info("Recreated client with ID: %s", self.client_id)
                         return {"is_authenticated": False, "auth_state": "closed"}
                 elif event["@type"] == "authorizationStateReady":
                     logger.info("Direct authorizationStateReady received during authenticate")
                     return {"is_authenticated": True, "auth_state": "authenticated"}
                 elif event["@type"] == "error":
-                    logger.error(f"TDLib error during authenticate: {event}")
+                    logger.error("TDLib error during authenticate: %s", event)
                     return {"is_authenticated": False, "auth_state": f"error: {event['message']}"}
             await asyncio.sleep(1)
         logger.warning("No authorization state received after retries")
         return {"is_authenticated": False, "auth_state": "unknown"}
 
     async def download_file(self, file_id: int, phone_number: str, file_type: str = "voice", retries: int = 5, timeout: float = 20.0) -> Optional[str]:
+        """Download a file and return its URL, cancelling the TDLib download if every waiter goes away."""
+        self._download_waiters[file_id] = self._download_waiters.get(file_id, 0) + 1
+        cached = file_id in self.file_url_cache
+        CACHE_LOOKUPS.inc("file_url", "hit" if cached else "miss")
+        try:
+            with span("download", file_id=file_id, file_type=file_type, cached=cached):
+                file_url = await self._download_file(file_id, phone_number, file_type, retries, timeout)
+            if not cached:
+                DOWNLOADS.inc(file_type, "ok" if file_url else "failed")
+            return file_url
+        except asyncio.CancelledError:
+            DOWNLOADS.inc(file_type, "cancelled")
+            if self._download_waiters[file_id] == 1 and file_id in self._downloads_started:
+                logger.info("Download of file_id %s (%s) abandoned, cancelling it in TDLib", file_id, file_type)
+                self.send({"@type": "cancelDownloadFile", "file_id": file_id, "only_if_pending": False})
+            raise
+        finally:
+            self._download_waiters[file_id] -= 1
+            if not self._download_waiters[file_id]:
+                del self._download_waiters[file_id]
+                self._downloads_started.discard(file_id)
+
+    async def _download_file(self, file_id: int, phone_number: str, file_type: str, retries: int, timeout: float) -> Optional[str]:
         """Download a file and return its URL."""
         if file_id in self.file_url_cache:
-            logger.info(f"Returning cached URL for file_id: {file_id} ({file_type})")
+            logger.info("Returning cached URL for file_id: %s (%s)", file_id, file_type)
             return self.file_url_cache[file_id] if self.file_url_cache[file_id] else None
         
-        session_id = hashlib.md5(phone_number.encode()).hexdigest()
         target_dir = os.path.join(self.session_path, "voice" if file_type == "voice" else "profile_photos")
         os.makedirs(target_dir, exist_ok=True)
         
         for attempt in range(retries):
-            logger.info(f"Attempt {attempt + 1} to download file_id: {file_id} ({file_type}) for phone: {phone_number}")
+            logger.info("Attempt %s to download file_id: %s (%s) for phone: %s", attempt + 1, file_id, file_type, phone_number)
             self.send({"@type": "getFile", "file_id": file_id})
             download_initiated = False
             async for event in self._receive_events(timeout=timeout):
@@ -322,18 +561,20 @@ class TdExample:
                     local = event.get("local", {})
                     if local.get("is_downloading_completed", False) and local.get("path"):
                         if not os.path.exists(local["path"]):
-                            logger.warning(f"File path {local['path']} does not exist, skipping")
+                            logger.warning("File path %s does not exist, skipping", local['path'])
                             self.file_url_cache[file_id] = None
                             return None
+                        if download_initiated:
+                            DOWNLOAD_BYTES.inc(file_type, amount=event.get("size") or local.get("downloaded_size", 0))
                         file_path = local["path"]
                         file_name = os.path.basename(file_path)
                         if file_type == "voice":
                             file_name = file_name.replace(".oga", ".wav") if file_name.endswith(".oga") else f"voice_{file_id}.wav"
                             target_path = os.path.join(target_dir, file_name)
                             try:
-                                convert_oga_to_wav(file_path, target_path)
+                                await self._transcode(file_path, target_path)
                             except Exception as e:
-                                logger.error(f"Conversion failed for file_id {file_id}: {e}")
+                                logger.error("Conversion failed for file_id %s: %s", file_id, e)
                                 self.file_url_cache[file_id] = None
                                 return None
                         else:
@@ -341,17 +582,17 @@ class TdExample:
                             try:
                                 os.rename(file_path, target_path)
                             except Exception as e:
-                                logger.error(f"Failed to move profile photo for file_id {file_id}: {e}")
+                                logger.error("Failed to move profile photo for file_id %s: %s", file_id, e)
                                 self.file_url_cache[file_id] = None
                                 return None
                         
-                        file_url = f"{BACKEND_HOST}/files/{session_id}/{file_type}/{urllib.parse.quote(os.path.basename(target_path))}?phone_number={urllib.parse.quote(phone_number)}"
+                        file_url = self._file_url(phone_number, file_type, target_path)
                         self.file_url_cache[file_id] = file_url
-                        logger.info(f"Successfully retrieved file URL for file_id: {file_id} ({file_type}): {file_url}")
+                        logger.info("Successfully retrieved file URL for file_id: %s (%s): %s", file_id, file_type, file_url)
                         return file_url
                     elif not local.get("is_downloading_active", False) and not local.get("is_downloading_completed", False):
                         if not download_initiated:
-                            logger.info(f"Initiating download for file_id: {file_id} ({file_type}) on attempt {attempt + 1}")
+                            logger.info("Initiating download for file_id: %s (%s) on attempt %s", file_id, file_type, attempt + 1)
                             self.send({
                                 "@type": "downloadFile",
                                 "file_id": file_id,
@@ -361,46 +602,353 @@ class TdExample:
                                 "synchronous": True
                             })
                             download_initiated = True
+                            self._downloads_started.add(file_id)
                     else:
-                        logger.debug(f"File_id: {file_id} ({file_type}) still downloading or no path on attempt {attempt + 1}")
+                        logger.debug("File_id: %s (%s) still downloading or no path on attempt %s", file_id, file_type, attempt + 1)
                 elif event["@type"] == "error" and event.get("code") == 404:
-                    logger.warning(f"File_id {file_id} ({file_type}) not found, skipping")
+                    logger.warning("File_id %s (%s) not found, skipping", file_id, file_type)
                     self.file_url_cache[file_id] = None
                     return None
                 elif event["@type"] == "error":
-                    logger.error(f"TDLib error in download_file: {event}")
+                    logger.error("TDLib error in download_file: %s", event)
                     self.file_url_cache[file_id] = None
                     return None
             await asyncio.sleep(1.0)
-        logger.error(f"Failed to get valid URL for file_id: {file_id} ({file_type}) after {retries} attempts")
+        logger.error("Failed to get valid URL for file_id: %s (%s) after %s attempts", file_id, file_type, retries)
         self.file_url_cache[file_id] = None
         return None
 
+    async def _download_admitted(self, file_id: int, phone_number: str, file_type: str) -> Optional[str]:
+        """Download a file within the session's download admission limits."""
+        async with self.limiter.admit("download"):
+            return await self.download_file(file_id, phone_number, file_type)
+
+    @traced("batch_download_files")
     async def _batch_download_files(self, file_ids: List[tuple], phone_number: str) -> Dict[int, Optional[str]]:
         """Download multiple files in batch."""
         file_urls = {}
+        pending = []
         tasks = []
         for file_id, file_type in file_ids:
             if file_id in self.file_url_cache:
+                # Misses are counted by download_file
+                CACHE_LOOKUPS.inc("file_url", "hit")
                 file_urls[file_id] = self.file_url_cache[file_id]
-                logger.info(f"Using cached URL for file_id: {file_id} ({file_type})")
+                logger.info("Using cached URL for file_id: %s (%s)", file_id, file_type)
             else:
-                tasks.append(self.download_file(file_id, phone_number, file_type))
+                pending.append((file_id, file_type))
+                tasks.append(self._download_admitted(file_id, phone_number, file_type))
 
         results = await asyncio.gather(*tasks, return_exceptions=True)
-        for (file_id, file_type), result in zip(file_ids, results):
-            if isinstance(result, Exception):
-                logger.error(f"Failed to get file URL for file_id {file_id} ({file_type}): {result}")
+        for (file_id, file_type), result in zip(pending, results):
+            if isinstance(result, RateLimitExceeded):
+                # Not cached, so the file is retried on the next request
+                logger.warning("Download of file_id %s (%s) not admitted: %s", file_id, file_type, result)
+                file_urls[file_id] = None
+            elif isinstance(result, Exception):
+                logger.error("Failed to get file URL for file_id %s (%s): %s", file_id, file_type, result)
                 file_urls[file_id] = None
                 self.file_url_cache[file_id] = None
             else:
                 file_urls[file_id] = result
-                logger.info(f"Retrieved URL for file_id: {file_id} ({file_type}): {result}")
+                logger.info("Retrieved URL for file_id: %s (%s): %s", file_id, file_type, result)
         return file_urls
 
-    async def get_chats(self, limit: int = 20, offset: int = 0, phone_number: str = None) -> List[Dict]:
+    def _last_message_fields(self, last_message: Optional[Dict]) -> Dict[str, Any]:
+        """Extract the cached fields derived from a chat's last message."""
+        voice_file_id = None
+        waveform = None
+        if last_message and last_message["content"]["@type"] == "messageVoiceNote":
+            voice_file_id = last_message["content"]["voice_note"]["voice"]["id"]
+            waveform = last_message["content"]["voice_note"].get("waveform", "")
+        return {"last_message": last_message, "voice_file_id": voice_file_id, "waveform": waveform}
+
+    def _chat_cache_entry(self, chat: Dict) -> Dict:
+        """Build a chat cache entry from a TDLib chat object."""
+        profile_photo_id = None
+        if chat.get("photo"):
+            profile_photo_id = chat["photo"].get("small", {}).get("id")
+        positions = chat.get("positions", [])
+        order = positions[0].get("order", "0") if positions else "0"
+        return {
+            "id": chat["id"],
+            "title": chat.get("title", "Unknown Chat"),
+            "unread_count": chat.get("unread_count", 0),
+            **self._last_message_fields(chat.get("last_message")),
+            "profile_photo_id": profile_photo_id,
+            "profile_photo_preview": (chat.get("photo") or {}).get("minithumbnail"),
+            "order": order
+        }
+
+    def _touch_chat(self, chat_id: int) -> None:
+        """Bump the chat list version if a cached chat's list-relevant fields changed."""
+        chat = self.chat_cache[chat_id]
+        if chat["order"] == "0":
+            self.chat_list_versions.remove(chat_id)
+            return
+        last_message_id = chat["last_message"]["id"] if chat["last_message"] else None
+        fingerprint = (chat["order"], last_message_id, chat["unread_count"], chat["title"], chat["profile_photo_id"])
+        self.chat_list_versions.update(chat_id, fingerprint)
+
+    def _file_url(self, phone_number: str, file_type: str, path: str) -> str:
+        """Return the /files URL serving a file from the session's voice or profile photo directory."""
+        session_id = hashlib.md5(phone_number.encode()).hexdigest()
+        return f"{BACKEND_HOST}/files/{session_id}/{file_type}/{urllib.parse.quote(os.path.basename(path))}?phone_number={urllib.parse.quote(phone_number)}"
+
+    def _track_send(self, message: Dict[str, Any]) -> None:
+        """Start tracking the delivery of a message TDLib accepted for sending, under its temporary id."""
+        self._pending_sends.pop(message["@extra"], None)
+        key = (message["chat_id"], message["id"])
+        sending_state = (message.get("sending_state") or {}).get("@type")
+        self.send_status[key] = {
+            "chat_id": message["chat_id"],
+            "message_id": message["id"],
+            "state": "pending" if sending_state == "messageSendingStatePending" else "sent",
+            "final_message_id": None,
+            "upload": None,
+            "remote_file_id": None,
+            "error": None,
+            "updated": int(time.time())
+        }
+        self.sent_message_ids.add(message["id"])
+        voice_file = message.get("content", {}).get("voice_note", {}).get("voice", {})
+        if voice_file.get("id") and sending_state == "messageSendingStatePending":
+            self._uploads[voice_file["id"]] = key
+        while len(self.send_status) > SEND_STATUS_SIZE:
+            dropped, _ = self.send_status.popitem(last=False)
+            # An upload nobody tracks any more would keep the client from ever counting as idle
+            for file_id in [file_id for file_id, upload_key in self._uploads.items() if upload_key == dropped]:
+                del self._uploads[file_id]
+
+    def _apply_send_update(self, event: Dict[str, Any]) -> None:
+        """Record upload progress and the final outcome of tracked sends."""
+        if event["@type"] == "updateFile":
+            key = self._uploads.get(event["file"]["id"])
+            status = self.send_status.get(key) if key else None
+            if status is not None:
+                file = event["file"]
+                status["upload"] = {
+                    "uploaded_size": file.get("remote", {}).get("uploaded_size", 0),
+                    "size": file.get("size") or file.get("expected_size", 0)
+                }
+                status["updated"] = int(time.time())
+            return
+
+        message = event["message"]
+        status = self.send_status.get((message["chat_id"], event["old_message_id"]))
+        if status is None:
+            return
+        voice_file = message.get("content", {}).get("voice_note", {}).get("voice", {})
+        self._uploads.pop(voice_file.get("id"), None)
+        if event["@type"] == "updateMessageSendSucceeded":
+            status["state"] = "sent"
+            status["final_message_id"] = message["id"]
+            status["remote_file_id"] = voice_file.get("remote", {}).get("id")
+            self.sent_message_ids.add(message["id"])
+        else:
+            # Newer TDLib reports an error object, older versions error_code/error_message
+            error = event.get("error") or {"code": event.get("error_code"), "message": event.get("error_message")}
+            status["state"] = "failed"
+            status["error"] = {"code": error.get("code"), "message": error.get("message")}
+            flood_wait = parse_flood_wait(status["error"])
+            if flood_wait:
+                self.limiter.backoff(flood_wait)
+        status["updated"] = int(time.time())
+
+    async def request(self, query: Dict[str, Any], timeout: float = 10.0) -> Dict[str, Any]:
+        """Send a query and wait for its response, returned as-is (TDLib errors included)."""
+        extra = self._next_extra()
+        self.send({**query, "@extra": extra})
+        async for event in self._receive_events(timeout=timeout):
+            if event.get("@extra") == extra:
+                return event
+        return {"@type": "error", "code": 408, "message": f"No response to {query['@type']} within {timeout}s"}
+
+    async def get_resource_stats(self, timeout: float = 5.0) -> Dict[str, Any]:
+        """Return TDLib's network usage since start and its fast storage estimate for this session."""
+        network, storage = await asyncio.gather(
+            self.request({"@type": "getNetworkStatistics", "only_current": True}, timeout=timeout),
+            self.request({"@type": "getStorageStatisticsFast"}, timeout=timeout)
+        )
+        result: Dict[str, Any] = {}
+        if network["@type"] == "networkStatistics":
+            sent = received = 0
+            for entry in network.get("entries", []):
+                sent += entry.get("sent_bytes", 0)
+                received += entry.get("received_bytes", 0)
+            result["network"] = {"since_date": network.get("since_date"), "sent_bytes": sent, "received_bytes": received}
+        else:
+            result["network"] = {"error": network.get("message")}
+        if storage["@type"] == "storageStatisticsFast":
+            result["storage"] = {key: value for key, value in storage.items() if not key.startswith("@")}
+        else:
+            result["storage"] = {"error": storage.get("message")}
+        return result
+
+    def memory_report(self) -> Dict[str, Any]:
+        """Summarize the session's caches (entry counts and approximate bytes), in-flight work and activity."""
+        caches = {
+            "chat_cache": self.chat_cache,
+            "file_url_cache": self.file_url_cache,
+            "sent_message_ids": self.sent_message_ids,
+            "send_status": self.send_status,
+            "message_pages": self.message_cache.pages,
+            "update_journal": self.update_journal.entries,
+        }
+        return {
+            "client_id": self.client_id,
+            "last_activity": self.last_activity,
+            "idle_s": time.time() - self.last_activity,
+            "caches": {name: {"entries": len(cache), "approx_bytes": approx_size(cache)} for name, cache in caches.items()},
+            "in_flight": {
+                "tdlib_queries": len(self._request_started),
+                "pending_sends": len(self._pending_sends),
+                "uploads": len(self._uploads),
+                "downloads": len(self._download_waiters),
+                "prefetches": sum(1 for task in self._prefetch_tasks.values() if not task.done()),
+                "broadcasts": self.active_broadcasts,
+                "admitted": dict(self.limiter.in_flight),
+                "update_pump": self._pump_task is not None and not self._pump_task.done(),
+            },
+            "receivers": len(self._receivers),
+            "receiver_queue_depth": self.queue_depth(),
+            "update_subscribers": self._update_subscribers,
+        }
+
+    def get_send_status(self, chat_id: int, message_id: int) -> Optional[Dict[str, Any]]:
+        """Return the delivery status of a message sent through this client, by its temporary id."""
+        return self.send_status.get((chat_id, message_id))
+
+    async def wait_send_status(self, chat_id: int, message_id: int, timeout: float = 60.0) -> Optional[Dict[str, Any]]:
+        """Wait until a tracked send leaves the pending state, and return its status."""
+        status = self.get_send_status(chat_id, message_id)
+        if status is None or status["state"] != "pending":
+            return status
+        async for _ in self._receive_events(timeout=timeout):
+            if status["state"] != "pending":
+                break
+        return status
+
+    async def send_pending(self, chat_id: int, input_message_content: Dict[str, Any], timeout: float = 20.0) -> Dict[str, Any]:
+        """Hand a message to TDLib and return the pending message, without waiting for its delivery.
+
+        An error TDLib didn't send is definitive; a timeout is marked `unconfirmed`, as TDLib may have sent the message.
+        """
+        extra = self._next_extra()
+        self._pending_sends[extra] = chat_id
+        try:
+            self.send({
+                "@type": "sendMessage",
+                "chat_id": chat_id,
+                "input_message_content": input_message_content,
+                "@extra": extra
+            })
+            async for event in self._receive_events(timeout=timeout):
+                if event.get("@extra") != extra:
+                    continue
+                if event["@type"] == "message":
+                    return event
+                if event["@type"] == "error":
+                    return event
+            return {"@type": "error", "message": "No valid message event received", "unconfirmed": True}
+        finally:
+            self._pending_sends.pop(extra, None)
+
+    def _apply_chat_update(self, event: Dict[str, Any]) -> None:
+        """Keep the chat cache and chat list version current from TDLib chat updates."""
+        update_type = event["@type"]
+        if update_type == "updateNewChat":
+            chat = self._chat_cache_entry(event["chat"])
+            self.chat_cache[chat["id"]] = chat
+            self._touch_chat(chat["id"])
+            return
+
+        chat_id = event["chat_id"]
+        if update_type == "updateChatRemovedFromList":
+            self.chat_list_versions.remove(chat_id)
+            return
+        chat = self.chat_cache.get(chat_id)
+        if chat is None:
+            return
+        if update_type == "updateChatLastMessage":
+            chat.update(self._last_message_fields(event.get("last_message")))
+            positions = event.get("positions", [])
+            if positions:
+                chat["order"] = positions[0].get("order", "0")
+        elif update_type == "updateChatPosition":
+            position = event["position"]
+            if position["list"]["@type"] == "chatListMain":
+                chat["order"] = position.get("order", "0")
+        elif update_type == "updateChatReadInbox":
+            chat["unread_count"] = event.get("unread_count", 0)
+        elif update_type == "updateChatTitle":
+            chat["title"] = event.get("title", "Unknown Chat")
+        elif update_type == "updateChatPhoto":
+            chat["profile_photo_id"] = (event.get("photo") or {}).get("small", {}).get("id")
+        self._touch_chat(chat_id)
+
+    def unresolved_media(self, chats: List[Dict] = (), messages: List[Dict] = ()) -> bool:
+        """Whether formatted chats or messages lack a voice or profile photo URL, because its download failed or wasn't admitted."""
+        for chat in chats:
+            cached = self.chat_cache.get(chat["id"], {})
+            if cached.get("profile_photo_id") and not chat["profile_photo_url"]:
+                return True
+            if cached.get("voice_file_id") and chat["last_message"]["content"]["@type"] != "messageVoiceNote":
+                return True
+        return any(message["is_voice"] and not message["voice_url"] for message in messages)
+
+    def _format_chat(self, chat: Dict, file_urls: Dict[int, Optional[str]], include_preview: bool = False) -> Dict:
+        """Build the API representation of a cached chat with resolved voice and profile photo URLs."""
+        chat = dict(chat)
+        if not include_preview:
+            del chat["profile_photo_preview"]
+        last_message = chat["last_message"]
+        if last_message and last_message["content"]["@type"] == "messageVoiceNote":
+            voice_file_id = chat["voice_file_id"]
+            voice_url = file_urls.get(voice_file_id) if voice_file_id else None
+            waveform = chat["waveform"]
+            if isinstance(waveform, str) and waveform:
+                try:
+                    waveform_data = [b / 255.0 for b in base64.b64decode(waveform)]
+                    logger.info("Decoded waveform for chat %s: %s...", chat['id'], waveform_data[:10])
+                except Exception as e:
+                    logger.error("Failed to decode waveform for chat %s: %s", chat['id'], e)
+                    waveform_data = [0.1] * 60
+            else:
+                logger.warning("No waveform data for chat %s, using default", chat['id'])
+                waveform_data = [0.1] * 60
+            if voice_url:
+                content = {
+                    "@type": "messageVoiceNote",
+                    "text": "🔈 پیغام صوتی",
+                    "voice_note": {
+                        "duration": last_message["content"]["voice_note"]["duration"],
+                        "waveform": waveform_data,
+                        "voice": {
+                            **last_message["content"]["voice_note"]["voice"],
+                            "remote": {
+                                **last_message["content"]["voice_note"]["voice"].get("remote", {}),
+                                "url": voice_url
+                            }
+                        }
+                    }
+                }
+            else:
+                content = {
+                    "@type": "messageText",
+                    "text": {"@type": "formattedText", "text": "[Voice Message Unavailable]"}
+                }
+            chat["last_message"] = {**last_message, "content": content}
+        chat["profile_photo_url"] = file_urls.get(chat["profile_photo_id"]) if chat["profile_photo_id"] else None
+        del chat["voice_file_id"]
+        del chat["waveform"]
+        del chat["profile_photo_id"]
+        return chat
+
+    @traced("get_chats")
+    async def get_chats(self, limit: int = 20, offset: int = 0, phone_number: str = None, include_previews: bool = False) -> List[Dict]:
         """Retrieve a list of chats."""
-        logger.info(f"Fetching chats with limit={limit}, offset={offset}")
+        logger.info("Fetching chats with limit=%s, offset=%s", limit, offset)
         if offset == 0:
             self.chat_cache.clear()
             logger.info("Cleared chat cache for fresh fetch")
@@ -439,41 +987,18 @@ class TdExample:
                         if chat_id not in chat_ids:
                             chat_ids.append(chat_id)
                             self.send({"@type": "getChat", "chat_id": chat_id})
-                    logger.info(f"Received {len(new_chat_ids)} chat IDs: {new_chat_ids}")
+                    logger.info("Received %s chat IDs: %s", len(new_chat_ids), new_chat_ids)
                 elif event["@type"] == "updateNewChat":
-                    chat = event["chat"]
-                    chat_id = chat["id"]
-                    last_message = chat.get("last_message")
-                    voice_file_id = None
-                    waveform = None
-                    profile_photo_id = None
-                    if last_message and last_message["content"]["@type"] == "messageVoiceNote":
-                        voice_file_id = last_message["content"]["voice_note"]["voice"]["id"]
-                        waveform = last_message["content"]["voice_note"].get("waveform", "")
-                    if chat.get("photo"):
-                        profile_photo_id = chat["photo"].get("small", {}).get("id")
-                    positions = chat.get("positions", [])
-                    order = positions[0].get("order", "0") if positions else "0"
-
-                    self.chat_cache[chat_id] = {
-                        "id": chat_id,
-                        "title": chat.get("title", "Unknown Chat"),
-                        "last_message": last_message,
-                        "unread_count": chat.get("unread_count", 0),
-                        "voice_file_id": voice_file_id,
-                        "waveform": waveform,
-                        "profile_photo_id": profile_photo_id,
-                        "order": order
-                    }
-                    logger.info(f"Updated/Added chat to cache: {chat_id}")
+                    # Already cached by _apply_chat_update when the event was dispatched
+                    logger.info("Updated/Added chat to cache: %s", event['chat']['id'])
                 elif event["@type"] == "updateChatAddedToList":
                     chat_id = event["chat_id"]
                     if chat_id in self.chat_cache and chat_id not in chat_ids:
                         chat_ids.append(chat_id)
                         self.send({"@type": "getChat", "chat_id": chat_id})
-                        logger.info(f"Chat {chat_id} added to list via updateChatAddedToList")
+                        logger.info("Chat %s added to list via updateChatAddedToList", chat_id)
                 elif event["@type"] == "error":
-                    logger.error(f"TDLib error in get_chats: {event}")
+                    logger.error("TDLib error in get_chats: %s", event)
 
         for chat_id in chat_ids:
             if chat_id not in self.chat_cache:
@@ -483,33 +1008,14 @@ class TdExample:
             async for event in self._receive_events(timeout=1.0):
                 if event["@type"] == "chat":
                     chat_id = event["id"]
-                    last_message = event.get("last_message")
-                    voice_file_id = None
-                    waveform = None
-                    profile_photo_id = None
-                    if last_message and last_message["content"]["@type"] == "messageVoiceNote":
-                        voice_file_id = last_message["content"]["voice_note"]["voice"]["id"]
-                        waveform = last_message["content"]["voice_note"].get("waveform", "")
-                    if event.get("photo"):
-                        profile_photo_id = event["photo"].get("small", {}).get("id")
-
-                    positions = event.get("positions", [])
-                    order = positions[0].get("order", "0") if positions else "0"
-
-                    if chat_id not in self.chat_cache or self.chat_cache[chat_id]["order"] != order or self.chat_cache[chat_id]["profile_photo_id"] != profile_photo_id:
-                        self.chat_cache[chat_id] = {
-                            "id": chat_id,
-                            "title": event.get("title", "Unknown Chat"),
-                            "last_message": last_message,
-                            "unread_count": event.get("unread_count", 0),
-                            "voice_file_id": voice_file_id,
-                            "waveform": waveform,
-                            "profile_photo_id": profile_photo_id,
-                            "order": order
-                        }
-                        logger.info(f"Updated/Fetched details for chat: {chat_id}")
+                    chat = self._chat_cache_entry(event)
+                    cached = self.chat_cache.get(chat_id)
+                    if not cached or cached["order"] != chat["order"] or cached["profile_photo_id"] != chat["profile_photo_id"]:
+                        self.chat_cache[chat_id] = chat
+                        self._touch_chat(chat_id)
+                        logger.info("Updated/Fetched details for chat: %s", chat_id)
                 elif event["@type"] == "error":
-                    logger.error(f"TDLib error in get_chat: {event}")
+                    logger.error("TDLib error in get_chat: %s", event)
 
         seen_chat_ids = set()
         for chat_id in chat_ids:
@@ -526,91 +1032,135 @@ class TdExample:
 
         if phone_number:
             file_urls = await self._batch_download_files(file_ids, phone_number)
-            for chat in chats:
-                if chat["last_message"] and chat["last_message"]["content"]["@type"] == "messageVoiceNote":
-                    voice_file_id = chat["voice_file_id"]
-                    voice_url = file_urls.get(voice_file_id) if voice_file_id else None
-                    waveform = chat["waveform"]
-                    if isinstance(waveform, str) and waveform:
-                        try:
-                            waveform_data = [b / 255.0 for b in base64.b64decode(waveform)]
-                            logger.info(f"Decoded waveform for chat {chat['id']}: {waveform_data[:10]}...")
-                        except Exception as e:
-                            logger.error(f"Failed to decode waveform for chat {chat['id']}: {e}")
-                            waveform_data = [0.1] * 60
-                    else:
-                        logger.warning(f"No waveform data for chat {chat['id']}, using default")
-                        waveform_data = [0.1] * 60
-                    if voice_url:
-                        chat["last_message"]["content"] = {
-                            "@type": "messageVoiceNote",
-                            "text": "🔈 پیغام صوتی",
-                            "voice_note": {
-                                "duration": chat["last_message"]["content"]["voice_note"]["duration"],
-                                "waveform": waveform_data,
-                                "voice": {
-                                    **chat["last_message"]["content"]["voice_note"]["voice"],
-                                    "remote": {
-                                        **chat["last_message"]["content"]["voice_note"]["voice"].get("remote", {}),
-                                        "url": voice_url
-                                    }
-                                }
-                            }
-                        }
-                    else:
-                        chat["last_message"]["content"] = {
-                            "@type": "messageText",
-                            "text": {"@type": "formattedText", "text": "[Voice Message Unavailable]"}
-                        }
-                profile_photo_url = file_urls.get(chat["profile_photo_id"]) if chat["profile_photo_id"] else None
-                chat["profile_photo_url"] = profile_photo_url
-                del chat["voice_file_id"]
-                del chat["waveform"]
-                del chat["profile_photo_id"]
+            chats = [self._format_chat(chat, file_urls, include_preview=include_previews) for chat in chats]
 
-        logger.info(f"Returning {len(chats)} chats")
+        logger.info("Returning %s chats", len(chats))
         return chats
 
-    async def get_messages(self, chat_id: int, limit: int = 50, from_message_id: int = 0, phone_number: str = None) -> List[Dict]:
-        """Retrieve messages from a specific chat."""
-        logger.info(f"Fetching messages for chat_id={chat_id}, limit={limit}, from_message_id={from_message_id}")
-
-        # Verify chat existence
-        self.send({"@type": "getChat", "chat_id": chat_id})
-        chat_exists = False
-        async for event in self._receive_events(timeout=5.0):
-            if event["@type"] == "chat" and event["id"] == chat_id:
-                chat_exists = True
-                logger.info(f"Chat {chat_id} exists: {event['title']}")
-                break
-            elif event["@type"] == "error":
-                logger.error(f"Error verifying chat {chat_id}: {event}")
-                return []
+    async def get_chat_changes(self, since_version: int = 0, epoch: Optional[str] = None, phone_number: str = None) -> Dict[str, Any]:
+        """Return the chats whose position, last message, unread count or title changed since a chat list version.
 
-        if not chat_exists:
-            logger.error(f"Chat {chat_id} does not exist or is inaccessible")
-            return []
+        Like get_chats, the voice notes and profile photos of the changed chats are downloaded if needed.
+        """
+        await self.drain_updates()
+        delta = self.chat_list_versions.since(since_version, epoch)
+        changed = [self.chat_cache[chat_id] for chat_id in delta.pop("changed") if chat_id in self.chat_cache]
+        file_urls = self.file_url_cache
+        if phone_number:
+            file_ids = []
+            for chat in changed:
+                if chat["voice_file_id"]:
+                    file_ids.append((chat["voice_file_id"], "voice"))
+                if chat["profile_photo_id"]:
+                    file_ids.append((chat["profile_photo_id"], "profile_photo"))
+            file_urls = await self._batch_download_files(file_ids, phone_number)
+        chats = [self._format_chat(chat, file_urls) for chat in changed]
+        chats.sort(key=lambda x: int(x["order"] or "0"), reverse=True)
+        logger.info("Returning %s changed and %s removed chats since version %s", len(chats), len(delta['removed']), since_version)
+        return {**delta, "chats": chats}
+
+    async def get_messages(self, chat_id: int, limit: int = 50, from_message_id: int = 0, phone_number: str = None,
+                           prefetch: bool = False) -> List[Dict]:
+        """Retrieve messages from a specific chat.
+
+        With `prefetch`, the next older page is fetched in the background afterwards, so scrolling up usually
+        finds it in the message cache.
+        """
+        messages = self.message_cache.get(chat_id, limit, from_message_id)
+        CACHE_LOOKUPS.inc("message_page", "miss" if messages is None else "hit")
+        if messages is not None:
+            logger.info("Returning %s cached messages for chat_id=%s, from_message_id=%s", len(messages), chat_id, from_message_id)
+        else:
+            messages = await self._fetch_messages(chat_id, limit, from_message_id, phone_number)
+        if prefetch and messages:
+            self._schedule_prefetch(chat_id, limit, min(message["id"] for message in messages), phone_number)
+        return messages
+
+    def _schedule_prefetch(self, chat_id: int, limit: int, from_message_id: int, phone_number: Optional[str]) -> None:
+        """Start fetching the page before `from_message_id`, cancelling prefetches of chats the user has left."""
+        for other_chat_id in [other for other in self._prefetch_tasks if other != chat_id]:
+            self.cancel_prefetch(other_chat_id)
+        task = self._prefetch_tasks.get(chat_id)
+        if task is not None and not task.done():
+            return
+        if (chat_id, limit, from_message_id) in self.message_cache.pages:
+            return
+        self._prefetch_tasks[chat_id] = asyncio.ensure_future(self._prefetch(chat_id, limit, from_message_id, phone_number))
+
+    async def _prefetch(self, chat_id: int, limit: int, from_message_id: int, phone_number: Optional[str]) -> None:
+        try:
+            # Let the response that triggered the prefetch go out first
+            await asyncio.sleep(PREFETCH_DELAY)
+            # Prefetching is only worth doing with spare capacity, so it never queues for admission
+            async with self.limiter.admit("read", max_wait=0):
+                messages = await self._fetch_messages(chat_id, limit, from_message_id, phone_number)
+            if messages:
+                self.message_cache.put(chat_id, limit, from_message_id, messages)
+                logger.info("Prefetched %s messages for chat_id=%s before %s", len(messages), chat_id, from_message_id)
+        except RateLimitExceeded:
+            logger.info("Skipping prefetch for chat_id=%s, no spare read capacity", chat_id)
+        except asyncio.CancelledError:
+            logger.info("Prefetch for chat_id=%s cancelled", chat_id)
+        except Exception as e:
+            logger.error("Prefetch for chat_id=%s failed: %s", chat_id, e)
+        finally:
+            if self._prefetch_tasks.get(chat_id) is asyncio.current_task():
+                del self._prefetch_tasks[chat_id]
+
+    def cancel_prefetch(self, chat_id: int) -> None:
+        """Cancel the background page fetch of a chat, e.g. when the user leaves it."""
+        task = self._prefetch_tasks.pop(chat_id, None)
+        if task is not None and not task.done():
+            task.cancel()
+
+    @traced("fetch_messages")
+    async def _fetch_messages(self, chat_id: int, limit: int, from_message_id: int, phone_number: Optional[str]) -> List[Dict]:
+        """Fetch and format a page of a chat's history from TDLib."""
+        logger.info("Fetching messages for chat_id=%s, limit=%s, from_message_id=%s", chat_id, limit, from_message_id)
+
+        # Verify chat existence unless the chat list already returned it;
+        # responses are matched by "@extra" so concurrent requests don't cross
+        CACHE_LOOKUPS.inc("chat", "hit" if chat_id in self.chat_cache else "miss")
+        if chat_id not in self.chat_cache:
+            extra = self._next_extra()
+            self.send({"@type": "getChat", "chat_id": chat_id, "@extra": extra})
+            chat_exists = False
+            async for event in self._receive_events(timeout=5.0):
+                if event["@type"] == "chat" and event["id"] == chat_id:
+                    chat_exists = True
+                    logger.info("Chat %s exists: %s", chat_id, event['title'])
+                    break
+                elif event["@type"] == "error" and event.get("@extra") == extra:
+                    logger.error("Error verifying chat %s: %s", chat_id, event)
+                    return []
+
+            if not chat_exists:
+                logger.error("Chat %s does not exist or is inaccessible", chat_id)
+                return []
 
         # Fetch message history
+        extra = self._next_extra()
         self.send({
             "@type": "getChatHistory",
             "chat_id": chat_id,
             "limit": limit,
             "from_message_id": from_message_id,
             "offset": 0,
-            "only_local": False
+            "only_local": False,
+            "@extra": extra
         })
 
         messages = []
         file_ids_to_download = []
+        voice_file_ids = {}
         seen_message_ids = set()
         async for event in self._receive_events(timeout=20.0):
-            if event["@type"] == "messages":
-                logger.info(f"Received messages event with {len(event.get('messages', []))} messages")
+            if event["@type"] == "messages" and event.get("@extra") == extra:
+                logger.info("Received messages event with %s messages", len(event.get('messages', [])))
                 for msg in event.get("messages", []):
                     message_id = msg["id"]
                     if message_id in seen_message_ids:
-                        logger.debug(f"Skipping duplicate message ID: {message_id}")
+                        logger.debug("Skipping duplicate message ID: %s", message_id)
                         continue
                     seen_message_ids.add(message_id)
 
@@ -628,13 +1178,14 @@ class TdExample:
                         voice = content.get("voice_note", {})
                         if voice.get("voice", {}).get("id"):
                             file_ids_to_download.append((voice["voice"]["id"], "voice"))
+                            voice_file_ids[message_id] = voice["voice"]["id"]
                         duration = voice.get("duration", 0)
                         waveform = voice.get("waveform", "")
                         if waveform:
                             try:
                                 waveform_data = [b / 31.0 for b in base64.b64decode(waveform)]
                             except Exception as e:
-                                logger.error(f"Failed to decode waveform for message {message_id}: {e}")
+                                logger.error("Failed to decode waveform for message %s: %s", message_id, e)
                                 waveform_data = [0.1] * 60
                         else:
                             waveform_data = [0.1] * 60
@@ -653,8 +1204,9 @@ class TdExample:
                             "waveform_data": waveform_data,
                             "status": status
                         })
-            elif event["@type"] == "error":
-                logger.error(f"TDLib error in get_messages: {event}")
+                break
+            elif event["@type"] == "error" and event.get("@extra") == extra:
+                logger.error("TDLib error in get_messages: %s", event)
                 return messages
 
         # Download voice files if necessary
@@ -662,101 +1214,142 @@ class TdExample:
             file_urls = await self._batch_download_files(file_ids_to_download, phone_number)
             for msg in messages:
                 if msg["is_voice"] and not msg["voice_url"]:
-                    voice_id = next((fid for fid, ftype in file_ids_to_download if ftype == "voice"), None)
+                    voice_id = voice_file_ids.get(msg["id"])
                     if voice_id and file_urls.get(voice_id):
                         msg["voice_url"] = file_urls[voice_id]
 
         messages.sort(key=lambda x: x["date"])
-        logger.info(f"Returning {len(messages)} messages for chat_id={chat_id}")
+        logger.info("Returning %s messages for chat_id=%s", len(messages), chat_id)
         return messages
 
+    @traced("get_bootstrap")
+    async def get_bootstrap(self, chat_limit: int = 20, top_chats: int = 5, message_limit: int = 20, phone_number: str = None) -> Dict[str, Any]:
+        """Retrieve the first chat page together with the newest messages of the top chats."""
+        logger.info("Bootstrapping with chat_limit=%s, top_chats=%s, message_limit=%s", chat_limit, top_chats, message_limit)
+        chats = await self.get_chats(limit=chat_limit, offset=0, phone_number=phone_number, include_previews=True)
+        top_chat_ids = [chat["id"] for chat in chats[:top_chats]]
+        # History requests are matched by "@extra", so they can be pipelined instead of issued one by one
+        pages = await asyncio.gather(
+            *(self.get_messages(chat_id=chat_id, limit=message_limit, phone_number=phone_number) for chat_id in top_chat_ids),
+            return_exceptions=True
+        )
+        messages = {}
+        for chat_id, page in zip(top_chat_ids, pages):
+            if isinstance(page, Exception):
+                logger.error("Failed to fetch messages for chat %s during bootstrap: %s", chat_id, page)
+                page = []
+            messages[str(chat_id)] = page
+        return {
+            "chats": chats,
+            "messages": messages,
+            "version": self.chat_list_versions.version,
+            "epoch": self.chat_list_versions.epoch
+        }
+
     async def send_message(self, chat_id: int, text: str) -> Dict:
-        """Send a text message to a specific chat."""
-        logger.info(f"Sending message to chat_id={chat_id}, text={text}")
-        message_id = None
-        self.send({
-            "@type": "sendMessage",
-            "chat_id": chat_id,
-            "input_message_content": {
-                "@type": "inputMessageText",
-                "text": {"@type": "formattedText", "text": text}
-            }
+        """Send a text message to a specific chat.
+
+        Returns as soon as TDLib accepts the message, with its temporary id and a "pending" status;
+        delivery is tracked by get_send_status and pushed as updateMessageSendSucceeded/Failed.
+        """
+        logger.info("Sending message to chat_id=%s, text=%s", chat_id, text)
+        event = await self.send_pending(chat_id, {
+            "@type": "inputMessageText",
+            "text": {"@type": "formattedText", "text": text}
         })
+        if event["@type"] == "error":
+            logger.error("TDLib error in send_message: %s", event)
+            return {"status": "error", "message": event["message"], "unconfirmed": event.get("unconfirmed", False)}
+        status = self.get_send_status(chat_id, event["id"])
+        return {
+            "id": event["id"],
+            "chat_id": chat_id,
+            "content": text,
+            "is_voice": False,
+            "voice_url": None,
+            "duration": 0,
+            "is_outgoing": True,
+            "date": event.get("date", int(time.time())),
+            "waveform_data": None,
+            "status": status["state"] if status else "pending"
+        }
 
-        async for event in self._receive_events(timeout=20.0):
-            if event["@type"] == "message":
-                if event["chat_id"] == chat_id and event.get("content", {}).get("text", {}).get("text") == text:
-                    message_id = event["id"]
-                    self.sent_message_ids.add(message_id)
-                    return {
-                        "id": message_id,
-                        "chat_id": chat_id,
-                        "content": text,
-                        "is_voice": False,
-                        "voice_url": None,
-                        "duration": 0,
-                        "is_outgoing": True,
-                        "date": event.get("date", int(time.time())),
-                        "waveform_data": None,
-                        "status": "success"
-                    }
-            elif event["@type"] == "error":
-                logger.error(f"TDLib error in send_message: {event}")
-                return {"status": "error", "message": event["message"]}
-        logger.warning("No message event received for send_message")
-        return {"status": "error", "message": "No valid message event received"}
+    async def _transcode(self, source_path: str, target_path: str, reverse: bool = False) -> None:
+        """Convert OGG to WAV (or back, with `reverse`) in the executor, so the event loop isn't blocked."""
+        TRANSCODES_QUEUED.inc()
+        start = time.perf_counter()
+        try:
+            with span("transcode", direction="wav_to_ogg" if reverse else "ogg_to_wav"):
+                await asyncio.get_event_loop().run_in_executor(None, convert_oga_to_wav, source_path, target_path, reverse)
+        finally:
+            TRANSCODES_QUEUED.dec()
+            TRANSCODE_SECONDS.observe(time.perf_counter() - start, "wav_to_ogg" if reverse else "ogg_to_wav")
 
+    async def prepare_voice_note(self, voice_path: str, duration: int) -> Dict[str, Any]:
+        """Encode a WAV recording to OGG/Opus once and return the inputMessageVoiceNote content sending it."""
+        ogg_path = os.path.splitext(voice_path)[0] + ".ogg"
+        await self._transcode(voice_path, ogg_path, reverse=True)
+        waveform_data = await asyncio.get_event_loop().run_in_executor(None, generate_waveform, voice_path)
+        waveform_b64 = base64.b64encode(bytes([int(x * 31) for x in waveform_data])).decode("utf-8")
+        return {
+            "@type": "inputMessageVoiceNote",
+            "voice_note": {
+                "@type": "inputFileLocal",
+                "path": ogg_path
+            },
+            "duration": duration,
+            "waveform": waveform_b64
+        }
+
+    @traced("send_voice_message")
     async def send_voice_message(self, chat_id: int, voice_path: str, duration: int, phone_number: str) -> Dict:
-        """Send a voice message to a specific chat."""
-        logger.info(f"Sending voice message to chat_id={chat_id}, voice_path={voice_path}, duration={duration}")
+        """Send a voice message to a specific chat.
+
+        Returns once TDLib accepts the message, like send_message; the upload runs in the background.
+        """
+        logger.info("Sending voice message to chat_id=%s, voice_path=%s, duration=%s", chat_id, voice_path, duration)
         if not os.path.exists(voice_path):
-            logger.error(f"Voice file not found: {voice_path}")
+            logger.error("Voice file not found: %s", voice_path)
             return {"status": "error", "message": "Voice file not found"}
 
         try:
-            audio = AudioSegment.from_file(voice_path)
-            waveform_data = generate_waveform(voice_path)
+            loop = asyncio.get_event_loop()
+            # Waveform extraction decodes the recording, which is CPU bound, so keep it off the event loop
+            waveform_data = await loop.run_in_executor(None, generate_waveform, voice_path)
             waveform_data = [x * 31 for x in waveform_data]
             waveform_b64 = base64.b64encode(bytes([int(x) for x in waveform_data])).decode("utf-8")
 
-            self.send({
-                "@type": "sendMessage",
-                "chat_id": chat_id,
-                "input_message_content": {
-                    "@type": "inputMessageVoiceNote",
-                    "voice_note": {
-                        "@type": "inputFileLocal",
-                        "path": voice_path
-                    },
-                    "duration": duration,
-                    "waveform": waveform_b64
-                }
+            event = await self.send_pending(chat_id, {
+                "@type": "inputMessageVoiceNote",
+                "voice_note": {
+                    "@type": "inputFileLocal",
+                    "path": voice_path
+                },
+                "duration": duration,
+                "waveform": waveform_b64
             })
+            if event["@type"] == "error":
+                logger.error("TDLib error in send_voice_message: %s", event)
+                return {"status": "error", "message": event["message"], "unconfirmed": event.get("unconfirmed", False)}
 
-            message_id = None
-            async for event in self._receive_events(timeout=20.0):
-                if event["@type"] == "message" and event["chat_id"] == chat_id and event.get("content", {}).get("@type") == "messageVoiceNote":
-                    message_id = event["id"]
-                    voice_id = event["content"]["voice_note"]["voice"]["id"]
-                    self.sent_message_ids.add(message_id)
-                    voice_url = await self.download_file(voice_id, phone_number, "voice")
-                    return {
-                        "id": message_id,
-                        "chat_id": chat_id,
-                        "content": "🔈 پیغام صوتی",
-                        "is_voice": True,
-                        "voice_url": voice_url,
-                        "duration": duration,
-                        "is_outgoing": True,
-                        "date": event.get("date", int(time.time())),
-                        "waveform_data": waveform_data,
-                        "status": "success"
-                    }
-                elif event["@type"] == "error":
-                    logger.error(f"TDLib error in send_voice_message: {event}")
-                    return {"status": "error", "message": event["message"]}
-            logger.warning("No message event received for send_voice_message")
-            return {"status": "error", "message": "No valid message event received"}
+            # The uploaded WAV is already in the session's voice directory, so serve it instead of downloading it back
+            voice_id = event.get("content", {}).get("voice_note", {}).get("voice", {}).get("id")
+            voice_url = self._file_url(phone_number, "voice", voice_path)
+            if voice_id:
+                self.file_url_cache[voice_id] = voice_url
+            status = self.get_send_status(chat_id, event["id"])
+            return {
+                "id": event["id"],
+                "chat_id": chat_id,
+                "content": "🔈 پیغام صوتی",
+                "is_voice": True,
+                "voice_url": voice_url,
+                "duration": duration,
+                "is_outgoing": True,
+                "date": event.get("date", int(time.time())),
+                "waveform_data": waveform_data,
+                "status": status["state"] if status else "pending"
+            }
         except Exception as e:
-            logger.error(f"Error processing voice message: {e}")
+            logger.error("Error processing voice message: %s", e)
             return {"status": "error", "message": str(e)}
\ No newline at end of file
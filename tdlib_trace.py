@@ -0,0 +1,91 @@
+import atexit
+import gzip
+import json
+import logging
+import os
+import re
+import time
+from typing import Any, Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+# Values replaced entirely: credentials and contact details
+SCRUBBED_KEYS = {"phone_number", "phone", "password", "email_address", "token", "first_name", "last_name", "title",
+                 "api_id", "api_hash"}
+# Scrubbed only as strings: "code" is the login code of checkAuthenticationCode, but an integer in errors
+STRING_SCRUBBED_KEYS = {"code"}
+# Free text replaced by a placeholder of the same length, so payload sizes stay realistic
+TEXT_KEYS = {"text", "caption"}
+PHONE_PATTERN = re.compile(r"\+\d{7,15}")
+# Session directories are named by the md5 of the phone number, e.g. in database_directory and file paths
+SESSION_DIR_PATTERN = re.compile(r"(?<=sessions[/\\])[0-9a-f]{32}")
+
+def scrub(value: Any, key: Optional[str] = None, pseudonyms: Optional[Dict[str, str]] = None) -> Any:
+    """Return a copy of a TDLib object with phone numbers, credentials and message text removed.
+
+    Session directory names are replaced by pseudonyms from `pseudonyms`, which is extended as new ones
+    are seen, so paths of one account stay consistent within a trace.
+    """
+    if isinstance(value, dict):
+        return {k: scrub(v, k, pseudonyms) for k, v in value.items()}
+    if isinstance(value, list):
+        return [scrub(item, key, pseudonyms) for item in value]
+    if key in SCRUBBED_KEYS and value is not None:
+        return "<scrubbed>"
+    if key in STRING_SCRUBBED_KEYS and isinstance(value, str):
+        return "<scrubbed>"
+    if isinstance(value, str):
+        if key in TEXT_KEYS:
+            return "x" * len(value)
+        value = SESSION_DIR_PATTERN.sub(lambda match: _pseudonym(match.group(0), pseudonyms), value)
+        return PHONE_PATTERN.sub("<phone>", value)
+    return value
+
+def _pseudonym(session_id: str, pseudonyms: Optional[Dict[str, str]]) -> str:
+    if pseudonyms is None:
+        return "session"
+    if session_id not in pseudonyms:
+        pseudonyms[session_id] = f"session{len(pseudonyms) + 1}"
+    return pseudonyms[session_id]
+
+class TraceRecorder:
+    """Writes TDLib queries and events to a gzip JSON-lines trace, one {"t", "dir", "client_id", "data"} per line.
+
+    "t" is seconds since the recording started and "dir" is "send" or "recv".
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = gzip.open(path, "wt", encoding="utf-8", compresslevel=6)
+        self.started = time.monotonic()
+        self.records = 0
+        self.pseudonyms: Dict[str, str] = {}
+        atexit.register(self.close)
+        logger.info("Recording TDLib traffic to %s", path)
+
+    def record(self, direction: str, client_id: Optional[int], data: Dict[str, Any]) -> None:
+        if self.file is None:
+            return
+        line = {"t": round(time.monotonic() - self.started, 6), "dir": direction, "client_id": client_id, "data": scrub(data, pseudonyms=self.pseudonyms)}
+        self.file.write(json.dumps(line, ensure_ascii=False) + "\n")
+        self.records += 1
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            logger.info("Closed TDLib trace %s with %s records", self.path, self.records)
+
+def open_recorder(trace_dir: Optional[str]) -> Optional[TraceRecorder]:
+    """Start a trace file for this process in `trace_dir`, or return None when recording is disabled."""
+    if not trace_dir:
+        return None
+    os.makedirs(trace_dir, exist_ok=True)
+    return TraceRecorder(os.path.join(trace_dir, f"tdlib-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.jsonl.gz"))
+
+def read_trace(path: str) -> Iterator[Dict[str, Any]]:
+    """Yield the records of a trace file in order."""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+
+from admission import RateLimitExceeded, SessionLimiter, TokenBucket, parse_flood_wait
+
+def test_token_bucket_allows_a_burst_then_waits():
+    bucket = TokenBucket(rate=1.0, burst=2)
+    assert bucket.try_acquire() == 0.0
+    assert bucket.try_acquire() == 0.0
+    delay = bucket.try_acquire()
+    assert 0.9 < delay <= 1.0
+
+def test_token_bucket_refills_up_to_burst():
+    bucket = TokenBucket(rate=10.0, burst=2)
+    bucket.tokens = 0.0
+    bucket.updated -= 10.0
+    assert bucket.try_acquire() == 0.0
+    assert bucket.tokens == pytest.approx(1.0)
+
+def test_token_bucket_refund_is_capped_at_burst():
+    bucket = TokenBucket(rate=0.001, burst=1)
+    bucket.try_acquire()
+    bucket.refund()
+    bucket.refund()
+    assert bucket.tokens == 1.0
+
+@pytest.mark.parametrize("error, seconds", [
+    ({"@type": "error", "code": 420, "message": "FLOOD_WAIT_17"}, 17),
+    ({"@type": "error", "code": 429, "message": "Too Many Requests: retry after 5"}, 5),
+    ({"@type": "error", "code": 429, "message": "Too Many Requests"}, 1),
+    ({"@type": "error", "code": 400, "message": "Chat not found"}, None),
+    ({"@type": "error", "code": 400}, None),
+])
+def test_parse_flood_wait(error, seconds):
+    assert parse_flood_wait(error) == seconds
+
+LIMITS = {"send": {"rate": 0.001, "burst": 2, "concurrency": 1}}
+
+def test_admit_rejects_when_the_bucket_is_empty():
+    async def scenario():
+        limiter = SessionLimiter(LIMITS, max_wait=0.05)
+        for _ in range(2):
+            async with limiter.admit("send"):
+                pass
+        with pytest.raises(RateLimitExceeded) as error:
+            async with limiter.admit("send"):
+                pass
+        return limiter, error.value
+
+    limiter, error = asyncio.run(scenario())
+    assert error.op_class == "send"
+    assert error.retry_after > 0
+    assert limiter.rejected["send"] == 1
+
+def test_concurrency_rejection_refunds_the_token():
+    async def scenario():
+        limiter = SessionLimiter(LIMITS, max_wait=0.05)
+        release = asyncio.Event()
+
+        async def hold():
+            async with limiter.admit("send"):
+                await release.wait()
+
+        holder = asyncio.ensure_future(hold())
+        await asyncio.sleep(0)
+        with pytest.raises(RateLimitExceeded):
+            async with limiter.admit("send"):
+                pass
+        tokens = limiter.buckets["send"].tokens
+        release.set()
+        await holder
+        return limiter, tokens
+
+    limiter, tokens = asyncio.run(scenario())
+    assert tokens == pytest.approx(1.0, abs=0.01)
+    assert limiter.in_flight["send"] == 0
+
+def test_flood_wait_longer_than_max_wait_rejects():
+    async def scenario():
+        limiter = SessionLimiter(LIMITS, max_wait=0.05)
+        limiter.backoff(10)
+        async with limiter.admit("send"):
+            pass
+
+    with pytest.raises(RateLimitExceeded):
+        asyncio.run(scenario())
@@ -0,0 +1,120 @@
+import asyncio
+
+import pytest
+
+from idempotency import IdempotencyKeyReused, IdempotencyStore
+
+KEY = ("sessions/a", "send_message", "key-1")
+
+def counting(result):
+    calls = []
+
+    async def work():
+        calls.append(1)
+        return result
+
+    return work, calls
+
+def test_second_run_replays_the_result():
+    async def scenario():
+        store = IdempotencyStore()
+        work, calls = counting({"id": 1})
+        first = await store.run(KEY, "fp", work)
+        second = await store.run(KEY, "fp", work)
+        return first, second, calls
+
+    first, second, calls = asyncio.run(scenario())
+    assert first == ({"id": 1}, False)
+    assert second == ({"id": 1}, True)
+    assert len(calls) == 1
+
+def test_concurrent_runs_share_the_in_flight_request():
+    async def scenario():
+        store = IdempotencyStore()
+        calls = []
+
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return {"id": 1}
+
+        results = await asyncio.gather(store.run(KEY, "fp", work), store.run(KEY, "fp", work))
+        return results, calls
+
+    results, calls = asyncio.run(scenario())
+    assert sorted(replayed for _, replayed in results) == [False, True]
+    assert len(calls) == 1
+
+def test_key_reused_for_another_request():
+    async def scenario():
+        store = IdempotencyStore()
+        work, _ = counting({"id": 1})
+        await store.run(KEY, "fp", work)
+        await store.run(KEY, "other", work)
+
+    with pytest.raises(IdempotencyKeyReused):
+        asyncio.run(scenario())
+
+def test_definitive_errors_are_retried():
+    async def scenario():
+        store = IdempotencyStore()
+        work, calls = counting({"status": "error", "message": "Chat not found", "unconfirmed": False})
+        await store.run(KEY, "fp", work)
+        _, replayed = await store.run(KEY, "fp", work)
+        return replayed, calls
+
+    replayed, calls = asyncio.run(scenario())
+    assert not replayed
+    assert len(calls) == 2
+
+def test_unconfirmed_errors_are_replayed():
+    async def scenario():
+        store = IdempotencyStore()
+        work, calls = counting({"status": "error", "message": "No valid message event received", "unconfirmed": True})
+        await store.run(KEY, "fp", work)
+        _, replayed = await store.run(KEY, "fp", work)
+        return replayed, calls
+
+    replayed, calls = asyncio.run(scenario())
+    assert replayed
+    assert len(calls) == 1
+
+def test_exceptions_are_forgotten():
+    async def scenario():
+        store = IdempotencyStore()
+
+        async def failing():
+            raise RuntimeError("rate limited")
+
+        with pytest.raises(RuntimeError):
+            await store.run(KEY, "fp", failing)
+        work, calls = counting({"id": 1})
+        return await store.run(KEY, "fp", work), calls
+
+    result, calls = asyncio.run(scenario())
+    assert result == ({"id": 1}, False)
+    assert len(calls) == 1
+
+def test_oldest_entries_beyond_the_bound_are_evicted():
+    async def scenario():
+        store = IdempotencyStore(max_entries=2)
+        for i in range(4):
+            work, _ = counting({"id": i})
+            await store.run(("sessions/a", "send_message", f"key-{i}"), "fp", work)
+        return store
+
+    store = asyncio.run(scenario())
+    assert [key[-1] for key in store.entries] == ["key-1", "key-2", "key-3"]
+
+def test_expired_entries_are_evicted():
+    async def scenario():
+        store = IdempotencyStore(ttl=600.0)
+        work, calls = counting({"id": 1})
+        await store.run(KEY, "fp", work)
+        store.entries[KEY]["created"] -= 601.0
+        _, replayed = await store.run(KEY, "fp", work)
+        return replayed, calls
+
+    replayed, calls = asyncio.run(scenario())
+    assert not replayed
+    assert len(calls) == 2
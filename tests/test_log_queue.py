@@ -0,0 +1,48 @@
+import logging
+import random
+
+from log_queue import CategoryFilter
+
+def make_record(name, level=logging.INFO):
+    return logging.LogRecord(name, level, __file__, 1, "message %s", (1,), None)
+
+def passed(log_filter, name, count, level=logging.INFO):
+    return sum(bool(log_filter.filter(make_record(name, level))) for _ in range(count))
+
+def test_unconfigured_loggers_pass():
+    log_filter = CategoryFilter(sample_rates={"td_example.events": 0.0})
+    assert passed(log_filter, "main", 10) == 10
+    assert passed(log_filter, "td_example", 10) == 10
+
+def test_sample_rate_covers_child_loggers():
+    log_filter = CategoryFilter(sample_rates={"td_example.events": 0.0})
+    assert passed(log_filter, "td_example.events", 10) == 0
+    assert passed(log_filter, "td_example.events.files", 10) == 0
+
+def test_sample_rate_keeps_a_fraction(monkeypatch):
+    values = iter([0.05, 0.5, 0.09, 0.95])
+    monkeypatch.setattr(random, "random", lambda: next(values))
+    log_filter = CategoryFilter(sample_rates={"td_example.events": 0.1})
+    assert passed(log_filter, "td_example.events", 4) == 2
+
+def test_warnings_are_never_filtered():
+    log_filter = CategoryFilter(sample_rates={"td_example.events": 0.0}, rate_limits={"td_example.events": 0})
+    assert passed(log_filter, "td_example.events", 5, logging.WARNING) == 5
+    assert passed(log_filter, "td_example.events", 5, logging.ERROR) == 5
+
+def test_rate_limit_reports_suppressed_records_on_the_next_one():
+    log_filter = CategoryFilter(rate_limits={"td_example.queries": 2})
+    assert passed(log_filter, "td_example.queries", 5) == 2
+    # Start a new one second window
+    log_filter._windows["td_example.queries"][0] -= 1.0
+    record = make_record("td_example.queries")
+    assert log_filter.filter(record)
+    assert record.suppressed == 3
+    follow_up = make_record("td_example.queries")
+    assert log_filter.filter(follow_up)
+    assert not hasattr(follow_up, "suppressed")
+
+def test_rate_limits_are_per_category():
+    log_filter = CategoryFilter(rate_limits={"td_example.queries": 1, "td_example.events": 1})
+    assert passed(log_filter, "td_example.queries", 3) == 1
+    assert passed(log_filter, "td_example.events", 3) == 1
@@ -0,0 +1,58 @@
+from responses import ResponseCache, etag_matches
+
+KEY = ("sessions/a", "get_chats", "{}", False, "epoch", 1)
+
+def test_put_then_get_returns_entry_with_strong_etag():
+    cache = ResponseCache()
+    entry = cache.put(KEY, b"body", "application/json")
+    assert cache.get(KEY) is entry
+    assert entry["etag"].startswith('"') and entry["etag"].endswith('"')
+    assert cache.hits == 1
+
+def test_etag_depends_on_body_only():
+    cache = ResponseCache()
+    first = cache.put(KEY, b"body", "application/json")["etag"]
+    assert cache.put(KEY[:-1] + (2,), b"body", "application/json")["etag"] == first
+    assert cache.put(KEY, b"other", "application/json")["etag"] != first
+
+def test_missing_key_counts_a_miss():
+    cache = ResponseCache()
+    assert cache.get(KEY) is None
+    assert cache.misses == 1
+
+def test_expired_entries_are_dropped():
+    cache = ResponseCache(ttl=30.0)
+    entry = cache.put(KEY, b"body", "application/json")
+    entry["created"] -= 31.0
+    assert cache.get(KEY) is None
+    assert KEY not in cache.entries
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResponseCache(max_entries=2)
+    first, second, third = (KEY[:-1] + (seq,) for seq in (1, 2, 3))
+    cache.put(first, b"1", "application/json")
+    cache.put(second, b"2", "application/json")
+    cache.get(first)
+    cache.put(third, b"3", "application/json")
+    assert cache.get(second) is None
+    assert cache.get(first) is not None
+    assert cache.get(third) is not None
+
+def test_invalidate_drops_only_the_session():
+    cache = ResponseCache()
+    other = ("sessions/b",) + KEY[1:]
+    cache.put(KEY, b"a", "application/json")
+    cache.put(other, b"b", "application/json")
+    cache.invalidate("sessions/a")
+    assert cache.get(KEY) is None
+    assert cache.get(other) is not None
+
+def test_etag_matches():
+    etag = '"abc"'
+    assert etag_matches('"abc"', etag)
+    assert etag_matches('"x", "abc"', etag)
+    assert etag_matches("*", etag)
+    assert etag_matches('W/"abc"', etag)
+    assert not etag_matches('"abd"', etag)
+    assert not etag_matches(None, etag)
+    assert not etag_matches("", etag)
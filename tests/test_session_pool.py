@@ -0,0 +1,191 @@
+import asyncio
+import os
+import time
+
+from session_pool import SessionPool, WARM_CACHE_FILE
+
+class FakeClient:
+    """Stands in for TdExample: authenticated, idle unless told otherwise, with a small warm cache."""
+
+    instances = []
+
+    def __init__(self, session_path):
+        self.session_path = session_path
+        self.client_id = len(FakeClient.instances) + 1
+        self.authenticated = True
+        self.busy = False
+        self.closed = False
+        self.drained = 0
+        self.restored = None
+        self.last_activity = time.time()
+        self.cache = {"chats": [1, 2]}
+        os.makedirs(session_path, exist_ok=True)
+        FakeClient.instances.append(self)
+
+    def touch(self):
+        self.last_activity = time.time()
+
+    def is_idle(self):
+        return not self.busy
+
+    def export_warm_cache(self):
+        return self.cache
+
+    def restore_warm_cache(self, data):
+        self.restored = data
+
+    async def check_session(self):
+        return {"is_authenticated": self.authenticated, "auth_state": "authenticated" if self.authenticated else "waitPhoneNumber"}
+
+    async def drain_updates(self):
+        self.drained += 1
+        return 0
+
+    async def close(self, timeout=20.0):
+        await asyncio.sleep(0.01)
+        self.closed = True
+        self.client_id = 0
+
+def make_pool(tmp_path, **kwargs):
+    FakeClient.instances = []
+    pool = SessionPool(FakeClient, **kwargs)
+    paths = [str(tmp_path / name) for name in ("a", "b", "c")]
+    return pool, paths
+
+def test_limit_evicts_least_recently_active_idle_client(tmp_path):
+    async def scenario():
+        pool, (a, b, c) = make_pool(tmp_path, max_live=2)
+        first = pool.create(a)
+        pool.create(b)
+        first.last_activity -= 100
+        pool.create(c)
+        await asyncio.sleep(0.05)
+        return pool, first, a
+
+    pool, first, a = asyncio.run(scenario())
+    assert sorted(os.path.basename(path) for path in pool) == ["b", "c"]
+    assert first.closed
+    assert os.path.exists(os.path.join(a, WARM_CACHE_FILE))
+    assert pool.evictions == 1
+
+def test_limit_keeps_busy_and_pinned_clients(tmp_path):
+    async def scenario():
+        pool, (a, b, c) = make_pool(tmp_path, max_live=1)
+        busy = pool.create(a)
+        busy.busy = True
+        async with pool.use(b, create=True):
+            pool.create(c)
+            await asyncio.sleep(0.05)
+            during = sorted(os.path.basename(path) for path in pool)
+        return pool, during
+
+    pool, during = asyncio.run(scenario())
+    # Only c was idle and unpinned
+    assert during == ["a", "b"]
+    assert pool.report()["pinned"] == 0
+
+def test_evicted_session_is_revived_once_with_its_warm_cache(tmp_path):
+    async def scenario():
+        pool, (a, _, _) = make_pool(tmp_path)
+        pool.create(a)
+        await pool.evict(a)
+        first, second = await asyncio.gather(pool.acquire(a), pool.acquire(a))
+        return pool, first, second
+
+    pool, first, second = asyncio.run(scenario())
+    assert first is second
+    assert first is FakeClient.instances[1]
+    assert first.restored == {"chats": [1, 2]}
+    assert pool.revivals == 1
+    assert pool.report()["reviving"] == 0
+
+def test_unknown_session_is_not_revived(tmp_path):
+    pool, (a, _, _) = make_pool(tmp_path)
+    assert asyncio.run(pool.acquire(a)) is None
+    assert not FakeClient.instances
+
+def test_revival_of_a_logged_out_session_forgets_it(tmp_path):
+    async def scenario():
+        pool, (a, _, _) = make_pool(tmp_path)
+        pool.create(a)
+        await pool.evict(a)
+        original_factory = pool.factory
+
+        def logged_out(session_path):
+            client = original_factory(session_path)
+            client.authenticated = False
+            return client
+
+        pool.factory = logged_out
+        return pool, await pool.acquire(a), a
+
+    pool, client, a = asyncio.run(scenario())
+    assert client is None
+    assert a not in pool
+    assert not os.path.exists(os.path.join(a, WARM_CACHE_FILE))
+    assert FakeClient.instances[1].closed
+
+def test_reopening_waits_for_the_eviction_to_close_the_old_client(tmp_path):
+    async def scenario():
+        pool, (a, _, _) = make_pool(tmp_path)
+        old = pool.create(a)
+        eviction = asyncio.ensure_future(pool.evict(a))
+        await asyncio.sleep(0)
+        assert pool.report()["evicting"] == 1
+        async with pool.use(a) as revived:
+            closed_before_revival = old.closed
+        await eviction
+        return revived, old, closed_before_revival
+
+    revived, old, closed_before_revival = asyncio.run(scenario())
+    assert revived is not old
+    assert closed_before_revival
+
+def test_evict_only_idle_keeps_a_session_pinned_meanwhile(tmp_path):
+    async def scenario():
+        pool, (a, _, _) = make_pool(tmp_path)
+        pool.create(a)
+        async with pool.use(a):
+            evicted = await pool.evict(a, only_idle=True)
+        return pool, evicted, a
+
+    pool, evicted, a = asyncio.run(scenario())
+    assert not evicted
+    assert a in pool
+
+def test_sweep_drains_events_and_evicts_idle_clients(tmp_path):
+    async def scenario():
+        pool, (a, b, _) = make_pool(tmp_path, idle_timeout=0.2)
+        idle = pool.create(a)
+        busy = pool.create(b)
+        busy.busy = True
+        idle.last_activity -= 10
+        busy.last_activity -= 10
+        pool.start()
+        await asyncio.sleep(0.2)
+        await pool.close()
+        return pool, idle, busy
+
+    pool, idle, busy = asyncio.run(scenario())
+    assert idle.closed and idle.drained >= 1
+    # close() evicts every client, busy or not
+    assert busy.closed
+    assert len(pool) == 0
+
+def test_use_touches_the_client(tmp_path):
+    async def scenario():
+        pool, (a, _, _) = make_pool(tmp_path)
+        client = pool.create(a)
+        client.last_activity -= 100
+        async with pool.use(a) as used:
+            return client, used
+
+    client, used = asyncio.run(scenario())
+    assert used is client
+    assert time.time() - client.last_activity < 5
+
+def test_labels_are_opaque_and_stable(tmp_path):
+    pool, (a, b, _) = make_pool(tmp_path)
+    assert pool.label(a) == "session1"
+    assert pool.label(b) == "session2"
+    assert pool.label(a) == "session1"
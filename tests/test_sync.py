@@ -0,0 +1,69 @@
+import asyncio
+
+from sync import UpdateJournal
+
+def test_append_assigns_increasing_seqs():
+    journal = UpdateJournal()
+    assert journal.append({"@type": "updateNewMessage"}) == 1
+    assert journal.append({"@type": "updateChatTitle"}) == 2
+    assert journal.last_seq == 2
+    assert journal.first_seq == 1
+
+def test_since_returns_only_newer_entries():
+    journal = UpdateJournal()
+    for i in range(3):
+        journal.append({"@type": "updateNewMessage", "i": i})
+    result = journal.since(1, journal.epoch)
+    assert not result["resync_required"]
+    assert result["last_seq"] == 3
+    assert [entry["seq"] for entry in result["updates"]] == [2, 3]
+    assert result["updates"][0]["update"]["i"] == 1
+
+def test_since_up_to_date_is_empty():
+    journal = UpdateJournal()
+    journal.append({"@type": "updateNewMessage"})
+    result = journal.since(1)
+    assert not result["resync_required"]
+    assert result["updates"] == []
+
+def test_empty_journal_since_zero():
+    journal = UpdateJournal()
+    assert journal.since(0) == {"resync_required": False, "epoch": journal.epoch, "last_seq": 0, "updates": []}
+
+def test_resync_when_entries_fell_out_of_the_window():
+    journal = UpdateJournal(max_size=2)
+    for _ in range(4):
+        journal.append({"@type": "updateNewMessage"})
+    assert journal.first_seq == 3
+    assert [entry["seq"] for entry in journal.since(2)["updates"]] == [3, 4]
+    result = journal.since(1)
+    assert result["resync_required"]
+    assert result["last_seq"] == 4
+    assert result["updates"] == []
+
+def test_resync_on_other_epoch_or_future_seq():
+    journal = UpdateJournal()
+    journal.append({"@type": "updateNewMessage"})
+    assert journal.since(0, "another-epoch")["resync_required"]
+    assert journal.since(5, journal.epoch)["resync_required"]
+    assert not journal.since(0, None)["resync_required"]
+
+def test_epochs_differ_between_journals():
+    assert UpdateJournal().epoch != UpdateJournal().epoch
+
+def test_wait_returns_immediately_when_newer_entries_exist():
+    journal = UpdateJournal()
+    journal.append({"@type": "updateNewMessage"})
+    assert asyncio.run(journal.wait(0, timeout=0.01))
+
+def test_wait_times_out_without_new_entries():
+    journal = UpdateJournal()
+    assert not asyncio.run(journal.wait(0, timeout=0.01))
+
+def test_wait_wakes_up_on_append():
+    async def scenario():
+        journal = UpdateJournal()
+        asyncio.get_running_loop().call_later(0.01, journal.append, {"@type": "updateNewMessage"})
+        return await journal.wait(0, timeout=5.0)
+
+    assert asyncio.run(scenario())
@@ -0,0 +1,61 @@
+from tdlib_trace import TraceRecorder, read_trace, scrub
+
+SESSION = "0123456789abcdef0123456789abcdef"
+OTHER_SESSION = "fedcba9876543210fedcba9876543210"
+
+def test_credentials_and_contact_details_are_scrubbed():
+    query = {
+        "@type": "setTdlibParameters",
+        "api_id": 12345,
+        "api_hash": "0123abcd",
+        "database_directory": f"sessions/{SESSION}",
+    }
+    scrubbed = scrub(query)
+    assert scrubbed["api_id"] == "<scrubbed>"
+    assert scrubbed["api_hash"] == "<scrubbed>"
+    assert scrubbed["@type"] == "setTdlibParameters"
+    assert SESSION not in scrubbed["database_directory"]
+    assert scrub({"@type": "setAuthenticationPhoneNumber", "phone_number": "+15551234567"})["phone_number"] == "<scrubbed>"
+    assert scrub({"@type": "checkAuthenticationPassword", "password": "hunter2"})["password"] == "<scrubbed>"
+
+def test_login_code_is_scrubbed_but_error_codes_are_kept():
+    assert scrub({"@type": "checkAuthenticationCode", "code": "12345"})["code"] == "<scrubbed>"
+    error = {"@type": "error", "code": 429, "message": "Too Many Requests: retry after 5"}
+    assert scrub(error) == error
+
+def test_missing_values_stay_missing():
+    assert scrub({"@type": "chat", "title": None})["title"] is None
+
+def test_text_is_replaced_by_a_placeholder_of_the_same_length():
+    message = {"@type": "message", "content": {"@type": "messageText", "text": {"@type": "formattedText", "text": "hello"}}}
+    assert scrub(message)["content"]["text"]["text"] == "xxxxx"
+
+def test_phone_numbers_in_free_strings_are_replaced():
+    assert scrub({"@type": "error", "message": "user +15551234567 not found"})["message"] == "user <phone> not found"
+
+def test_nested_lists_are_scrubbed():
+    chats = {"@type": "chats", "chats": [{"@type": "chat", "title": "Alice"}, {"@type": "chat", "title": "Bob"}]}
+    assert [chat["title"] for chat in scrub(chats)["chats"]] == ["<scrubbed>", "<scrubbed>"]
+
+def test_session_directories_get_consistent_pseudonyms():
+    pseudonyms = {}
+    first = scrub({"path": f"sessions/{SESSION}/voice/a.ogg"}, pseudonyms=pseudonyms)["path"]
+    other = scrub({"path": f"sessions/{OTHER_SESSION}/voice/b.ogg"}, pseudonyms=pseudonyms)["path"]
+    again = scrub({"path": f"sessions/{SESSION}/profile_photos/c.jpg"}, pseudonyms=pseudonyms)["path"]
+    assert first == "sessions/session1/voice/a.ogg"
+    assert other == "sessions/session2/voice/b.ogg"
+    assert again == "sessions/session1/profile_photos/c.jpg"
+
+def test_session_directories_without_a_pseudonym_map():
+    assert scrub({"path": f"sessions/{SESSION}/td.binlog"})["path"] == "sessions/session/td.binlog"
+
+def test_recorded_trace_reads_back_scrubbed(tmp_path):
+    recorder = TraceRecorder(str(tmp_path / "trace.jsonl.gz"))
+    recorder.record("send", 1, {"@type": "checkAuthenticationCode", "code": "12345", "@extra": "1:1"})
+    recorder.record("recv", 1, {"@type": "error", "code": 400, "message": "PHONE_CODE_INVALID", "@extra": "1:1"})
+    recorder.close()
+    records = list(read_trace(recorder.path))
+    assert [record["dir"] for record in records] == ["send", "recv"]
+    assert records[0]["data"]["code"] == "<scrubbed>"
+    assert records[1]["data"]["code"] == 400
+    assert records[1]["t"] >= records[0]["t"]
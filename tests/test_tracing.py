@@ -0,0 +1,90 @@
+import tracing
+from tracing import OtlpHttpSpanExporter, Tracer, format_span_tree, span, start_span
+
+TRACEPARENT = "00-" + "a" * 32 + "-" + "b" * 16 + "-01"
+
+def traced_request(traceparent=None):
+    """Record a root span with a nested child and a sibling, as a request would."""
+    root = Tracer(slow_threshold=None).start_trace("GET /get_chats", traceparent, method="GET")
+    token = tracing._current_span.set(root)
+    try:
+        with span("get_chats"):
+            with span("tdlib getChats", chat_count=2):
+                pass
+        with span("encode"):
+            pass
+    finally:
+        tracing._current_span.reset(token)
+    root.end()
+    return root
+
+def test_span_tree_nests_children_under_their_parents():
+    lines = format_span_tree(traced_request().trace).splitlines()
+    assert [line.split()[1] for line in lines] == ["GET", "get_chats", "tdlib", "encode"]
+    assert lines[0].startswith("+0.0ms GET /get_chats")
+    assert lines[1].startswith("  +")
+    assert lines[2].startswith("    +") and lines[2].endswith("chat_count=2")
+    assert lines[3].startswith("  +")
+
+def test_span_tree_of_a_continued_trace_starts_at_the_root():
+    root = traced_request(TRACEPARENT)
+    assert root.trace.trace_id == "a" * 32
+    assert root.parent_id == "b" * 16
+    lines = format_span_tree(root.trace).splitlines()
+    assert len(lines) == 4
+    assert lines[0].startswith("+0.0ms GET /get_chats")
+
+def test_span_tree_reports_unfinished_and_dropped_spans():
+    root = Tracer(slow_threshold=None, max_spans=2).start_trace("GET /x")
+    token = tracing._current_span.set(root)
+    try:
+        pending = start_span("tdlib getChats")
+        assert start_span("tdlib getChat") is None
+    finally:
+        tracing._current_span.reset(token)
+    assert pending is not None
+    lines = format_span_tree(root.trace).splitlines()
+    assert "unfinished" in lines[1]
+    assert lines[-1] == "(1 spans dropped)"
+
+def test_invalid_traceparent_starts_a_new_trace():
+    root = Tracer().start_trace("GET /x", "garbage")
+    assert root.parent_id is None
+    assert len(root.trace.trace_id) == 32
+
+def test_spans_outside_a_request_record_nothing():
+    assert start_span("tdlib getChats") is None
+    with span("encode") as child:
+        assert child is None
+
+def test_spans_of_a_finished_trace_record_nothing():
+    root = traced_request()
+    Tracer(slow_threshold=None).finish(root)
+    token = tracing._current_span.set(root)
+    try:
+        assert start_span("late") is None
+    finally:
+        tracing._current_span.reset(token)
+
+def test_finish_exports_to_every_exporter():
+    exported = []
+
+    class Exporter:
+        def export(self, trace):
+            exported.append(trace)
+
+    tracer = Tracer(exporters=[Exporter(), Exporter()], slow_threshold=None)
+    root = tracer.start_trace("GET /x")
+    tracer.finish(root)
+    assert exported == [root.trace, root.trace]
+    assert root.trace.finished
+
+def test_otlp_root_span_is_server_even_with_a_remote_parent():
+    root = traced_request(TRACEPARENT)
+    exporter = OtlpHttpSpanExporter("http://localhost:4318/v1/traces")
+    try:
+        kinds = [exporter._otlp_span(item)["kind"] for item in root.trace.spans]
+    finally:
+        exporter.executor.shutdown()
+    assert kinds == [2, 1, 1, 1]
+    assert exporter._otlp_span(root)["parentSpanId"] == "b" * 16
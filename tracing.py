@@ -0,0 +1,234 @@
+import functools
+import json
+import logging
+import os
+import re
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+TRACEPARENT_PATTERN = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+class Trace:
+    """The spans recorded for one HTTP request."""
+
+    def __init__(self, trace_id: Optional[str] = None, max_spans: int = 1000):
+        self.trace_id = trace_id or os.urandom(16).hex()
+        self.max_spans = max_spans
+        self.spans: List["Span"] = []
+        self.dropped = 0
+        self.finished = False
+
+class Span:
+    """A timed stage of a request; ended spans carry their duration in seconds."""
+
+    __slots__ = ("trace", "span_id", "parent_id", "name", "start", "start_wall", "duration", "attributes")
+
+    def __init__(self, trace: Trace, name: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.trace = trace
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.start = time.perf_counter()
+        self.start_wall = time.time()
+        self.duration: Optional[float] = None
+        self.attributes = attributes
+
+    def end(self, **attributes: Any) -> None:
+        if self.duration is None:
+            self.duration = time.perf_counter() - self.start
+            self.attributes.update(attributes)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start_wall,
+            "duration_ms": self.duration * 1000 if self.duration is not None else None,
+            "attributes": self.attributes
+        }
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+def start_span(name: str, **attributes: Any) -> Optional[Span]:
+    """Start a child of the current span, for stages that end elsewhere (e.g. a TDLib response).
+
+    Outside a traced request, or once its trace has been exported, this returns None and records nothing.
+    """
+    parent = _current_span.get()
+    if parent is None or parent.trace.finished:
+        return None
+    trace = parent.trace
+    if len(trace.spans) >= trace.max_spans:
+        trace.dropped += 1
+        return None
+    span = Span(trace, name, parent.span_id, attributes)
+    trace.spans.append(span)
+    return span
+
+@contextmanager
+def span(name: str, **attributes: Any):
+    """Record the enclosed block as a child span of the current one, and make it current."""
+    child = start_span(name, **attributes)
+    if child is None:
+        yield None
+        return
+    token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.attributes["error"] = type(e).__name__
+        raise
+    finally:
+        _current_span.reset(token)
+        child.end()
+
+def traced(name: str):
+    """Decorator recording every call of a coroutine function as a span."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with span(name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def format_span_tree(trace: Trace) -> str:
+    """Render a trace as an indented tree of spans with their offsets and durations in ms."""
+    children: Dict[Optional[str], List[Span]] = {}
+    for item in trace.spans:
+        children.setdefault(item.parent_id, []).append(item)
+    root_start = trace.spans[0].start if trace.spans else 0.0
+    lines = []
+
+    def walk(item: Span, depth: int) -> None:
+        duration = f"{item.duration * 1000:.1f}ms" if item.duration is not None else "unfinished"
+        attributes = " ".join(f"{key}={value}" for key, value in item.attributes.items())
+        lines.append(f"{'  ' * depth}+{(item.start - root_start) * 1000:.1f}ms {item.name} {duration} {attributes}".rstrip())
+        for child in sorted(children.get(item.span_id, []), key=lambda s: s.start):
+            walk(child, depth + 1)
+
+    # The root span's parent may be the remote caller's span (from traceparent), so start from the root itself
+    if trace.spans:
+        walk(trace.spans[0], 0)
+    if trace.dropped:
+        lines.append(f"({trace.dropped} spans dropped)")
+    return "\n".join(lines)
+
+class JsonlSpanExporter:
+    """Appends every span as one JSON line to a local file."""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.file = open(path, "a", encoding="utf-8", buffering=1)
+
+    def export(self, trace: Trace) -> None:
+        self.file.write("".join(json.dumps(item.to_dict(), ensure_ascii=False, default=str) + "\n" for item in trace.spans))
+
+class OtlpHttpSpanExporter:
+    """Posts traces as OTLP/HTTP JSON (e.g. to a collector's /v1/traces) from a background thread."""
+
+    def __init__(self, endpoint: str, service_name: str = "telegram-backend"):
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="otlp-export")
+
+    def _otlp_span(self, item: Span) -> Dict[str, Any]:
+        start_ns = int(item.start_wall * 1e9)
+        return {
+            "traceId": item.trace.trace_id,
+            "spanId": item.span_id,
+            "parentSpanId": item.parent_id or "",
+            "name": item.name,
+            # The request's root span is SERVER even when it continues a caller's trace and so has a parent
+            "kind": 2 if item is item.trace.spans[0] else 1,
+            "startTimeUnixNano": str(start_ns),
+            "endTimeUnixNano": str(start_ns + int((item.duration or 0.0) * 1e9)),
+            "attributes": [{"key": key, "value": {"stringValue": str(value)}} for key, value in item.attributes.items()]
+        }
+
+    def _post(self, body: bytes) -> None:
+        request = urllib.request.Request(self.endpoint, data=body, headers={"Content-Type": "application/json"})
+        try:
+            urllib.request.urlopen(request, timeout=5).close()
+        except Exception as e:
+            logger.warning("Failed to export trace to %s: %s", self.endpoint, e)
+
+    def export(self, trace: Trace) -> None:
+        body = {
+            "resourceSpans": [{
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]},
+                "scopeSpans": [{"scope": {"name": __name__}, "spans": [self._otlp_span(item) for item in trace.spans]}]
+            }]
+        }
+        self.executor.submit(self._post, json.dumps(body).encode("utf-8"))
+
+class Tracer:
+    """Starts a trace per request, exports finished traces and logs the span tree of slow ones."""
+
+    def __init__(self, exporters: Optional[List[Any]] = None, slow_threshold: Optional[float] = 5.0, max_spans: int = 1000):
+        self.exporters = exporters or []
+        self.slow_threshold = slow_threshold
+        self.max_spans = max_spans
+
+    def start_trace(self, name: str, traceparent: Optional[str] = None, **attributes: Any) -> Span:
+        """Create the root span of a new trace, continuing the caller's trace id from a W3C traceparent."""
+        match = TRACEPARENT_PATTERN.match(traceparent or "")
+        trace = Trace(match.group(1) if match else None, max_spans=self.max_spans)
+        root = Span(trace, name, match.group(2) if match else None, attributes)
+        trace.spans.append(root)
+        return root
+
+    def finish(self, root: Span) -> None:
+        root.end()
+        trace = root.trace
+        trace.finished = True
+        for exporter in self.exporters:
+            try:
+                exporter.export(trace)
+            except Exception as e:
+                logger.warning("Span exporter %s failed: %s", type(exporter).__name__, e)
+        if self.slow_threshold is not None and root.duration >= self.slow_threshold:
+            logger.warning("Slow request %s took %.2fs (trace %s):\n%s", root.name, root.duration, trace.trace_id, format_span_tree(trace))
+
+class TracingMiddleware:
+    """ASGI middleware opening a trace per HTTP request and returning its id in a traceparent header."""
+
+    def __init__(self, app, tracer: Tracer):
+        self.app = app
+        self.tracer = tracer
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        traceparent = None
+        for name, value in scope.get("headers", []):
+            if name == b"traceparent":
+                traceparent = value.decode("latin-1")
+                break
+        root = self.tracer.start_trace(f"{scope['method']} {scope['path']}", traceparent, method=scope["method"])
+        header = f"00-{root.trace.trace_id}-{root.span_id}-01".encode("latin-1")
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                root.attributes["status"] = message["status"]
+                message = {**message, "headers": list(message.get("headers", [])) + [(b"traceparent", header)]}
+            await send(message)
+
+        token = _current_span.set(root)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_span.reset(token)
+            route = scope.get("route")
+            if route is not None:
+                root.name = f"{scope['method']} {route.path}"
+            self.tracer.finish(root)
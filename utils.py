@@ -16,10 +16,10 @@ def generate_waveform(file_path: str, num_samples: int = 60, trim_ms: int = 100)
         step = max(1, len(samples) // num_samples)
         waveform = [float(np.max(np.abs(samples[i:i + step]))) for i in range(0, len(samples), step)]
         waveform = waveform[:num_samples] + [0.0] * (num_samples - len(waveform))
-        logger.info(f"Generated waveform with {len(waveform)} samples after trimming {trim_ms}ms")
+        logger.info("Generated waveform with %s samples after trimming %sms", len(waveform), trim_ms)
         return waveform
     except Exception as e:
-        logger.error(f"Failed to generate waveform for {file_path}: {e}")
+        logger.error("Failed to generate waveform for %s: %s", file_path, e)
         return []
 
 def convert_oga_to_wav(oga_path: str, wav_path: str, reverse: bool = False) -> None:
@@ -28,7 +28,7 @@ def convert_oga_to_wav(oga_path: str, wav_path: str, reverse: bool = False) -> N
         audio = AudioSegment.from_file(oga_path, format="ogg" if not reverse else "wav")
         audio = audio.set_channels(1).set_sample_width(2).set_frame_rate(16000)
         audio.export(wav_path, format="wav" if not reverse else "ogg", codec="libopus" if reverse else None, bitrate="32k" if reverse else None)
-        logger.info(f"Converted {oga_path} to {wav_path}")
+        logger.info("Converted %s to %s", oga_path, wav_path)
     except Exception as e:
-        logger.error(f"Failed to convert {oga_path} to {'WAV' if not reverse else 'OGG'}: {e}")
+        logger.error("Failed to convert %s to %s: %s", oga_path, 'WAV' if not reverse else 'OGG', e)
         raise
\ No newline at end of file
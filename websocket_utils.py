@@ -1,5 +1,5 @@
 from typing import Dict, List
-from fastapi import WebSocket
+from fastapi import WebSocket, WebSocketDisconnect
 import json
 import logging
 
@@ -9,18 +9,26 @@ logger = logging.getLogger(__name__)
 clients: Dict[str, 'TdExample'] = {}  # Map phone_number to TdExample instance
 websocket_connections: Dict[str, List[WebSocket]] = {}  # Map phone_number to list of WebSocket connections
 
+async def wait_for_disconnect(websocket: WebSocket) -> None:
+    """Read (and ignore) what the peer sends until it disconnects, so a connection that went away is noticed
+    even while nothing is being written to it."""
+    while True:
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            return
+
 async def broadcast_message(phone_number: str, message: dict):
     """Broadcast message to all connected WebSocket clients for a phone number."""
     if phone_number in websocket_connections:
         for ws in websocket_connections[phone_number][:]:
             try:
                 await ws.send_json(message)
-                logger.info(f"Broadcasted message to WebSocket for {phone_number}")
+                logger.info("Broadcasted message to WebSocket for %s", phone_number)
             except WebSocketDisconnect:
                 websocket_connections[phone_number].remove(ws)
-                logger.info(f"Removed disconnected WebSocket for {phone_number}")
+                logger.info("Removed disconnected WebSocket for %s", phone_number)
             except Exception as e:
-                logger.error(f"Error broadcasting to WebSocket for {phone_number}: {e}")
+                logger.error("Error broadcasting to WebSocket for %s: %s", phone_number, e)
                 websocket_connections[phone_number].remove(ws)
                 if not websocket_connections[phone_number]:
                     del websocket_connections[phone_number]
\ No newline at end of file